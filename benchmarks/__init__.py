@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Build benchmarks for Blogofile.
+
+Generates synthetic sites of a configurable size and times building
+them with the Blogofile in this source tree:
+
+    python -m benchmarks --pages 2000 --static 500 --output results.json
+
+Each run records, as JSON:
+
+  full          - a full build (`blogofile build`)
+  incremental   - a first incremental build, with no manifest yet
+  noop          - an incremental rebuild with nothing changed
+  single_change - an incremental rebuild after changing one page
+
+Pass the JSON of an earlier run with --compare to see how the times
+changed. See `python -m benchmarks --help` for the site parameters.
+
+The startup time of each sub-command, as measured by
+`python -X importtime`, is benchmarked separately:
+
+    python -m benchmarks.startup --output startup.json
+"""
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""Time builds of a synthetic site.
+
+Each build runs `blogofile build` in a fresh Python process (using the
+Blogofile this package sits next to), so the times include interpreter
+startup and nothing is cached in memory between builds.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from . import sitegen
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BLOGOFILE = ("import sys; from blogofile.main import main; "
+             "main(['blogofile'] + sys.argv[1:])")
+SCENARIOS = ("full", "incremental", "noop", "single_change")
+
+
+def build(site_dir, *args):
+    """Run `blogofile build args` in site_dir, and return how long it
+    took, in seconds.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get("PYTHONPATH")] if p])
+    start = time.perf_counter()
+    subprocess.check_call(
+        [sys.executable, "-c", BLOGOFILE, "build"] + list(args),
+        cwd=site_dir, env=env)
+    return time.perf_counter() - start
+
+
+def clean(site_dir):
+    """Delete the output and the caches of previous builds.
+    """
+    for name in os.listdir(site_dir):
+        if name.startswith("_site") or name == "_bf_cache":
+            path = os.path.join(site_dir, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+
+def touch_page(site_dir, page, run):
+    """Change the content of page, differently for each run.
+    """
+    path = os.path.join(site_dir, page)
+    with open(path) as f:
+        src = f.read()
+    marker = "\n<!-- benchmark change -->"
+    src = src.split(marker)[0]
+    with open(path, "w") as f:
+        f.write(src + marker + " {0}\n".format(run))
+
+
+def run_benchmarks(site_dir, pages, repeat=3, build_args=()):
+    """Time each scenario repeat times.
+
+    Returns {scenario: [seconds, ...]}.
+    """
+    times = dict((scenario, []) for scenario in SCENARIOS)
+    for run in range(repeat):
+        clean(site_dir)
+        times["full"].append(build(site_dir, *build_args))
+        clean(site_dir)
+        times["incremental"].append(
+            build(site_dir, "--incremental", *build_args))
+        times["noop"].append(build(site_dir, "--incremental", *build_args))
+        touch_page(site_dir, pages[len(pages) // 2], run)
+        times["single_change"].append(
+            build(site_dir, "--incremental", *build_args))
+    return times
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def results(params, times):
+    """Return the machine readable results of a benchmark run.
+    """
+    sys.path.insert(0, ROOT)
+    try:
+        from blogofile import __version__
+    finally:
+        sys.path.pop(0)
+    return {
+        "blogofile_version": __version__,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "params": params,
+        "results": dict(
+            (scenario, {"runs": runs, "min": min(runs),
+                        "median": _median(runs)})
+            for scenario, runs in times.items()),
+    }
+
+
+def compare(current, previous):
+    """Return report lines comparing the median times of two results.
+    """
+    lines = []
+    for scenario in SCENARIOS:
+        try:
+            before = previous["results"][scenario]["median"]
+        except KeyError:
+            continue
+        after = current["results"][scenario]["median"]
+        lines.append("{0:<14} {1:>9.3f}s -> {2:>9.3f}s  ({3:+.1f}%)".format(
+            scenario, before, after, (after - before) / before * 100))
+    if previous.get("params") != current["params"]:
+        lines.append("Warning: the runs used different parameters")
+    return lines
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Time Blogofile builds of a synthetic site.")
+    parser.add_argument("--pages", type=int, default=300,
+                        help="number of pages (default: %(default)s)")
+    parser.add_argument("--static", type=int, default=100,
+                        help="number of static files (default: %(default)s)")
+    parser.add_argument("--static-size", type=int, default=16384,
+                        help="size of each static file in bytes "
+                        "(default: %(default)s)")
+    parser.add_argument("--depth", type=int, default=4,
+                        help="depth of the _templates inheritance chain "
+                        "(default: %(default)s)")
+    parser.add_argument("--paragraphs", type=int, default=5,
+                        help="paragraphs per page (default: %(default)s)")
+    parser.add_argument("--engines", default=",".join(sitegen.ENGINES),
+                        help="comma separated template engines of the "
+                        "pages (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="times to run each scenario "
+                        "(default: %(default)s)")
+    parser.add_argument("--build-args", default="",
+                        help="extra arguments for `blogofile build`, "
+                        "eg. \"--jobs 4\"")
+    parser.add_argument("--site-dir",
+                        help="generate the site here and keep it "
+                        "(default: a temporary directory)")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write the results to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare with the JSON results in FILE")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    params = {
+        "pages": args.pages,
+        "static": args.static,
+        "static_size": args.static_size,
+        "depth": args.depth,
+        "paragraphs": args.paragraphs,
+        "engines": args.engines.split(","),
+        "seed": args.seed,
+        "build_args": args.build_args.split(),
+    }
+    tmp_dir = None
+    if args.site_dir:
+        site_dir = args.site_dir
+    else:
+        tmp_dir = tempfile.mkdtemp(prefix="blogofile_bench_")
+        site_dir = os.path.join(tmp_dir, "site")
+    try:
+        print("Generating site in {0}".format(site_dir), file=sys.stderr)
+        pages = sitegen.generate_site(
+            site_dir, pages=args.pages, static=args.static,
+            static_size=args.static_size, depth=args.depth,
+            paragraphs=args.paragraphs, engines=params["engines"],
+            seed=args.seed)
+        times = run_benchmarks(site_dir, pages, args.repeat,
+                               params["build_args"])
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir)
+    current = results(params, times)
+    for scenario in SCENARIOS:
+        result = current["results"][scenario]
+        print("{0:<14} median {1:>9.3f}s  min {2:>9.3f}s".format(
+            scenario, result["median"], result["min"]))
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print("\n".join(["", "Compared with {0}:".format(args.compare)] +
+                        compare(current, previous)))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    return current
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Generate synthetic Blogofile sites for benchmarking.
+
+A generated site has:
+
+  - pages spread over Mako, Jinja2 and Markdown templates, in
+    directories of at most 100 files
+  - static files of a given size
+  - a chain of _templates, each inheriting from the previous one,
+    ending in the site base template
+  - the base template in Mako, so that the Jinja2 and Markdown pages
+    exercise the mixed engine base template conversion
+
+Everything is derived from a seed, so the same parameters always give
+the same site.
+"""
+import os
+import random
+
+
+ENGINES = ("mako", "jinja2", "markdown")
+FILES_PER_DIR = 100
+
+CONFIG = """\
+site.url = "http://www.example.com"
+site.base_template = "site.mako"
+"""
+
+#A stand-in for the Markdown filter, which lives in plugins, so that
+#the benchmark doesn't depend on them:
+MARKDOWN_FILTER = '''\
+import re
+
+config = {"name": "Markdown", "description": "Benchmark markdown filter"}
+
+try:
+    import markdown
+except ImportError:
+    markdown = None
+
+
+def run(content):
+    if markdown is not None:
+        return markdown.markdown(content)
+    paragraphs = re.split(r"\\n\\s*\\n", content.strip())
+    return "\\n".join("<p>{0}</p>".format(p) for p in paragraphs)
+'''
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do "
+         "eiusmod tempor incididunt ut labore et dolore magna aliqua").split()
+
+
+def _paragraphs(rng, count):
+    return ["{0}.".format(" ".join(rng.choice(WORDS)
+                                   for i in range(rng.randint(20, 60))))
+            for p in range(count)]
+
+
+def _write(path, content):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def _base_templates(depth):
+    """Return {file name: source} for the _templates inheritance chain.
+    """
+    templates = {"layout0.mako": (
+        "<!DOCTYPE html>\n<html><head><title>Benchmark</title></head>\n"
+        "<body>${next.body()}</body></html>\n")}
+    for level in range(1, depth):
+        templates["layout{0}.mako".format(level)] = (
+            '<%inherit file="layout{0}.mako"/>\n'
+            '<div class="level{1}">${{next.body()}}</div>\n'
+            .format(level - 1, level))
+    templates["site.mako"] = (
+        '<%inherit file="layout{0}.mako"/>\n'
+        '<%include file="nav.mako"/>\n'
+        '<div id="content">${{next.body()}}</div>\n'.format(depth - 1))
+    templates["nav.mako"] = "<nav>Benchmark site</nav>\n"
+    return templates
+
+
+def _page(engine, number, paragraphs):
+    title = "Page {0}".format(number)
+    if engine == "mako":
+        body = "\n".join("<p>{0}</p>".format(p) for p in paragraphs)
+        return ('<%inherit file="/site.mako"/>\n<h1>{0}</h1>\n{1}\n'
+                .format(title, body))
+    if engine == "jinja2":
+        body = "\n".join("<p>{0}</p>".format(p) for p in paragraphs)
+        return ('{{% extends "bf_base_template" %}}\n'
+                '{{% block content %}}<h1>{0}</h1>\n{1}\n'
+                '{{% endblock %}}\n'.format(title, body))
+    return "# {0}\n\n{1}\n".format(title, "\n\n".join(paragraphs))
+
+
+def page_path(number, engine):
+    """Return the source path of page number, relative to the site.
+    """
+    return os.path.join("pages{0:04d}".format(number // FILES_PER_DIR),
+                        "page{0:05d}.html.{1}".format(number, engine))
+
+
+def generate_site(path, pages=100, static=50, static_size=16384,
+                  depth=4, paragraphs=5, engines=ENGINES, seed=0):
+    """Generate a site in the directory path (which must not exist.)
+
+    Returns the source paths of the pages, relative to path.
+    """
+    rng = random.Random(seed)
+    os.makedirs(path)
+    _write(os.path.join(path, "_config.py"), CONFIG)
+    _write(os.path.join(path, "_filters", "markdown.py"), MARKDOWN_FILTER)
+    for name, src in _base_templates(max(1, depth)).items():
+        _write(os.path.join(path, "_templates", name), src)
+    page_paths = []
+    for number in range(pages):
+        engine = engines[number % len(engines)]
+        page_paths.append(page_path(number, engine))
+        _write(os.path.join(path, page_paths[-1]),
+               _page(engine, number, _paragraphs(rng, paragraphs)))
+    for number in range(static):
+        static_path = os.path.join(
+            path, "static", "dir{0:03d}".format(number // FILES_PER_DIR),
+            "file{0:05d}.bin".format(number))
+        directory = os.path.dirname(static_path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(static_path, "wb") as f:
+            f.write(rng.getrandbits(8 * static_size).to_bytes(
+                static_size, "little"))
+    return page_paths
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Time the startup of Blogofile's sub-commands.
+
+Each command runs in a fresh Python process with `-X importtime`, in a
+bare site made by `blogofile init`:
+
+    python -m benchmarks.startup --output startup.json
+
+For each command this records, as JSON, the wall time of the run, the
+total time spent importing modules and how many modules were imported,
+along with the modules that took longest. Pass the JSON of an earlier
+run with --compare to see what changed.
+"""
+from __future__ import print_function
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from .run import BLOGOFILE, ROOT, _median, results
+
+
+#name -> arguments of the commands to time:
+COMMANDS = (
+    ("help", ["--help"]),
+    ("info", ["info"]),
+    ("plugins_list", ["plugins", "list"]),
+    ("filters_list", ["filters", "list"]),
+    ("build_help", ["build", "--help"]),
+    ("build", ["build"]),
+    ("serve_help", ["serve", "--help"]),
+)
+
+
+def _env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get("PYTHONPATH")] if p])
+    return env
+
+
+def parse_importtime(stderr):
+    """Return {module: (self, cumulative)} in microseconds, from the
+    `-X importtime` output in stderr.
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        try:
+            self_us, cumulative_us = int(fields[0]), int(fields[1])
+        except (IndexError, ValueError):
+            # The header line
+            continue
+        modules[fields[2].strip()] = (self_us, cumulative_us)
+    return modules
+
+
+def run_command(site_dir, args):
+    """Run `blogofile args` in site_dir.
+
+    Returns the wall time in seconds and the imported modules (see
+    parse_importtime).
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-X", "importtime", "-c", BLOGOFILE] + list(args),
+        cwd=site_dir, env=_env(), stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, universal_newlines=True)
+    stdout, stderr = process.communicate()
+    elapsed = time.perf_counter() - start
+    if process.returncode:
+        raise subprocess.CalledProcessError(
+            process.returncode, " ".join(["blogofile"] + list(args)),
+            stderr)
+    return elapsed, parse_importtime(stderr)
+
+
+def run_benchmarks(site_dir, repeat=5, top=10):
+    """Time each command repeat times.
+
+    Returns {command: {"wall": [seconds, ...], "imports": [seconds, ...],
+    "modules": count, "slowest": [[module, seconds], ...]}}, the
+    slowest modules being the top ones with the longest self time.
+    """
+    times = {}
+    for name, args in COMMANDS:
+        wall, imports = [], []
+        for run in range(repeat):
+            elapsed, modules = run_command(site_dir, args)
+            wall.append(elapsed)
+            imports.append(
+                sum(s for s, c in modules.values()) / 1000000.0)
+        slowest = sorted(modules.items(), key=lambda m: -m[1][0])[:top]
+        times[name] = {
+            "wall": wall,
+            "imports": imports,
+            "modules": len(modules),
+            "slowest": [[module, s / 1000000.0]
+                        for module, (s, c) in slowest],
+        }
+    return times
+
+
+def startup_results(params, times):
+    """Return the machine readable results of a benchmark run.
+    """
+    current = results(params, {})
+    current["results"] = dict(
+        (name, {"wall_median": _median(t["wall"]),
+                "imports_median": _median(t["imports"]),
+                "modules": t["modules"],
+                "slowest": t["slowest"],
+                "runs": {"wall": t["wall"], "imports": t["imports"]}})
+        for name, t in times.items())
+    return current
+
+
+def compare(current, previous):
+    """Return report lines comparing the median import times of two
+    results.
+    """
+    lines = []
+    for name, args in COMMANDS:
+        try:
+            before = previous["results"][name]
+        except KeyError:
+            continue
+        after = current["results"][name]
+        lines.append(
+            "{0:<14} {1:>7.1f}ms -> {2:>7.1f}ms  ({3:+.1f}%)  "
+            "{4} -> {5} modules".format(
+                name, before["imports_median"] * 1000,
+                after["imports_median"] * 1000,
+                (after["imports_median"] - before["imports_median"]) /
+                before["imports_median"] * 100,
+                before["modules"], after["modules"]))
+    return lines
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks.startup",
+        description="Time the startup of Blogofile's sub-commands.")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="times to run each command "
+                        "(default: %(default)s)")
+    parser.add_argument("--top", type=int, default=10,
+                        help="number of slowest imports to record "
+                        "(default: %(default)s)")
+    parser.add_argument("--output", metavar="FILE",
+                        help="write the results to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="compare with the JSON results in FILE")
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    params = {"repeat": args.repeat, "commands": dict(COMMANDS)}
+    tmp_dir = tempfile.mkdtemp(prefix="blogofile_bench_")
+    try:
+        site_dir = os.path.join(tmp_dir, "site")
+        subprocess.check_call(
+            [sys.executable, "-c", BLOGOFILE, "init", site_dir],
+            env=_env(), stdout=subprocess.PIPE)
+        # Once, so plugin discovery is cached as it normally is:
+        run_command(site_dir, ["--help"])
+        times = run_benchmarks(site_dir, args.repeat, args.top)
+    finally:
+        shutil.rmtree(tmp_dir)
+    current = startup_results(params, times)
+    for name, args_ in COMMANDS:
+        result = current["results"][name]
+        print("{0:<14} wall {1:>7.1f}ms  imports {2:>7.1f}ms  "
+              "{3:>4} modules".format(
+                  name, result["wall_median"] * 1000,
+                  result["imports_median"] * 1000, result["modules"]))
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print("\n".join(["", "Compared with {0}:".format(args.compare)] +
+                        compare(current, previous)))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    return current
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""The ways a build can treat the output directory.
+
+These are kept apart from writer.py, which imports the template
+engines, so the command line parser can offer them as choices without
+importing the whole build.
+"""
+
+#Ways of publishing a staged build:
+# rename     - rename the staging directory to the output directory
+# symlink    - make the output directory a symlink to the staging
+#              directory, and atomically flip it on each build
+# keep_inode - move the staged files into the existing output
+#              directory, so it retains its inode
+STAGED_MODES = ("rename", "symlink", "keep_inode")
+#What happens to the previous contents of the output directory:
+# clean - everything is deleted before the build
+# sync  - unchanged static files are kept, and only the files this
+#         build doesn't write are deleted after it
+OUTPUT_MODES = ("clean", "sync")
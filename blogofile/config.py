@@ -9,9 +9,12 @@ import os
 import logging
 import sys
 import re
+import types
 from . import cache
 from . import controller
+from . import lazymodule
 from . import plugin
+from . import util
 from . import filter as _filter
 from .cache import HierarchicalCache as HC
 # TODO: This import MUST come after cache is imported; that's too brittle!
@@ -31,6 +34,11 @@ templates = cache.HierarchicalCache()
 default_config_path = os.path.join(
     os.path.dirname(__file__), "default_config.py")
 
+#Code objects of the config files, by path: path -> (source, code)
+_compiled_configs = {}
+#The config as it was right after it was last loaded:
+_snapshot = None
+
 
 def init_interactive(args=None):
     """Reset the blogofile cache objects, and load the configuration.
@@ -66,21 +74,152 @@ def _load_config(user_config_path):
     This establishes sane defaults that the user can override as they
     wish.
 
-    config is exec-ed from Python modules into locals(), then updated
+    config is exec-ed from Python modules into a namespace, then updated
     into globals().
+
+    When none of the files the config came from have changed since it
+    was last loaded, the config is restored from a snapshot of it
+    instead (see ConfigSnapshot.)
     """
-    with open(default_config_path) as f:
-        exec(f.read())
+    global _snapshot
+    fingerprint = _config_fingerprint(user_config_path)
+    if fingerprint is not None and _snapshot is not None and \
+            _snapshot.fingerprint == fingerprint:
+        logger.debug("Config unchanged, restoring it")
+        globals().update(_snapshot.restore())
+        _filter.invalidate_chains()
+        return
+    _snapshot = None
+    namespace = {}
+    exec(_compile_config(default_config_path), globals(), namespace)
     plugin.load_plugins()
     _filter.preload_filters()
     controller.load_controllers(namespace=bf.config.controllers)
-    try:
-        with open(user_config_path) as f:
-            exec(f.read())
-    except IOError:
-        raise
+    exec(_compile_config(user_config_path), globals(), namespace)
     _compile_file_ignore_patterns()
-    globals().update(locals())
+    globals().update(namespace)
+    if fingerprint is not None:
+        _snapshot = ConfigSnapshot(
+            fingerprint, [bf, site, controllers, filters, plugins, templates],
+            namespace)
+
+
+def _compile_config(path):
+    """Return the code object of the config file at path.
+
+    The code is kept, and only compiled again once the file's source
+    changes.
+    """
+    with open(path) as f:
+        src = f.read()
+    key = os.path.abspath(path)
+    try:
+        cached_src, code = _compiled_configs[key]
+    except KeyError:
+        pass
+    else:
+        if cached_src == src:
+            return code
+    code = compile(src, path, "exec")
+    _compiled_configs[key] = (src, code)
+    return code
+
+
+def _config_fingerprint(user_config_path):
+    """Return the size and mtime of the files a loaded config comes
+    from: the config files, and the site's filters and controllers.
+
+    Returns None if a config file is missing.
+    """
+    fingerprint = []
+    for path in (default_config_path, user_config_path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        fingerprint.append((os.path.abspath(path), st.st_size, st.st_mtime))
+    for directory in ("_filters", "_controllers"):
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for fn in sorted(files):
+                path = os.path.join(root, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                fingerprint.append(
+                    (os.path.abspath(path), st.st_size, st.st_mtime))
+    return fingerprint
+
+
+class ConfigSnapshot(object):
+    """The state of a config right after it was loaded.
+
+    Every dict (HierarchicalCache) and list reachable from the roots
+    and the namespace the config files were executed in is recorded
+    with its contents, and restore() puts those contents back in place,
+    so that whatever holds a reference to part of the config (plugins,
+    filters...) sees the restored values. Anything else (callables,
+    modules, compiled regular expressions...) is kept by reference.
+
+    Filter and controller modules are imported once; restore() only
+    marks them as uninitialized, so they're initialized again for the
+    next build, as if they had just been imported.
+    """
+
+    def __init__(self, fingerprint, roots, namespace):
+        self.fingerprint = fingerprint
+        self.namespace = dict(namespace)
+        self.containers = []
+        seen = set()
+        for value in list(roots) + list(self.namespace.values()):
+            self.__record(value, seen)
+
+    def __record(self, value, seen):
+        if isinstance(value, dict):
+            items = list(value.items())
+            values = [v for k, v in items]
+        elif isinstance(value, list):
+            items = values = list(value)
+        elif isinstance(value, tuple):
+            items, values = None, value
+        else:
+            return
+        if id(value) in seen:
+            return
+        seen.add(id(value))
+        if items is not None:
+            self.containers.append((value, items))
+        for v in values:
+            self.__record(v, seen)
+
+    def restore(self):
+        """Put the config back the way it was recorded.
+
+        Returns the namespace the config files were executed in.
+        """
+        for container, items in self.containers:
+            if isinstance(container, dict):
+                dict.clear(container)
+                dict.update(container, items)
+                if "mod" in container:
+                    dict.__setitem__(
+                        container, "mod", _reinitialized(container["mod"]))
+            else:
+                container[:] = items
+        return dict(self.namespace)
+
+
+def _reinitialized(mod):
+    """Return the module of a restored filter or controller, marked as
+    not initialized yet.
+    """
+    if lazymodule.is_loaded(mod):
+        mod = lazymodule.resolve(mod)
+    if isinstance(mod, types.ModuleType) and \
+            getattr(mod, "__initialized", None) is not None:
+        setattr(mod, "__initialized", False)
+    return mod
 
 
 def _compile_file_ignore_patterns():
@@ -92,3 +231,5 @@ def _compile_file_ignore_patterns():
         else:
             site.compiled_file_ignore_patterns.append(
                 re.compile(p, re.IGNORECASE))
+    site.file_ignore_matcher = util.FileIgnoreMatcher(
+        site.file_ignore_patterns)
@@ -17,6 +17,18 @@ Every controller has a contract to provide the following:
       This is optional, if not provided, it will default to 50.
       Controllers with higher priorities get run sooner than ones with
       lower priorities.
+   * provides - Optional keys (a string or a list of them) naming what
+      the controller makes for other controllers, eg. "posts".
+   * requires - Optional keys the controller needs other controllers
+      to provide before it runs.
+
+A controller that declares provides or requires only waits for the
+controllers providing what it requires, instead of for every
+controller with a higher priority, so with site.controller_threads
+above 1 independent controllers run at the same time. Controllers that
+declare neither still run after every controller with a higher
+priority, but the controllers declaring provides or requires don't
+wait for them.
 
 Example controller (either a standalone .py file or
                       __init__.py inside a module):
@@ -55,7 +67,12 @@ import operator
 import logging
 import imp
 
+import six
+
 from .cache import bf
+from . import exception
+from . import lazymodule
+from . import timing
 
 
 bf.controller = sys.modules['blogofile.controller']
@@ -87,6 +104,12 @@ def init_controllers(namespace):
     # discoverable implementation:
     actual_controllers = {}
     for name, controller in namespace.items():
+        if "mod" in controller and \
+                not lazymodule.is_loaded(controller.mod):
+            # Only import the modules of enabled controllers:
+            if not controller.get("enabled"):
+                continue
+            lazymodule.resolve(controller.mod)
         if "mod" in controller and type(controller.mod).__name__ == "module":
             actual_controllers[name] = controller
         elif "enabled" in controller and controller.enabled:
@@ -104,78 +127,111 @@ def init_controllers(namespace):
                 controller.mod.__initialized = True
                 continue
             else:
-                init_method()
+                with timing.timer.time("controller.init", name):
+                    init_method()
 
 
 def load_controller(name, namespace, directory="_controllers", defaults={},
-                    is_plugin=False):
+                    is_plugin=False, lazy=False):
     """Load a single controller by name.
+
+    With lazy, the controller module isn't imported until the
+    controller is enabled and initialized, if its config can be read
+    from its source (see lazymodule.py.)
     """
     logger.debug("loading controller: {0}"
                  .format(bf.util.path_join(directory, name)))
+    controller_config = None
+    if lazy:
+        module_path = os.path.join(directory, name)
+        if not os.path.isdir(module_path):
+            module_path += ".py"
+        controller_config = lazymodule.static_config(module_path)
+    if controller_config is None:
+        controller = _import_controller(name, directory)
+        controller_config = getattr(controller, "config", None)
+    else:
+        logger.debug("Deferring the import of controller: {0}".format(name))
+        controller = lazymodule.LazyModule(
+            name, module_path,
+            lambda: _import_lazy_controller(name, directory, namespace[name]))
+    # Remember the actual imported module
+    namespace[name].mod = controller
+    # Load the blogofile defaults for controllers:
+    for k, v in list(default_controller_config.items()):
+        namespace[name][k] = v
+    # Load provided defaults:
+    for k, v in list(defaults.items()):
+        namespace[name][k] = v
+    if not is_plugin:
+        # Load any of the controller defined defaults:
+        try:
+            for k, v in list(controller_config.items()):
+                if "." in k:
+                    # This is a hierarchical setting
+                    tail = namespace[name]
+                    parts = k.split(".")
+                    for part in parts[:-1]:
+                        tail = tail[part]
+                    tail[parts[-1]] = v
+                if k == "enabled" and v is True:
+                    # Controller default value can't turn itself
+                    # on, but it can turn itself off.
+                    pass
+                if k == "mod":
+                    # Don't ever redefine the module reference
+                    pass
+                else:
+                    namespace[name][k] = v
+        except AttributeError:
+            pass
+    # Provide every controller with a logger:
+    c_logger = logging.getLogger("blogofile.controllers." + name)
+    namespace[name]["logger"] = c_logger
+    return namespace[name].mod
+
+
+def _import_controller(name, directory):
     # Don't generate pyc files in the _controllers directory
     try:
         initial_dont_write_bytecode = sys.dont_write_bytecode
     except KeyError:
         initial_dont_write_bytecode = False
     try:
-        try:
-            sys.dont_write_bytecode = True
-            controller = imp.load_module(
-                name, *imp.find_module(name, [directory]))
-            controller.__initialized = False
-            logger.debug("found controller: {0} - {1}"
-                         .format(name, controller))
-        except (ImportError,) as e:
-            logger.error(
-                "Cannot import controller : {0} ({1})".format(name, e))
-            raise
-        # Remember the actual imported module
-        namespace[name].mod = controller
-        # Load the blogofile defaults for controllers:
-        for k, v in list(default_controller_config.items()):
-            namespace[name][k] = v
-        # Load provided defaults:
-        for k, v in list(defaults.items()):
-            namespace[name][k] = v
-        if not is_plugin:
-            # Load any of the controller defined defaults:
-            try:
-                controller_config = getattr(controller, "config")
-                for k, v in list(controller_config.items()):
-                    if "." in k:
-                        # This is a hierarchical setting
-                        tail = namespace[name]
-                        parts = k.split(".")
-                        for part in parts[:-1]:
-                            tail = tail[part]
-                        tail[parts[-1]] = v
-                    if k == "enabled" and v is True:
-                        # Controller default value can't turn itself
-                        # on, but it can turn itself off.
-                        pass
-                    if k == "mod":
-                        # Don't ever redefine the module reference
-                        pass
-                    else:
-                        namespace[name][k] = v
-            except AttributeError:
-                pass
-        # Provide every controller with a logger:
-        c_logger = logging.getLogger("blogofile.controllers." + name)
-        namespace[name]["logger"] = c_logger
-        return namespace[name].mod
+        sys.dont_write_bytecode = True
+        controller = imp.load_module(
+            name, *imp.find_module(name, [directory]))
+        controller.__initialized = False
+        logger.debug("found controller: {0} - {1}"
+                     .format(name, controller))
+        return controller
+    except (ImportError,) as e:
+        logger.error(
+            "Cannot import controller : {0} ({1})".format(name, e))
+        raise
     finally:
         # Reset the original sys.dont_write_bytecode setting when we're done
         sys.dont_write_bytecode = initial_dont_write_bytecode
 
 
+def _import_lazy_controller(name, directory, controller_config):
+    """Import the module of a controller registered with
+    load_controller(lazy=True).
+    """
+    controller = _import_controller(name, directory)
+    controller_config["mod"] = controller
+    return controller
+
+
 def load_controllers(namespace, directory="_controllers", defaults={}):
     """Find all the controllers in the _controllers directory and
-    import them into the bf context.
+    load them into the bf context.
+
+    The controller modules are imported when the controllers are
+    enabled.
     """
     for name in __find_controller_names(directory):
-        load_controller(name, namespace, directory, defaults)
+        load_controller(name, namespace, directory, defaults, lazy=True)
 
 
 def defined_controllers(namespaces, only_enabled=True):
@@ -216,17 +272,145 @@ def defined_controllers(namespaces, only_enabled=True):
                               reverse=True)]
 
 
-def run_all(namespaces):
-    """Run each controller in priority order.
+def _keys(c, name):
+    """Return a controller's provides or requires setting as a list.
+    """
+    keys = c.get(name) or []
+    if isinstance(keys, six.string_types):
+        return [keys]
+    return list(keys)
+
+
+def controller_dependencies(controllers):
+    """Return, for each of the controllers (in priority order), the set
+    of the indexes of the controllers it has to wait for.
+
+    A controller waits for the controllers that provide what it
+    requires. Controllers that declare neither provides nor requires
+    wait for every controller before them, as if they were run one
+    after another in priority order, but nothing waits for them: they
+    can't provide anything, and a controller requiring something of a
+    lower priority controller would otherwise wait for them in a cycle.
+    """
+    providers = {}
+    for index, c in enumerate(controllers):
+        for key in _keys(c, "provides"):
+            providers.setdefault(key, []).append(index)
+    dependencies = []
+    for index, c in enumerate(controllers):
+        provides, requires = _keys(c, "provides"), _keys(c, "requires")
+        if not provides and not requires:
+            dependencies.append(set(range(index)))
+            continue
+        waits = set()
+        for key in requires:
+            if key not in providers:
+                logger.warn("No enabled controller provides {0!r}, "
+                            "required by {1}".format(key, _name(c)))
+            waits.update(providers.get(key, []))
+        waits.discard(index)
+        dependencies.append(waits)
+    return dependencies
+
+
+def _name(c):
+    try:
+        return c.mod.__name__
+    except AttributeError:
+        return repr(c)
+
+
+def run_order(controllers, dependencies):
+    """Return the indexes of the controllers in the order to run them
+    in: each after the controllers it waits for, and otherwise in
+    priority order.
+
+    Raises BuildError if the controllers wait for each other in a
+    cycle.
+    """
+    done = set()
+    order = []
+    while len(order) < len(controllers):
+        for index in range(len(controllers)):
+            if index not in done and dependencies[index] <= done:
+                done.add(index)
+                order.append(index)
+                break
+        else:
+            cycle = [_name(controllers[i]) for i in range(len(controllers))
+                     if i not in done]
+            raise exception.BuildError(
+                "Controllers require each other in a cycle: {0}".format(
+                    ", ".join(cycle)))
+    return order
+
+
+def run_controller(c):
+    """Run a single controller.
+    """
+    if "run" in dir(c.mod):
+        logger.info("running controller (priority {0}): {1}"
+                    .format(c.priority, c.mod.__file__))
+        with timing.timer.time("controller.run", c.mod.__name__):
+            c.mod.run()
+    else:
+        logger.debug(
+            "controller {0} has no run() method, skipping it.".format(c))
+
+
+def run_all(namespaces, threads=1):
+    """Run the controllers, each after the ones it depends on, and
+    otherwise in priority order.
+
+    With more than one thread, controllers that don't depend on each
+    other run at the same time.
     """
     # Get the controllers in priority order:
     controllers = defined_controllers(namespaces)
-    # Temporarily add _controllers directory onto sys.path
-    for c in controllers:
-        if "run" in dir(c.mod):
-            logger.info("running controller (priority {0}): {1}"
-                        .format(c.priority, c.mod.__file__))
-            c.mod.run()
+    dependencies = controller_dependencies(controllers)
+    order = run_order(controllers, dependencies)
+    if threads > 1 and len(controllers) > 1:
+        try:
+            # The futures backport on Python 2:
+            import concurrent.futures
+        except ImportError:
+            logger.warn("Running controllers in threads needs the "
+                        "concurrent.futures module, running them one "
+                        "at a time")
         else:
-            logger.debug(
-                "controller {0} has no run() method, skipping it.".format(c))
+            _run_concurrently(controllers, dependencies, threads)
+            return
+    for index in order:
+        run_controller(controllers[index])
+
+
+def _run_concurrently(controllers, dependencies, threads):
+    import concurrent.futures
+    done = set()
+    # future -> index of the controller it runs:
+    running = {}
+    error = None
+    with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        while True:
+            if error is None:
+                for index in range(len(controllers)):
+                    if index not in done and \
+                            index not in running.values() and \
+                            dependencies[index] <= done:
+                        future = executor.submit(
+                            run_controller, controllers[index])
+                        running[future] = index
+            if not running:
+                break
+            finished, pending = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in finished:
+                index = running.pop(future)
+                if future.exception() is not None:
+                    # Let the running controllers finish, but don't
+                    # start any more:
+                    error = error or future.exception()
+                else:
+                    done.add(index)
+    if error is not None:
+        raise error
@@ -34,8 +34,55 @@ site.author = None
 # This is turned off by default though, because hard links are not
 # necessarily what every user wants.
 site.use_hard_links = False
+# How to copy static files: "reflink" (copy-on-write clones),
+# "copy_file_range", "sendfile", "hardlink" or "copy". None picks the
+# fastest one that works between the source and _site directories
+# (hardlink only if site.use_hard_links is on.)
+site.copy_strategy = None
+#Run controllers that don't depend on each other (see their provides
+#and requires settings) on up to this many threads at the same time.
+#Templates are still rendered one at a time:
+site.controller_threads = 1
+#Skip the units of work of controllers (see bf.writer.run_unit) whose
+#declared inputs are unchanged since the last build, and reuse their
+#outputs (kept in site.cache_dir.) Only turn this on when the
+#controllers declare everything their units read:
+site.controller_cache = False
 #Warn when we're overwriting a file?
 site.overwrite_warning = True
+# Directory (relative to the source dir) where Blogofile keeps data
+# between builds, like the manifest used by `blogofile build --incremental`
+site.cache_dir = "_bf_cache"
+#Keep the results of filters that declare themselves cacheable between
+#builds, in a "filters" directory inside site.cache_dir, using at most
+#this many bytes (the least recently used results are dropped first.)
+#0 turns the filter result cache off:
+site.filter_cache_size = 0
+#Run the filter chains of batches of documents (Markdown, reST and
+#Textile pages, and whatever controllers pass to
+#bf.filter.run_chain_batch) on this many worker processes. 0 uses one
+#per CPU, 1 runs them in the build process:
+site.filter_processes = 1
+#Build the site in a staging directory next to _site, and only publish
+#it once the whole build has succeeded, so _site is never half built.
+#False builds in place. Otherwise how to publish the staged build:
+# "rename"     - rename the staging directory to _site
+# "symlink"    - make _site a symlink that is atomically flipped over
+# "keep_inode" - move the staged files into _site, which keeps its
+#                inode (for HTTP servers that need that)
+#Incremental and sync staged builds start from copies of the previous
+#build's files, which are hard links with site.use_hard_links; then
+#controllers must replace files rather than write into them in place.
+site.staged_build = False
+#What to do with the files of the previous build in _site:
+# "clean" - delete them all before building
+# "sync"  - keep the static files that haven't changed (same size and
+#           mtime), and only delete the outputs the previous build
+#           recorded that this build doesn't write (files controllers
+#           write straight into _site are left alone)
+site.output_mode = "clean"
+#When syncing, compare static files whose mtime differs by content:
+site.sync_compare_hash = False
 # These are the default ignore patterns for excluding files and dirs
 # from the _site directory
 # These can be strings or compiled patterns.
@@ -70,6 +117,22 @@ templates.engines = HC(
     rst = RestructuredTextTemplate,
     textile = TextileTemplate
     )
+#Write template output to disk as it's rendered, instead of rendering
+#each page to a string first. This keeps memory use flat on big pages:
+templates.stream_output = True
+#Run the filter chains of this many Markdown, reST and Textile pages at
+#a time, so filters that can process many documents at once (with a
+#run_batch function) get them together. 1 filters each page on its own:
+templates.filter_batch_size = 50
+
+#Directory where Mako keeps the compiled modules of templates between
+#builds. None means a "mako" directory inside site.cache_dir, False
+#keeps compiled templates in memory only:
+templates.mako.module_cache_dir = None
+#Directory where Jinja2 keeps the bytecode of compiled templates between
+#builds. None means a "jinja2" directory inside site.cache_dir, False
+#disables the bytecode cache:
+templates.jinja2.bytecode_cache_dir = None
 
 #Template content blocks:
 templates.content_blocks = HC(
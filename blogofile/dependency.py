@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""Template dependency graph.
+
+Records which templates inherit from, include, or import which other
+templates (usually the ones in _templates), so that a change to one
+template only invalidates the outputs that actually depend on it.
+
+The edges are found by each template engine's find_dependencies()
+method, which parses the template source without rendering it.
+"""
+import io
+import logging
+import os
+
+from . import sourceindex
+from . import util
+from . import template as _template
+
+
+logger = logging.getLogger("blogofile.dependency")
+
+
+class DependencyGraph(object):
+    """A graph of template paths to the template paths they depend on.
+
+    A dependency of None means that the template references another
+    template whose name is only known at render time; such a template
+    is treated as depending on every template in _templates.
+    """
+
+    def __init__(self, search_path=None):
+        if search_path is None:
+            search_path = [".", _template.base_template_dir]
+        self.search_path = [os.path.normpath(p) for p in search_path]
+        self.edges = {}
+
+    def add_template(self, path, engine=None):
+        """Parse the template at path, and add it and everything it
+        depends on to the graph.
+
+        engine is the template engine class to parse path with when its
+        file name doesn't have a template extension of its own (eg. a
+        .html file included by a Mako template.)
+
+        Returns the direct dependencies of path.
+        """
+        path = os.path.normpath(path)
+        if path in self.edges:
+            return self.edges[path]
+        try:
+            engine = _template.get_engine_for_template_name(path)
+        except _template.TemplateEngineError:
+            if engine is None:
+                self.edges[path] = []
+                return self.edges[path]
+        # Mark the template as visited before following its edges, so
+        # that cycles terminate:
+        self.edges[path] = []
+        try:
+            with io.open(path, encoding="utf-8", errors="replace") as f:
+                names = engine.find_dependencies(f.read())
+        except Exception as e:
+            logger.debug("Cannot find dependencies of {0}: {1}"
+                         .format(path, e))
+            names = [None]
+        dependencies = []
+        for name in names:
+            dependency = None if name is None else self.resolve(name, path)
+            if dependency is None and name is not None:
+                # Not a file in the site (eg. a plugin template)
+                continue
+            if dependency not in dependencies:
+                dependencies.append(dependency)
+        self.edges[path] = dependencies
+        for dependency in dependencies:
+            if dependency is not None:
+                self.add_template(dependency, engine)
+        return dependencies
+
+    def resolve(self, name, referrer):
+        """Find the file a template name used in referrer refers to.
+
+        Returns None if it isn't a file in the site.
+        """
+        if name == "bf_base_template":
+            path = _template.get_base_template_path()
+            return os.path.normpath(path) if os.path.isfile(path) else None
+        if name.startswith("/"):
+            uri = name.lstrip("/")
+        else:
+            # Relative names are looked up next to the referrer first:
+            uri = util.path_join(
+                os.path.dirname(self.__uri(referrer)), name)
+        for directory in self.search_path:
+            for candidate in (uri, name):
+                path = os.path.normpath(util.path_join(directory, candidate))
+                if os.path.isfile(path):
+                    return path
+        return None
+
+    def __uri(self, path):
+        """Return path relative to the most specific search path
+        directory that contains it.
+        """
+        best = None
+        for directory in self.search_path:
+            if directory == os.curdir:
+                relative = path
+            elif path.startswith(directory + os.sep):
+                relative = path[len(directory) + 1:]
+            else:
+                continue
+            if best is None or len(relative) < len(best):
+                best = relative
+        return path if best is None else best
+
+    def dependencies(self, path):
+        """Return every template that path depends on, directly or
+        indirectly.
+        """
+        path = os.path.normpath(path)
+        if path not in self.edges:
+            self.add_template(path)
+        found = []
+        pending = list(self.edges[path])
+        while pending:
+            dependency = pending.pop(0)
+            if dependency in found or dependency == path:
+                continue
+            found.append(dependency)
+            if dependency is not None:
+                pending.extend(self.edges.get(dependency, []))
+        return found
+
+    def dependents(self, path):
+        """Return every template in the graph that depends on path,
+        directly or indirectly.
+        """
+        path = os.path.normpath(path)
+        in_templates = path.startswith(
+            os.path.normpath(_template.base_template_dir) + os.sep)
+        dependents = []
+        for template in sorted(self.edges):
+            if template == path:
+                continue
+            dependencies = self.dependencies(template)
+            if path in dependencies or \
+                    (in_templates and None in dependencies):
+                dependents.append(template)
+        return dependents
+
+
+def site_graph():
+    """Return the dependency graph of every template in the current
+    source directory, including everything in _templates.
+    """
+    graph = DependencyGraph()
+    for root, dirs, files in sourceindex.SourceIndex().walk():
+        for fn in files:
+            path = util.path_join(root, fn)
+            try:
+                _template.get_engine_for_template_name(path)
+            except _template.TemplateEngineError:
+                continue
+            graph.add_template(path)
+    base_template_dir = os.path.normpath(_template.base_template_dir)
+    for path in sorted(util.recursive_file_list(base_template_dir)):
+        graph.add_template(path)
+    return graph
@@ -3,3 +3,7 @@
 
 class FilterNotLoaded(Exception):
     pass
+
+
+class BuildError(Exception):
+    pass
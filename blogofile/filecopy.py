@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Strategies for copying static files into the _site directory.
+
+Copying gigabytes of images is most of the build time of some sites,
+so we use the cheapest way of getting a file's contents into _site
+that the filesystems involved support:
+
+  reflink         - a copy-on-write clone (FICLONE on Btrfs, XFS...),
+                    which shares the data blocks with the source
+  copy_file_range - an in-kernel copy, which some filesystems
+                    (NFS, CIFS...) can do server side
+  sendfile        - an in-kernel copy
+  hardlink        - a hard link to the source file; only used when
+                    site.use_hard_links is on, since changes to the
+                    output then change the source too
+  copy            - a plain read/write copy
+
+choose_strategy() probes each of them once, at the start of a build.
+"""
+import errno
+import logging
+import os
+import shutil
+
+from . import util
+
+
+logger = logging.getLogger("blogofile.filecopy")
+
+#ioctl number of FICLONE, from linux/fs.h:
+FICLONE = 0x40049409
+
+
+class CopyStrategy(object):
+    """Copy files from the source directory to the output directory.
+
+    Subclasses implement copy_file(), which raises OSError (or
+    IOError) when the strategy can't copy a file. copy() then falls
+    back to a plain copy for that file, so a strategy that works for
+    most files (eg. reflinks on a filesystem that only some files are
+    on) is still usable.
+    """
+    name = None
+
+    def __init__(self):
+        # Files and bytes copied by this strategy and by the fallback:
+        self.files = 0
+        self.bytes = 0
+        self.fallback_files = 0
+
+    def copy_file(self, src, dst):
+        raise NotImplementedError(
+            "CopyStrategy base class cannot be used directly")
+
+    def copy(self, src, dst):
+        """Copy the file src to dst.
+        """
+        try:
+            self.copy_file(src, dst)
+        except (IOError, OSError) as e:
+            logger.debug("Cannot {0} {1}, copying it: {2}".format(
+                self.name, src, e))
+            if os.path.lexists(dst):
+                os.remove(dst)
+            shutil.copyfile(src, dst)
+            self.fallback_files += 1
+        else:
+            self.files += 1
+        self.bytes += os.path.getsize(dst)
+
+    def summary(self):
+        """Describe what was copied, for the build stats.
+        """
+        summary = "{0} files ({1} bytes) copied with {2}".format(
+            self.files + self.fallback_files, self.bytes, self.name)
+        if self.fallback_files:
+            summary += ", {0} of them by falling back to copy".format(
+                self.fallback_files)
+        return summary
+
+
+class ReflinkCopy(CopyStrategy):
+    name = "reflink"
+
+    def copy_file(self, src, dst):
+        import fcntl
+        with open(src, "rb") as fsrc:
+            with open(dst, "wb") as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+
+def _copy_with(copy_func, src, dst):
+    """Copy src to dst with copy_func(in_fd, out_fd, offset, count),
+    which returns the number of bytes it copied.
+    """
+    with open(src, "rb") as fsrc:
+        with open(dst, "wb") as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            offset = 0
+            while offset < size:
+                copied = copy_func(fsrc.fileno(), fdst.fileno(), offset,
+                                   size - offset)
+                if copied == 0:
+                    raise OSError(errno.EIO, "Short copy", src)
+                offset += copied
+
+
+class CopyFileRangeCopy(CopyStrategy):
+    name = "copy_file_range"
+
+    def copy_file(self, src, dst):
+        if not hasattr(os, "copy_file_range"):
+            raise OSError(errno.ENOSYS, "os.copy_file_range is missing")
+        _copy_with(
+            lambda in_fd, out_fd, offset, count: os.copy_file_range(
+                in_fd, out_fd, count, offset_src=offset),
+            src, dst)
+
+
+class SendfileCopy(CopyStrategy):
+    name = "sendfile"
+
+    def copy_file(self, src, dst):
+        if not hasattr(os, "sendfile"):
+            raise OSError(errno.ENOSYS, "os.sendfile is missing")
+        _copy_with(
+            lambda in_fd, out_fd, offset, count: os.sendfile(
+                out_fd, in_fd, offset, count),
+            src, dst)
+
+
+class HardLinkCopy(CopyStrategy):
+    name = "hardlink"
+
+    def copy_file(self, src, dst):
+        os.link(src, dst)
+
+
+class PlainCopy(CopyStrategy):
+    name = "copy"
+
+    def copy_file(self, src, dst):
+        shutil.copyfile(src, dst)
+
+
+#Copy strategies, in the order choose_strategy() tries them:
+strategies = (ReflinkCopy, CopyFileRangeCopy, SendfileCopy, PlainCopy)
+
+
+def get_strategy(name):
+    """Return the copy strategy class called name.
+    """
+    for strategy in strategies + (HardLinkCopy,):
+        if strategy.name == name:
+            return strategy
+    raise ValueError("Unknown copy strategy: {0}".format(name))
+
+
+def choose_strategy(src_dir, dst_dir, use_hard_links=False):
+    """Return an instance of the best copy strategy that works from
+    the filesystem of src_dir to the one of dst_dir.
+
+    Each strategy is tried out on a small probe file.
+    """
+    candidates = list(strategies)
+    if use_hard_links:
+        candidates.insert(0, HardLinkCopy)
+    util.mkdir(src_dir)
+    util.mkdir(dst_dir)
+    src = util.path_join(src_dir, ".bf_copy_probe")
+    dst = util.path_join(dst_dir, ".bf_copy_probe")
+    data = b"blogofile copy probe\n"
+    with open(src, "wb") as f:
+        f.write(data)
+    try:
+        for strategy in candidates[:-1]:
+            try:
+                strategy().copy_file(src, dst)
+                with open(dst, "rb") as f:
+                    if f.read() == data:
+                        break
+            except (IOError, OSError) as e:
+                logger.debug("Copy strategy {0} is unavailable: {1}".format(
+                    strategy.name, e))
+            finally:
+                if os.path.lexists(dst):
+                    os.remove(dst)
+        else:
+            strategy = candidates[-1]
+    finally:
+        os.remove(src)
+    logger.debug("Copying static files with " + strategy.name)
+    return strategy()
@@ -7,18 +7,39 @@ import imp
 import uuid
 import inspect
 
+import six
+
 logger = logging.getLogger("blogofile.filter")
 
 from .cache import bf
 from .cache import HierarchicalCache
 from . import exception
+from . import lazymodule
+from . import timing
 
 bf.filter = sys.modules['blogofile.filter']
 
 default_filter_config = {"name": None,
                          "description": None,
                          "author": None,
-                         "url": None}
+                         "url": None,
+                         # Does the filter's output only depend on its
+                         # input and its config? Then its results can be
+                         # kept between builds (see filtercache.py):
+                         "cacheable": False}
+
+#The filtercache.FilterCache the writer sets up for a build, if the
+#site has site.filter_cache_size set:
+result_cache = None
+
+
+#Compiled filter chains, by chain string (or tuple of filter names):
+_compiled_chains = {}
+
+#Worker processes running filter chains when site.filter_processes is
+#above 1, and how many of them there are:
+_pool = None
+_pool_processes = 0
 
 
 def run_chain(chain, content, context=None):
@@ -28,26 +49,311 @@ def run_chain(chain, content, context=None):
     """
     if chain is None:
         return content
-    # lib3to2 interprets str as meaning unicode instead of basestring,
-    # hand craft the translation to python2:
-    if sys.version_info >= (3,):
-        is_str = eval("isinstance(chain, str)")
-    else:
-        is_str = eval("isinstance(chain, basestring)")
-    if is_str:
-        chain = parse_chain(chain)
-    for fn in chain:
-        f = get_filter(fn)
-        logger.debug("Applying filter: " + fn)
-        code_obj = getattr(f.run, 'func_code', f.run.__code__)
-        if 'context' not in inspect.getargs(code_obj).args:
-            content = f.run(content)
-        else:
-            content = f.run(content, context)
-    logger.debug("Content: " + content)
+    content = compile_chain(chain)(content, context)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Content: " + content)
     return content
 
 
+def run_chain_batch(documents):
+    """Run many documents through their filter chains.
+
+    documents is a sequence of (chain, content) or (chain, content,
+    context) tuples. Documents with the same chain are handed to the
+    filters together (see FilterChain.run_batch), and with
+    site.filter_processes above 1 the documents without a context are
+    filtered on worker processes. Returns the filtered contents, in the
+    order of documents.
+
+    Controllers that filter many documents (like the posts of a blog)
+    should collect them and make one call to this, rather than calling
+    run_chain for each of them:
+
+        contents = bf.filter.run_chain_batch(
+            [(post.filters, post.content) for post in posts])
+    """
+    results = [None] * len(documents)
+    # chain -> indexes of its documents:
+    groups = {}
+    for index, document in enumerate(documents):
+        chain = document[0]
+        if chain is None:
+            results[index] = document[1]
+            continue
+        key = chain if isinstance(chain, six.string_types) else tuple(chain)
+        groups.setdefault(key, []).append(index)
+    for chain, indexes in groups.items():
+        contents = [documents[i][1] for i in indexes]
+        contexts = [documents[i][2] if len(documents[i]) > 2 else None
+                    for i in indexes]
+        filtered = _run_chain_group(chain, contents, contexts)
+        for i, content in zip(indexes, filtered):
+            results[i] = content
+    return results
+
+
+def _run_chain_group(chain, contents, contexts):
+    """Run contents through a chain, on the filter worker processes if
+    site.filter_processes is above 1.
+
+    Contexts (like template contexts) generally can't be sent to other
+    processes, so the documents with a context are filtered in this
+    process, while the workers filter the others.
+    """
+    processes = _parallel_processes()
+    remote = [i for i, context in enumerate(contexts) if context is None]
+    if processes < 2 or len(remote) < 2:
+        return compile_chain(chain).run_batch(contents, contexts)
+    pool = _get_pool(processes)
+    if pool is None:
+        return compile_chain(chain).run_batch(contents, contexts)
+    size = -(-len(remote) // processes)
+    chunks = [remote[start:start + size]
+              for start in range(0, len(remote), size)]
+    async_results = pool.map_async(
+        _run_chain_in_worker,
+        [(chain, [contents[i] for i in chunk]) for chunk in chunks])
+    results = list(contents)
+    local = [i for i, context in enumerate(contexts) if context is not None]
+    if local:
+        filtered = compile_chain(chain).run_batch(
+            [contents[i] for i in local], [contexts[i] for i in local])
+        for i, content in zip(local, filtered):
+            results[i] = content
+    for chunk, (filtered, timings) in zip(chunks, async_results.get()):
+        timing.timer.merge(timings)
+        for i, content in zip(chunk, filtered):
+            results[i] = content
+    return results
+
+
+def _run_chain_in_worker(work):
+    """Run contents through a chain in a filter worker process.
+
+    Returns the filtered contents, and the timings recorded for
+    --profile.
+    """
+    chain, contents = work
+    timing.timer.records = {}
+    filtered = compile_chain(chain).run_batch(contents)
+    return filtered, timing.timer.records
+
+
+def _parallel_processes():
+    """Return how many processes site.filter_processes asks for.
+    """
+    processes = bf.config.site.get("filter_processes", 1)
+    if processes == 1:
+        return 1
+    import multiprocessing
+    if multiprocessing.current_process().daemon:
+        # Worker processes (of parallel builds too) can't have their
+        # own workers:
+        return 1
+    return processes or multiprocessing.cpu_count()
+
+
+def _get_pool(processes):
+    """Return the pool of filter worker processes, starting it if
+    needed.
+
+    The workers are forked from this process, so they start with the
+    filters already loaded and initialized.
+    """
+    global _pool, _pool_processes
+    if _pool is not None and _pool_processes == processes:
+        return _pool
+    close_pool()
+    import multiprocessing
+    try:
+        context = multiprocessing.get_context("fork")
+    except (AttributeError, ValueError):
+        logger.warn("Parallel filters need os.fork(), "
+                    "running filters serially")
+        return None
+    logger.debug("Starting {0} filter processes".format(processes))
+    _pool = context.Pool(processes)
+    _pool_processes = processes
+    return _pool
+
+
+def close_pool():
+    """Stop the filter worker processes, if they were started.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+
+def compile_chain(chain):
+    """Return the FilterChain for a filter chain string or sequence of
+    filter names.
+
+    Chains are compiled once and then reused, until a filter is
+    (re)loaded or bf.config.filters is replaced.
+    """
+    is_str = isinstance(chain, six.string_types)
+    key = chain if is_str else tuple(chain)
+    compiled = _compiled_chains.get(key)
+    if compiled is None or compiled.namespace is not bf.config.filters:
+        names = parse_chain(chain) if is_str else key
+        compiled = _compiled_chains[key] = FilterChain(names)
+    return compiled
+
+
+def invalidate_chains():
+    """Forget the compiled filter chains.
+
+    Filter worker processes started with the old filters are stopped.
+    """
+    _compiled_chains.clear()
+    close_pool()
+
+
+class FilterChain(object):
+    """A filter chain resolved to the run functions of its filters.
+
+    Call it with the content (and optionally a context) to run the
+    content through the chain. Raises FilterNotLoaded when created if
+    any filter of the chain isn't loaded, or has no run function.
+    """
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self.namespace = bf.config.filters
+        self.filters = [_ChainFilter(name) for name in self.names]
+        # Consecutive filters grouped by whether they are cacheable:
+        self.steps = []
+        for f in self.filters:
+            if self.steps and self.steps[-1][0] == f.cacheable:
+                self.steps[-1][1].append(f)
+            else:
+                self.steps.append((f.cacheable, [f]))
+
+    def __call__(self, content, context=None):
+        for cacheable, filters in self.steps:
+            if cacheable and result_cache is not None:
+                content = _run_cached(filters, content, context)
+            else:
+                for f in filters:
+                    content = f(content, context)
+        return content
+
+    def run_batch(self, contents, contexts=None):
+        """Run many contents (with their contexts) through the chain.
+
+        Filters with a run_batch function get all the contents at
+        once, the others get them one by one.
+        """
+        contents = list(contents)
+        if contexts is None:
+            contexts = [None] * len(contents)
+        for cacheable, filters in self.steps:
+            if cacheable and result_cache is not None:
+                contents = _run_cached_batch(filters, contents, contexts)
+            else:
+                for f in filters:
+                    contents = f.run_batch(contents, contexts)
+        return contents
+
+    def __repr__(self):
+        return "<FilterChain {0}>".format(", ".join(self.names))
+
+
+class _ChainFilter(object):
+    """One filter of a FilterChain.
+    """
+    __slots__ = ("name", "config", "run", "run_batch_function",
+                 "wants_context", "cacheable")
+
+    def __init__(self, name):
+        self.name = name
+        self.config = get_filter_config(name)
+        try:
+            self.run = self.config["mod"].run
+        except AttributeError:
+            raise exception.FilterNotLoaded(
+                "Filter has no run function: {0}".format(name))
+        code_obj = getattr(self.run, 'func_code', self.run.__code__)
+        self.wants_context = 'context' in inspect.getargs(code_obj).args
+        self.cacheable = bool(self.config.get("cacheable"))
+        self.run_batch_function = getattr(self.config["mod"], "run_batch",
+                                          None)
+
+    def __call__(self, content, context):
+        logger.debug("Applying filter: " + self.name)
+        with timing.timer.time("filter", self.name):
+            if self.wants_context:
+                return self.run(content, context)
+            return self.run(content)
+
+    def run_batch(self, contents, contexts):
+        if self.run_batch_function is None or len(contents) < 2:
+            return [self(content, context)
+                    for content, context in zip(contents, contexts)]
+        logger.debug("Applying filter to {0} documents: {1}".format(
+            len(contents), self.name))
+        with timing.timer.time("filter", self.name):
+            results = list(self.run_batch_function(contents, contexts))
+        if len(results) != len(contents):
+            raise ValueError(
+                "Filter {0} run_batch returned {1} results for {2} "
+                "documents".format(self.name, len(results), len(contents)))
+        return results
+
+
+def _run_cached(filters, content, context):
+    """Run content through cacheable filters, or get their result from
+    the result cache.
+    """
+    if not isinstance(content, six.string_types):
+        for f in filters:
+            content = f(content, context)
+        return content
+    key = result_cache.key([f.config for f in filters], content)
+    result = result_cache.get(key)
+    if result is not None:
+        logger.debug("Using cached result of filters: " +
+                     ", ".join(f.name for f in filters))
+        return result
+    result = content
+    for f in filters:
+        result = f(result, context)
+    if isinstance(result, six.string_types):
+        result_cache.put(key, result)
+    return result
+
+
+def _run_cached_batch(filters, contents, contexts):
+    """Run contents through cacheable filters, running only the ones
+    whose results aren't in the result cache.
+    """
+    results = list(contents)
+    misses = []
+    keys = {}
+    for i, content in enumerate(contents):
+        if isinstance(content, six.string_types):
+            keys[i] = result_cache.key([f.config for f in filters], content)
+            result = result_cache.get(keys[i])
+            if result is not None:
+                results[i] = result
+                continue
+        misses.append(i)
+    if not misses:
+        return results
+    filtered = [contents[i] for i in misses]
+    miss_contexts = [contexts[i] for i in misses]
+    for f in filters:
+        filtered = f.run_batch(filtered, miss_contexts)
+    for i, result in zip(misses, filtered):
+        results[i] = result
+        if i in keys and isinstance(result, six.string_types):
+            result_cache.put(keys[i], result)
+    return results
+
+
 def parse_chain(chain):
     """Parse a filter chain into a sequence of filters.
     """
@@ -64,6 +370,8 @@ def parse_chain(chain):
 def preload_filters(namespace=None, directory="_filters"):
     """Find all the standalone .py files and modules in the directory
     specified and load them into namespace specified.
+
+    The filter modules are imported when the filters are first used.
     """
     if namespace is None:
         namespace = bf.config.filters
@@ -73,16 +381,20 @@ def preload_filters(namespace=None, directory="_filters"):
         p = os.path.join(directory, fn)
         if (os.path.isfile(p) and fn.endswith(".py")):
             # Load a single .py file:
-            load_filter(fn[:-3], module_path=p, namespace=namespace)
+            load_filter(fn[:-3], module_path=p, namespace=namespace,
+                        lazy=True)
         elif (os.path.isdir(p)
               and os.path.isfile(os.path.join(p, "__init__.py"))):
             # Load a package:
-            load_filter(fn, module_path=p, namespace=namespace)
+            load_filter(fn, module_path=p, namespace=namespace, lazy=True)
 
 
 def init_filters(namespace=None):
     """Filters have an optional init method that runs before the site
     is built.
+
+    Filters whose module hasn't been imported yet are initialized when
+    it is.
     """
     if namespace is None:
         namespace = bf.config.filters
@@ -100,8 +412,9 @@ def init_filters(namespace=None):
             filt.mod.__initialized = True
 
 
-def get_filter(name, namespace=None):
-    """Return an already loaded filter.
+def get_filter_config(name, namespace=None):
+    """Return the config of an already loaded filter, which holds the
+    filter module in mod.
     """
     if namespace is None:
         if name.startswith("bf") and "." in name:
@@ -114,31 +427,41 @@ def get_filter(name, namespace=None):
             namespace = bf.config.filters
     if name in namespace and "mod" in namespace[name]:
         logger.debug("Retrieving already loaded filter: " + name)
-        return namespace[name]['mod']
+        return namespace[name]
     else:
         raise exception.FilterNotLoaded("Filter not loaded: {0}".format(name))
 
 
-def load_filter(name, module_path, namespace=None):
+def get_filter(name, namespace=None):
+    """Return an already loaded filter.
+    """
+    return get_filter_config(name, namespace)['mod']
+
+
+def load_filter(name, module_path, namespace=None, lazy=False):
     """Load a filter from the site's _filters directory.
+
+    With lazy, the filter module isn't imported until the filter is
+    used, if its config can be read from its source (see
+    lazymodule.py.)
     """
     if namespace is None:
         namespace = bf.config.filters
+    module_name = "{0}_{1}".format(name, uuid.uuid4())
+    filter_config = lazymodule.static_config(module_path) if lazy else None
     try:
-        initial_dont_write_bytecode = sys.dont_write_bytecode
-    except KeyError:
-        initial_dont_write_bytecode = False
-    try:
-        # Don't generate .pyc files in the _filters directory
-        sys.dont_write_bytecode = True
-        if module_path.endswith(".py"):
-            mod = imp.load_source(
-                "{0}_{1}".format(name, uuid.uuid4()), module_path)
+        if filter_config is None:
+            mod = _import_filter(module_name, module_path)
+            mod.__initialized = False
+            filter_config = getattr(mod, "config", None)
         else:
-            mod = imp.load_package(
-                "{0}_{1}".format(name, uuid.uuid4()), module_path)
-        logger.debug("Loaded filter for first time: {0}".format(module_path))
-        mod.__initialized = False
+            logger.debug("Deferring the import of filter: {0}".format(
+                module_path))
+            mod = lazymodule.LazyModule(
+                module_name, module_path,
+                lambda: _import_lazy_filter(name, module_name, module_path,
+                                            namespace[name]))
+        invalidate_chains()
         # Overwrite anything currently in this namespace:
         try:
             del namespace[name]
@@ -146,14 +469,13 @@ def load_filter(name, module_path, namespace=None):
             pass
         # If the filter defines it's own configuration, use that as
         # it's own namespace:
-        if hasattr(mod, "config") and \
-                isinstance(mod.config, HierarchicalCache):
-            namespace[name] = mod.config
+        if isinstance(filter_config, HierarchicalCache):
+            namespace[name] = filter_config
         # Load the module into the namespace
         namespace[name].mod = mod
         # If the filter has any aliases, load those as well
         try:
-            for alias in mod.config['aliases']:
+            for alias in filter_config['aliases']:
                 namespace[alias] = namespace[name]
         except:
             pass
@@ -161,8 +483,7 @@ def load_filter(name, module_path, namespace=None):
         for k, v in list(default_filter_config.items()):
             namespace[name][k] = v
         # Load any filter defined defaults:
-        try:
-            filter_config = getattr(mod, "config")
+        if filter_config is not None:
             for k, v in list(filter_config.items()):
                 if "." in k:
                     # This is a hierarchical setting
@@ -173,17 +494,54 @@ def load_filter(name, module_path, namespace=None):
                     tail[parts[-1]] = v
                 else:
                     namespace[name][k] = v
-        except AttributeError:
-            pass
         return mod
     except:
         logger.error("Cannot load filter: " + name)
         raise
+
+
+def _import_filter(module_name, module_path):
+    try:
+        initial_dont_write_bytecode = sys.dont_write_bytecode
+    except KeyError:
+        initial_dont_write_bytecode = False
+    try:
+        # Don't generate .pyc files in the _filters directory
+        sys.dont_write_bytecode = True
+        if module_path.endswith(".py"):
+            mod = imp.load_source(module_name, module_path)
+        else:
+            mod = imp.load_package(module_name, module_path)
+        logger.debug("Loaded filter for first time: {0}".format(module_path))
+        return mod
     finally:
         # Reset the original sys.dont_write_bytecode setting where we're done
         sys.dont_write_bytecode = initial_dont_write_bytecode
 
 
+def _import_lazy_filter(name, module_name, module_path, filter_config):
+    """Import the module of a filter registered with load_filter(lazy=True),
+    and initialize it, since it's about to be used.
+    """
+    try:
+        mod = _import_filter(module_name, module_path)
+    except:
+        logger.error("Cannot load filter: " + name)
+        raise
+    # The module's own config is the filter's namespace, as if it had
+    # been imported right away:
+    if isinstance(getattr(mod, "config", None), HierarchicalCache):
+        mod.config = filter_config
+    filter_config["mod"] = mod
+    mod.__initialized = False
+    init_method = getattr(mod, "init", None)
+    if init_method is not None:
+        logger.debug("Initializing filter: " + name)
+        init_method()
+    mod.__initialized = True
+    return mod
+
+
 def list_filters(args):
     from . import config, plugin
     config.init_interactive()
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+"""Persistent cache of filter results.
+
+Running content through filters like syntax highlighting or Markdown
+is often the most expensive part of a build, and most of the content
+doesn't change between builds. Filters that declare themselves
+cacheable in their config:
+
+    config = {"name": "Markdown",
+              "cacheable": True}
+
+have their results kept between builds, in site.cache_dir/filters. A
+cacheable filter's output must only depend on its input content and
+its config; the context it may be given is not part of the cache key.
+
+Results are keyed by the names of the filters, the fingerprint of each
+of them (a hash of its source files, its config and the versions of
+the libraries it uses), and the hash of the content. The cache is bounded to site.filter_cache_size bytes, evicting
+the least recently used results at the end of each build.
+"""
+import hashlib
+import logging
+import os
+import sys
+import types
+
+import six
+
+from . import lazymodule
+from . import util
+
+
+logger = logging.getLogger("blogofile.filtercache")
+
+#Lone surrogates (from undecodable file names, etc.) can only be
+#encoded on Python 3:
+_ERRORS = "surrogatepass" if six.PY3 else "strict"
+
+
+def _encode(content):
+    if isinstance(content, six.binary_type):
+        # A Python 2 str
+        return content
+    return content.encode("utf-8", _ERRORS)
+
+
+def _source_files(path):
+    """Return the source files of the module at path: path itself, or
+    all the .py files of its package when it's a package's __init__.
+    """
+    if os.path.splitext(os.path.basename(path))[0] != "__init__":
+        return [path]
+    return sorted(p for p in util.recursive_file_list(os.path.dirname(path))
+                  if p.endswith(".py"))
+
+
+def _library_versions(mod):
+    """Return the (name, version) of the libraries (top level packages)
+    that mod and the modules of its package refer to.
+    """
+    prefix = mod.__name__ + "."
+    modules = [mod] + [m for name, m in sorted(sys.modules.items())
+                       if name.startswith(prefix) and m is not None]
+    libraries = set()
+    for m in modules:
+        for value in list(vars(m).values()):
+            if isinstance(value, types.ModuleType):
+                name = value.__name__
+            else:
+                name = getattr(value, "__module__", None)
+            if isinstance(name, six.string_types):
+                libraries.add(name.split(".")[0])
+    versions = []
+    for name in sorted(libraries):
+        library = sys.modules.get(name)
+        version = getattr(library, "__version__", None)
+        if not isinstance(version, (six.string_types, tuple)):
+            version = getattr(library, "VERSION", None)
+        if isinstance(version, (six.string_types, tuple)):
+            versions.append((name, version))
+    return versions
+
+
+def filter_fingerprint(filter_config):
+    """Return a hash of a loaded filter's source files, its config and
+    the versions of the libraries it uses (eg. Markdown, Pygments.)
+    """
+    h = hashlib.sha1()
+    mod = lazymodule.resolve(filter_config["mod"])
+    h.update(repr(getattr(mod, "__version__", None)).encode("utf-8"))
+    path = getattr(mod, "__file__", None)
+    if path:
+        for source in _source_files(path):
+            h.update(repr(os.path.relpath(source, os.path.dirname(path)))
+                     .encode("utf-8", "replace"))
+            try:
+                with open(source, "rb") as f:
+                    h.update(f.read())
+            except (IOError, OSError):
+                pass
+    if isinstance(mod, types.ModuleType):
+        h.update(repr(_library_versions(mod)).encode("utf-8", "replace"))
+    for key, value in sorted(filter_config.items()):
+        if key not in ("mod", "logger"):
+            h.update(repr((key, value)).encode("utf-8", "replace"))
+    return h.hexdigest()
+
+
+class FilterCache(object):
+    """Filter results stored as files in directory, at most max_size
+    bytes of them.
+
+    Reading a result bumps its mtime, which prune() uses to find the
+    least recently used ones. Results are written to a temporary file
+    that is then renamed, so several build processes can share the
+    cache.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        # id(filter module) -> fingerprint:
+        self.__fingerprints = {}
+
+    def key(self, filter_configs, content):
+        """Return the cache key for running content through the
+        filters with the given (loaded) configs.
+        """
+        h = hashlib.sha1()
+        for filter_config in filter_configs:
+            mod_id = id(filter_config["mod"])
+            try:
+                fingerprint = self.__fingerprints[mod_id]
+            except KeyError:
+                fingerprint = self.__fingerprints[mod_id] = \
+                    filter_fingerprint(filter_config)
+            h.update(fingerprint.encode("ascii"))
+        h.update(hashlib.sha1(_encode(content)).digest())
+        return h.hexdigest()
+
+    def __path(self, key):
+        return util.path_join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        """Return the cached result for key, or None.
+        """
+        path = self.__path(key)
+        try:
+            with open(path, "rb") as f:
+                content = f.read().decode("utf-8", _ERRORS)
+        except (IOError, OSError, UnicodeDecodeError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return content
+
+    def put(self, key, content):
+        path = self.__path(key)
+        tmp_path = "{0}.{1}.tmp".format(path, os.getpid())
+        try:
+            util.mkdir(os.path.dirname(path))
+            with open(tmp_path, "wb") as f:
+                f.write(_encode(content))
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logger.warn("Cannot cache filter result: {0}".format(e))
+
+    def prune(self):
+        """Delete the least recently used results until the cache is
+        no bigger than max_size.
+        """
+        entries = []
+        total = 0
+        for path in util.recursive_file_list(self.directory):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+        return total
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Deferred importing of filter and controller modules.
+
+Filters and controllers are registered when the config is loaded, but
+their modules are only imported when they are used: a filter when a
+chain runs it, a controller when it is enabled. Until then, the mod of
+their namespace holds a LazyModule, which imports the real module the
+first time any of its attributes is used.
+
+Registering a module without importing it needs its config (for the
+filter aliases, controller priorities, etc.), which static_config()
+reads from the module's source. Modules whose config can't be read
+that way are imported right away, like before.
+
+lazy_import() does the same for Blogofile's own modules, so that each
+command only imports the modules it uses.
+"""
+import ast
+import logging
+import os
+import sys
+
+from .cache import HierarchicalCache
+
+
+logger = logging.getLogger("blogofile.lazymodule")
+
+#Names a config can be built with, besides a dict literal:
+_CONFIG_CALLS = ("HC", "HierarchicalCache", "dict")
+#Statements making config refer to a variable outside the function
+#(there's no nonlocal on Python 2):
+_SCOPE_STATEMENTS = (ast.Global, getattr(ast, "Nonlocal", ()))
+
+
+class LazyModule(object):
+    """Stands in for a module until one of its attributes is used.
+
+    load is called (once) to import the module, and returns it. When
+    path is None, __file__ is the real module's.
+    """
+
+    def __init__(self, name, path, load):
+        self.__dict__.update({
+            "__name__": name,
+            "_LazyModule__load": load,
+            "_LazyModule__module": None,
+        })
+        if path is not None:
+            self.__dict__["__file__"] = path
+
+    def __getattr__(self, attr):
+        return getattr(resolve(self), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(resolve(self), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(resolve(self), attr)
+
+    def __dir__(self):
+        return dir(resolve(self))
+
+    def __repr__(self):
+        state = "loaded" if is_loaded(self) else "not loaded"
+        return "<LazyModule {0} from {1!r} ({2})>".format(
+            self.__name__, self.__dict__.get("__file__"), state)
+
+
+def resolve(mod):
+    """Return the real module for mod, importing it if needed.
+    """
+    if not isinstance(mod, LazyModule):
+        return mod
+    module = mod.__dict__["_LazyModule__module"]
+    if module is None:
+        logger.debug("Importing deferred module: {0}".format(
+            mod.__dict__.get("__file__", mod.__name__)))
+        module = mod.__dict__["_LazyModule__load"]()
+        mod.__dict__["_LazyModule__module"] = module
+    return module
+
+
+def is_loaded(mod):
+    """Has mod been imported (or is it a real module to begin with)?
+    """
+    return not isinstance(mod, LazyModule) or \
+        mod.__dict__["_LazyModule__module"] is not None
+
+
+def lazy_import(module_name):
+    """Return a LazyModule for the module module_name (an absolute
+    name), imported the first time it's used.
+
+    Nothing is looked up until then, so a missing module only raises
+    ImportError when it's used.
+    """
+    def load():
+        __import__(module_name)
+        return sys.modules[module_name]
+    return LazyModule(module_name, None, load)
+
+
+def module_source_path(module_path):
+    """Return the source file of a module: either module_path, or the
+    __init__.py of a package.
+    """
+    if os.path.isdir(module_path):
+        return os.path.join(module_path, "__init__.py")
+    return module_path
+
+
+def _literal(node):
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) \
+            and node.func.id in _CONFIG_CALLS and not node.args:
+        value = {}
+        for keyword in node.keywords:
+            if keyword.arg is None:
+                raise ValueError("** in config")
+            value[keyword.arg] = _literal(keyword.value)
+        if node.func.id == "dict":
+            return value
+        return HierarchicalCache(**value)
+    if isinstance(node, ast.Dict):
+        return dict((ast.literal_eval(k), _literal(v))
+                    for k, v in zip(node.keys, node.values))
+    return ast.literal_eval(node)
+
+
+def _root_name(node):
+    """Return the name at the root of an attribute or subscript chain
+    (config for config.a["b"]), if any.
+    """
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+    if isinstance(node, ast.Name):
+        return node.id
+
+
+def static_config(module_path):
+    """Return the config a filter or controller module defines, read
+    from its source without importing it.
+
+    Returns {} for modules without a config, and None when the config
+    can't be determined without running the module: when it isn't
+    built from literals, or is changed after it's defined.
+    """
+    try:
+        with open(module_source_path(module_path), "rb") as f:
+            tree = ast.parse(f.read(), module_path)
+    except (IOError, OSError, SyntaxError, ValueError):
+        return None
+    config = {}
+    definitions = 0
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "config" and \
+                isinstance(node.ctx, (ast.Store, ast.Del)):
+            definitions += 1
+        elif isinstance(node, _SCOPE_STATEMENTS) and \
+                "config" in node.names:
+            return None
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and \
+                isinstance(node.targets[0], ast.Name) and \
+                node.targets[0].id == "config":
+            try:
+                config = _literal(node.value)
+            except (ValueError, TypeError, SyntaxError):
+                return None
+            if not isinstance(config, dict):
+                return None
+            definitions -= 1
+    if definitions:
+        # Assigned more than once, or somewhere we can't follow:
+        return None
+    # Anything else changing config (config["x"] = ..., config.a.b = ...,
+    # config.update()) could make it differ from the source:
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Subscript, ast.Attribute)) and \
+                not isinstance(node.ctx, ast.Load) and \
+                _root_name(node) == "config":
+            return None
+        if isinstance(node, ast.Call) and \
+                isinstance(node.func, ast.Attribute) and \
+                _root_name(node.func) == "config" and \
+                node.func.attr not in ("get", "keys", "items", "values"):
+            return None
+    return config
@@ -17,13 +17,20 @@ import time
 import platform
 
 from . import __version__
-from . import server
-from . import config
-from . import util
 from . import filter as _filter
+from . import lazymodule
 from . import plugin
+from . import timing
 from .cache import bf
-from .writer import Writer
+from .buildmodes import STAGED_MODES
+
+#Imported by the sub-commands that use them, so that the others (and
+#--help) start up without the template engines, the web server, etc.:
+config = lazymodule.lazy_import("blogofile.config")
+dependency = lazymodule.lazy_import("blogofile.dependency")
+server = lazymodule.lazy_import("blogofile.server")
+util = lazymodule.lazy_import("blogofile.util")
+_writer = lazymodule.lazy_import("blogofile.writer")
 
 
 locale.setlocale(locale.LC_ALL, '')
@@ -45,7 +52,7 @@ def main(argv=[]):
     """
     do_debug()
     argv = argv or sys.argv
-    parser, subparsers = setup_command_parser()
+    parser, subparsers = setup_command_parser(argv)
     if len(argv) == 1:
         parser.print_help()
         parser.exit(2)
@@ -78,8 +85,11 @@ def do_debug():
         pass
 
 
-def setup_command_parser():
+def setup_command_parser(argv=None):
     """Set up the command line parser, and the parsers for the sub-commands.
+
+    When argv is given, only the plugins it names get imported to set
+    up their command parsers.
     """
     parser_template = _setup_parser_template()
     parser = argparse.ArgumentParser(parents=[parser_template])
@@ -89,7 +99,7 @@ def setup_command_parser():
     _setup_build_parser(subparsers)
     _setup_serve_parser(subparsers)
     _setup_info_parser(subparsers)
-    _setup_plugins_parser(subparsers, parser_template)
+    _setup_plugins_parser(subparsers, parser_template, argv)
     _setup_filters_parser(subparsers)
     return parser, subparsers
 
@@ -172,8 +182,57 @@ def _setup_build_parser(subparsers):
     parser.add_argument(
         "-s", "--src-dir", dest="src_dir", metavar="DIR",
         help="Your site's source directory (default is current directory)")
+    parser.add_argument(
+        "--incremental", dest="incremental", action="store_true",
+        help="""
+            Keep the existing _site and only rebuild the outputs
+            whose sources changed since the last incremental build
+            """)
+    parser.add_argument(
+        "-j", "--jobs", dest="jobs", metavar="N", type=int,
+        help="""
+            Materialize templates with N worker processes
+            (0 means one per CPU; default is %(default)s)
+            """)
+    parser.add_argument(
+        "--staged", dest="staged", nargs="?", const="rename",
+        choices=STAGED_MODES,
+        help="""
+            Build in a staging directory and publish it to _site only
+            if the build succeeds (by %(const)s unless another mode
+            is given; default is site.staged_build in _config.py)
+            """)
+    parser.add_argument(
+        "--sync", dest="output_mode", action="store_const", const="sync",
+        help="""
+            Keep the static files in _site that haven't changed, and
+            only delete the files this build doesn't write
+            (same as site.output_mode = "sync" in _config.py)
+            """)
+    parser.add_argument(
+        "--profile", dest="profile", action="store_true",
+        help="""
+            Print how long each build phase, controller, filter and
+            template took
+            """)
+    parser.add_argument(
+        "--profile-json", dest="profile_json", metavar="FILE",
+        help="Write the --profile timings to FILE as JSON")
+    parser.add_argument(
+        "--profile-pstats", dest="profile_pstats", metavar="FILE",
+        help="""
+            Run the build under cProfile and dump its statistics to
+            FILE, for the pstats module
+            """)
     defaults = {
         "src_dir": os.curdir,
+        "incremental": False,
+        "jobs": 1,
+        "staged": None,
+        "output_mode": None,
+        "profile": False,
+        "profile_json": None,
+        "profile_pstats": None,
         "func": do_build,
     }
     parser.set_defaults(**defaults)
@@ -223,15 +282,27 @@ def _setup_info_parser(subparsers):
     parser.add_argument(
         "-s", "--src-dir", dest="src_dir", metavar="DIR",
         help="Your site's source directory (default is current directory)")
+    parser.add_argument(
+        "--deps", dest="deps", action="store_true",
+        help="""
+            Show which templates each of the site's templates
+            inherits, includes or imports
+            """)
     defaults = {
         "src_dir": os.curdir,
+        "deps": False,
         "func": do_info,
     }
     parser.set_defaults(**defaults)
 
 
-def _setup_plugins_parser(subparsers, parser_template):
+def _setup_plugins_parser(subparsers, parser_template, argv=None):
     """Set up the parser for the plugins sub-command.
+
+    Plugins with a command parser get a sub-command each. Only the
+    plugins named in argv (all of them if argv is None) are imported to
+    set up their parsers; the others are listed from their cached
+    metadata.
     """
     parser = subparsers.add_parser(
         "plugins",
@@ -241,20 +312,45 @@ def _setup_plugins_parser(subparsers, parser_template):
         "list",
         help="List all of the plugins installed")
     plugins_list.set_defaults(func=plugin.list_plugins)
-    for p in plugin.iter_plugins():
+    for info in plugin.discover_plugins():
+        dist = info['dist']
         # Setup the plugin command parser, if it has one
-        try:
-            plugin_parser_setup = p.__dist__['command_parser_setup']
-        except KeyError:
+        if not dist.get('command_parser'):
             continue
+        p = None
+        if argv is None or dist['config_name'] in argv[1:]:
+            p = _get_plugin(dist['config_name'])
+            if p is None:
+                continue
         plugin_parser = subparsers.add_parser(
-            p.__dist__['config_name'],
-            help="Plugin: " + p.__dist__['description'])
+            dist['config_name'],
+            help="Plugin: " + dist['description'])
         plugin_parser.add_argument(
             "--version", action="version",
             version="{name} plugin {version} by {author} -- {url}"
-            .format(**p.__dist__))
-        plugin_parser_setup(plugin_parser, parser_template)
+            .format(**dist))
+        if p is not None:
+            p.__dist__['command_parser_setup'](plugin_parser, parser_template)
+
+
+def _get_plugin(config_name):
+    """Return the installed plugin with config_name, or None.
+
+    The cached plugin metadata can be stale (a plugin can be removed or
+    renamed without changing the search path), so the plugins are
+    discovered again before giving up on one.
+    """
+    try:
+        p = plugin.get_by_name(config_name)
+    except ImportError:
+        p = None
+    if p is None:
+        plugin.discover_plugins(refresh=True)
+        p = plugin.get_by_name(config_name)
+    if p is None:
+        logger.warn("Plugin {0} is no longer installed, skipping its "
+                    "command".format(config_name))
+    return p
 
 
 def _setup_filters_parser(subparsers):
@@ -378,10 +474,36 @@ def _init_plugin_site(args):
 
 def do_build(args, load_config=True):
     _validate_src_dir(args.src_dir)
+    profile = args.profile or args.profile_json or args.profile_pstats
+    if not profile:
+        _build(args, load_config)
+        return
+    timing.timer.enable()
+    profiler = None
+    if args.profile_pstats:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        _build(args, load_config)
+    finally:
+        timing.timer.disable()
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile_pstats)
+        print("\n".join(["Build profile:"] + timing.timer.summary()))
+        if args.profile_json:
+            timing.timer.write_json(args.profile_json)
+
+
+def _build(args, load_config):
     if load_config:
-        config.init_interactive(args)
+        with timing.timer.time("phase", "load_config"):
+            config.init_interactive(args)
     output_dir = util.path_join("_site", util.fs_site_path_helper())
-    writer = Writer(output_dir=output_dir)
+    writer = _writer.Writer(
+        output_dir=output_dir, incremental=args.incremental, jobs=args.jobs,
+        staged=args.staged, output_mode=args.output_mode)
     logger.debug("Running user's pre_build() function...")
     config.pre_build()
     try:
@@ -442,3 +564,21 @@ def do_info(args):
     else:
         print(
             "The specified directory has no _config.py, and cannot be built.")
+        return
+    if args.deps:
+        _print_template_dependencies(args)
+
+
+def _print_template_dependencies(args):
+    """Print the template dependency graph of the site in `src_dir`.
+    """
+    _validate_src_dir(args.src_dir)
+    config.init_interactive(args)
+    graph = dependency.site_graph()
+    print("\nTemplate dependencies:")
+    for path in sorted(graph.edges):
+        print(path)
+        for dep in graph.dependencies(path):
+            if dep is None:
+                dep = "(determined at render time)"
+            print("    " + dep)
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""Build manifest used for incremental builds.
+
+The manifest remembers, between runs, which files were written to the
+_site directory and which inputs (identified by content hash) each of
+them was produced from. On the next incremental build an output is
+only re-materialized when one of its inputs has changed, and outputs
+that are no longer produced are deleted.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+from . import __version__
+from . import util
+
+
+logger = logging.getLogger("blogofile.manifest")
+
+#Bump this whenever the layout of the manifest file changes:
+MANIFEST_FORMAT = 1
+#Input key that stands for everything in the site's underscore
+#directories (_config.py, _posts, _controllers...) except _templates
+DATA_INPUT = "<data>"
+#Input key that stands for everything in _templates, for templates
+#whose dependencies can't be determined before rendering
+TEMPLATES_INPUT = "<templates>"
+
+
+def hash_file(path, block_size=65536):
+    """Return the SHA-1 hex digest of the contents of a file.
+    """
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def output_key(path):
+    """Normalize an output path into the form used as a manifest key.
+    """
+    return os.path.normpath(path).lstrip(os.sep)
+
+
+class Manifest(object):
+    """The record of a single build.
+
+    outputs maps each output path (relative to the output directory)
+    to the inputs it was built from, or None for outputs that are
+    always regenerated (eg. everything written by controllers.)
+
+    files is a stat cache: source path -> [size, mtime, digest]. It
+    lets us avoid re-hashing files whose size and mtime are unchanged
+    since the previous build.
+
+    source_index is the sourceindex.SourceIndex to get the stat
+    results and file lists of the source tree from, if any.
+    """
+
+    def __init__(self, path, previous=None, source_index=None):
+        self.path = path
+        self.previous = previous
+        self.source_index = source_index
+        self.outputs = {}
+        self.files = {}
+
+    @classmethod
+    def load(cls, path):
+        """Load the manifest at path.
+
+        Returns None if there is no usable manifest, in which case the
+        caller should do a full build.
+        """
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        if data.get("format") != MANIFEST_FORMAT or \
+                data.get("version") != __version__:
+            logger.info("Build manifest is from another Blogofile version, "
+                        "ignoring it")
+            return None
+        manifest = cls(path)
+        manifest.outputs = data.get("outputs", {})
+        manifest.files = data.get("files", {})
+        return manifest
+
+    def save(self):
+        util.mkdir(os.path.dirname(self.path))
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"format": MANIFEST_FORMAT,
+                       "version": __version__,
+                       "outputs": self.outputs,
+                       "files": self.files}, f)
+        os.rename(tmp_path, self.path)
+
+    def digest(self, path):
+        """Return the content digest of a source file, reusing the
+        previous build's digest when the file's size and mtime have not
+        changed.
+        """
+        try:
+            return self.files[path][2]
+        except KeyError:
+            pass
+        st = None
+        if self.source_index is not None:
+            st = self.source_index.stat(path)
+        if st is None:
+            st = os.stat(path)
+        if self.previous is not None:
+            prev = self.previous.files.get(path)
+            if prev and prev[0] == st.st_size and prev[1] == st.st_mtime:
+                self.files[path] = prev
+                return prev[2]
+        digest = hash_file(path)
+        self.files[path] = [st.st_size, st.st_mtime, digest]
+        return digest
+
+    def record(self, output, inputs=None):
+        """Record that output was written from inputs.
+
+        Returns True if output was already recorded.
+        """
+        output = output_key(output)
+        recorded = output in self.outputs
+        self.outputs[output] = inputs
+        return recorded
+
+    def is_current(self, output, inputs, output_dir):
+        """Is output already up to date with respect to inputs?
+
+        If so, carry its entry over into this manifest.
+        """
+        if self.previous is None or inputs is None:
+            return False
+        output = output_key(output)
+        if self.previous.outputs.get(output) != inputs:
+            return False
+        if not os.path.isfile(util.path_join(output_dir, output)):
+            return False
+        self.record(output, inputs)
+        return True
+
+    def orphans(self):
+        """Yield the outputs of the previous build that were not
+        produced by this one.
+        """
+        if self.previous is None:
+            return
+        for output in sorted(self.previous.outputs):
+            if output not in self.outputs:
+                yield output
+
+
+def tree_digest(manifest, paths):
+    """Digest the contents of all the files in paths (recursively for
+    directories.)
+    """
+    h = hashlib.sha1(__version__.encode("utf-8"))
+    index = manifest.source_index
+    for name in sorted(paths):
+        if os.path.isfile(name):
+            files = [name]
+        elif index is not None:
+            files = sorted(entry.path for entry in index.files(name))
+        else:
+            files = sorted(util.recursive_file_list(name))
+        for path in files:
+            h.update(path.encode("utf-8", "replace"))
+            h.update(manifest.digest(path).encode("utf-8"))
+    return h.hexdigest()
+
+
+def data_digest(manifest, exclude=()):
+    """Digest all the files in the top level underscore directories of
+    the current directory (and the top level underscore files, like
+    _config.py), except the ones in exclude.
+
+    These are never copied to _site, but templates can depend on them
+    in arbitrary ways (through bf.config or controller data), so any
+    change in them invalidates every template output.
+    """
+    exclude = set(os.path.normpath(e) for e in exclude)
+    if manifest.source_index is not None:
+        names = [entry.name for entry in manifest.source_index.listdir()]
+    else:
+        names = os.listdir(".")
+    return tree_digest(manifest, [
+        name for name in names
+        if name.startswith("_") and os.path.normpath(name) not in exclude])
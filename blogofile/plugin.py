@@ -1,21 +1,25 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
+import importlib
+import json
 import logging
 import os
 import os.path
-import pkg_resources
 import sys
-from mako.lookup import TemplateLookup
 import six
-from . import controller
+from . import __version__
 from . import filter as _filter
-from . import template
+from . import lazymodule
 from .cache import bf
 from .cache import HierarchicalCache
 
 
 logger = logging.getLogger("blogofile.plugin")
 
+#Only needed to build sites:
+controller = lazymodule.lazy_import("blogofile.controller")
+template = lazymodule.lazy_import("blogofile.template")
+
 default_plugin_config = {
     "priority": 50.0,
     "enabled": False,
@@ -24,23 +28,152 @@ default_plugin_config = {
 reserved_attributes = ["mod", "filters", "controllers", "site_src"]
 
 
-def iter_plugins():
-    for plugin in pkg_resources.iter_entry_points("blogofile.plugins"):
-        yield plugin.load()
+#Entry point group plugins register themselves in:
+ENTRY_POINT_GROUP = "blogofile.plugins"
+
+#The metadata of the installed plugins, once discovered:
+_discovered = None
+
+
+def plugin_cache_path():
+    """Return the path of the file the metadata of the installed
+    plugins is kept in between runs.
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or \
+        os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_home, "blogofile", "plugins.json")
+
+
+def _path_fingerprint():
+    """Return what the installed plugins depend on: the Python search
+    path, and when each of its directories last changed (installing or
+    removing a distribution changes its directory.)
+
+    The current directory (in sys.path when running with -c or -m) is
+    usually the site's source, which changes all the time, so only its
+    name counts.
+    """
+    entries = []
+    for entry in sys.path:
+        if not entry:
+            entries.append([entry, None])
+            continue
+        try:
+            mtime = os.stat(entry).st_mtime
+        except OSError:
+            mtime = None
+        entries.append([entry, mtime])
+    return [__version__, sys.version, entries]
+
+
+def _entry_points():
+    """Return the (name, "module:attr") of the plugin entry points.
+    """
+    try:
+        from importlib import metadata
+    except ImportError:
+        import pkg_resources
+        return [(ep.name, "{0}:{1}".format(ep.module_name, ".".join(ep.attrs))
+                 if ep.attrs else ep.module_name)
+                for ep in pkg_resources.iter_entry_points(ENTRY_POINT_GROUP)]
+    try:
+        entry_points = metadata.entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:
+        # Python < 3.10:
+        entry_points = metadata.entry_points().get(ENTRY_POINT_GROUP, [])
+    return [(ep.name, ep.value) for ep in entry_points]
+
+
+def _load_entry_point(value):
+    module_name, _, attrs = value.partition(":")
+    obj = importlib.import_module(module_name.strip())
+    for attr in attrs.strip().split("."):
+        if attr:
+            obj = getattr(obj, attr)
+    return obj
+
+
+def _plugin_metadata(entry_point, module):
+    """Return what's kept of a plugin between runs: its entry point,
+    and the JSON serializable parts of its __dist__.
+    """
+    dist = {}
+    for key, value in module.__dist__.items():
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        dist[key] = value
+    dist["command_parser"] = "command_parser_setup" in module.__dist__
+    return {"entry_point": entry_point, "dist": dist}
+
+
+def discover_plugins(refresh=False):
+    """Return the metadata of the installed plugins: a list of dicts
+    with the plugin's entry point and __dist__ (with command_parser
+    telling whether it sets up a command parser.)
+
+    Discovering the plugins means importing them all, so the metadata
+    is kept in plugin_cache_path() until the Python search path
+    changes.
+    """
+    global _discovered
+    if _discovered is not None and not refresh:
+        return _discovered
+    fingerprint = _path_fingerprint()
+    cache_path = plugin_cache_path()
+    if not refresh:
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached["fingerprint"] == fingerprint:
+                _discovered = cached["plugins"]
+                return _discovered
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            pass
+    plugins = []
+    for name, entry_point in _entry_points():
+        try:
+            module = _load_entry_point(entry_point)
+        except Exception:
+            logger.exception("Cannot load plugin: {0}".format(name))
+            continue
+        plugins.append(_plugin_metadata(entry_point, module))
+    _discovered = plugins
+    try:
+        if not os.path.isdir(os.path.dirname(cache_path)):
+            os.makedirs(os.path.dirname(cache_path))
+        tmp_path = "{0}.{1}.tmp".format(cache_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump({"fingerprint": fingerprint, "plugins": plugins}, f)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError) as e:
+        logger.debug("Cannot save plugin metadata: {0}".format(e))
+    return plugins
+
+
+def iter_plugins(config_name=None):
+    """Import and yield the installed plugins (only the one with
+    config_name, if given.)
+    """
+    for info in discover_plugins():
+        if config_name is None or info["dist"].get("config_name") == \
+                config_name:
+            yield _load_entry_point(info["entry_point"])
 
 
 def get_by_name(name):
-    for plugin in iter_plugins():
+    for plugin in iter_plugins(config_name=name):
         if plugin.__dist__['config_name'] == name:
             return plugin
 
 
 def list_plugins(args):
-    for plugin in iter_plugins():
-        print("{0} ({1}) - {2} - {3}".format(plugin.__dist__['config_name'],
-                                             plugin.__dist__['version'],
-                                             plugin.__dist__['description'],
-                                             plugin.__dist__['author']))
+    for info in discover_plugins():
+        print("{0} ({1}) - {2} - {3}".format(info["dist"]['config_name'],
+                                             info["dist"]['version'],
+                                             info["dist"]['description'],
+                                             info["dist"]['author']))
 
 
 def check_plugin_config(module):
@@ -125,6 +258,7 @@ class PluginTools(object):
             "blogofile.plugins.{0}".format(self.module.__name__))
 
     def _template_lookup(self):
+        from mako.lookup import TemplateLookup
         return TemplateLookup(
             directories=[
                 "_templates", os.path.join(self.get_src_dir(), "_templates")],
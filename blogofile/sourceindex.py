@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""In-memory index of the site's source tree.
+
+The writer builds one SourceIndex per build (bf.writer.source_index).
+Every directory is read with os.scandir() at most once (os.listdir()
+and os.lstat() on Pythons before 3.5, which lack it), and the stat
+results of its entries are kept, so the writer's walk, the incremental
+build manifest, and any controller or plugin that wants to know about
+the source files can share them instead of each going to the disk.
+
+Directories are read lazily: walk() never reads the directories it
+prunes (the ignored ones, like _posts or .git), but they can still be
+listed explicitly, eg. bf.writer.source_index.files("_posts").
+"""
+import logging
+import os
+import stat
+
+from . import util
+
+
+logger = logging.getLogger("blogofile.sourceindex")
+
+
+class ListdirEntry(object):
+    """Stands in for the os.DirEntry objects of os.scandir() on
+    Pythons that don't have it, with the entry's lstat result read up
+    front.
+    """
+    __slots__ = ("name", "path", "_lstat")
+
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self._lstat = os.lstat(self.path)
+
+    def is_symlink(self):
+        return stat.S_ISLNK(self._lstat.st_mode)
+
+    def is_dir(self):
+        try:
+            return stat.S_ISDIR(self.stat().st_mode)
+        except OSError:
+            # A broken symlink
+            return False
+
+    def stat(self):
+        # Like os.DirEntry.stat(), follows symlinks:
+        if self.is_symlink():
+            return os.stat(self.path)
+        return self._lstat
+
+
+def listdir_entries(directory):
+    """Return ListdirEntry objects for the entries in directory, like
+    os.scandir() does with os.DirEntry objects.
+    """
+    entries = []
+    for name in os.listdir(directory):
+        try:
+            entries.append(ListdirEntry(directory, name))
+        except OSError:
+            # Removed since it was listed
+            pass
+    return entries
+
+
+scandir = getattr(os, "scandir", listdir_entries)
+
+
+class SourceEntry(object):
+    """A file or directory in the source tree.
+
+    path is relative to the top of the tree, with os.sep separators
+    and no leading "./". The stat result is that of the os.scandir()
+    entry (or ListdirEntry), which is only fetched once, when it's first
+    needed.
+    """
+    __slots__ = ("path", "name", "is_dir", "is_symlink", "_dir_entry",
+                 "_stat")
+
+    def __init__(self, path, dir_entry):
+        self.path = path
+        self.name = dir_entry.name
+        self.is_dir = dir_entry.is_dir()
+        self.is_symlink = dir_entry.is_symlink()
+        self._dir_entry = dir_entry
+        self._stat = None
+
+    def stat(self):
+        if self._stat is None:
+            self._stat = self._dir_entry.stat()
+            # The DirEntry isn't needed any more:
+            self._dir_entry = None
+        return self._stat
+
+    @property
+    def size(self):
+        return self.stat().st_size
+
+    @property
+    def mtime(self):
+        return self.stat().st_mtime
+
+    def __repr__(self):
+        return "<SourceEntry {0}{1}>".format(
+            self.path, os.sep if self.is_dir else "")
+
+
+class SourceIndex(object):
+    """The files and directories under top, read on demand.
+    """
+
+    def __init__(self, top="."):
+        self.top = top
+        # Directory path -> the SourceEntry objects in it, sorted by name:
+        self.__listings = {}
+        # Path -> SourceEntry, for every entry listed so far:
+        self.entries = {}
+
+    @staticmethod
+    def key(path):
+        """Normalize path into the form used as an index key.
+        """
+        path = os.path.normpath(path)
+        return "" if path == os.curdir else path
+
+    def listdir(self, directory=""):
+        """Return the entries in directory, sorted by name.
+
+        Raises OSError if it isn't a directory.
+        """
+        directory = self.key(directory)
+        try:
+            return self.__listings[directory]
+        except KeyError:
+            pass
+        listing = []
+        for dir_entry in scandir(os.path.join(self.top, directory)):
+            path = os.path.join(directory, dir_entry.name)
+            entry = SourceEntry(path, dir_entry)
+            listing.append(entry)
+            self.entries[path] = entry
+        listing.sort(key=lambda e: e.name)
+        self.__listings[directory] = listing
+        return listing
+
+    def get(self, path):
+        """Return the entry for path, or None if it doesn't exist.
+        """
+        path = self.key(path)
+        try:
+            return self.entries[path]
+        except KeyError:
+            pass
+        try:
+            self.listdir(os.path.dirname(path))
+        except OSError:
+            return None
+        return self.entries.get(path)
+
+    def stat(self, path):
+        """Return the stat result of path, or None if it doesn't exist.
+        """
+        entry = self.get(path)
+        return None if entry is None else entry.stat()
+
+    def walk(self, directory=""):
+        """Walk the tree below directory like os.walk(), skipping the
+        paths that match site.file_ignore_patterns.
+
+        Yields (root, dirs, files) tuples, where root is "." for the
+        top directory (so, joined with util.path_join, the top level
+        paths look like "./name" just as they do with os.walk(".")),
+        and dirs and files are sorted lists of names. Ignored
+        directories are pruned before they're read. Like os.walk(),
+        symlinks to directories are listed but not followed.
+        """
+        pending = [self.key(directory)]
+        while pending:
+            directory = pending.pop(0)
+            root = directory or os.curdir
+            dirs = []
+            files = []
+            subdirs = []
+            for entry in self.listdir(directory):
+                path = util.path_join(root, entry.name)
+                if util.should_ignore_path(path):
+                    logger.debug("Ignoring: " + path)
+                    continue
+                if entry.is_dir:
+                    dirs.append(entry.name)
+                    if not entry.is_symlink:
+                        subdirs.append(entry.path)
+                else:
+                    files.append(entry.name)
+            yield root, dirs, files
+            # Depth first, in name order, like os.walk():
+            pending[:0] = subdirs
+
+    def files(self, directory="", ignore=False):
+        """Return the entries of all the files below directory.
+
+        With ignore=True, paths matching site.file_ignore_patterns are
+        left out.
+        """
+        if ignore:
+            return [self.get(util.path_join(root, name))
+                    for root, dirs, files in self.walk(directory)
+                    for name in files]
+        found = []
+        pending = [self.key(directory)]
+        while pending:
+            subdirs = []
+            for entry in self.listdir(pending.pop(0)):
+                if not entry.is_dir:
+                    found.append(entry)
+                elif not entry.is_symlink:
+                    subdirs.append(entry.path)
+            pending[:0] = subdirs
+        return found
@@ -6,20 +6,30 @@ Templates are dictionaries. Any key/value pairs stored are supplied to
 the underlying template as name/values.
 """
 from __future__ import print_function
+import contextlib
 import copy
+import hashlib
+import io
 import logging
 import os.path
 import re
 import sys
-import tempfile
+import threading
 
 import jinja2
+import jinja2.bccache
+import jinja2.meta
+import jinja2.utils
 
 import mako
+import mako.lexer
 import mako.lookup
+import mako.parsetree
+import mako.runtime
 import mako.template
 
 from . import filter as _filter
+from . import timing
 from . import util
 from .cache import bf
 from .cache import Cache
@@ -51,15 +61,67 @@ class Template(dict):
         raise NotImplementedError(
             "Template base class cannot be used directly")
 
-    def write(self, path, rendered):
+    def streaming(self, path):
+        """Should rendering to path write straight to the file?
+        """
+        return bool(
+            path and bf.config.templates.get("stream_output", False))
+
+    def output_path(self, path):
+        """Record path as an output of the build, and return its
+        location inside the output directory.
+        """
+        reused = bf.writer.record_output(path)
         path = util.path_join(bf.writer.output_dir, path)
         # Create the parent directories if they don't exist:
         util.mkdir(os.path.split(path)[0])
-        if bf.config.site.overwrite_warning and os.path.exists(path):
+        if bf.config.site.overwrite_warning and reused:
             logger.warn("Location is used more than once: {0}".format(path))
-        with open(path, "wb") as f:
+        if os.path.lexists(path):
+            # Don't write through a hard link into a previous build:
+            os.remove(path)
+        return path
+
+    def write(self, path, rendered):
+        with open(self.output_path(path), "wb") as f:
             f.write(rendered)
 
+    @contextlib.contextmanager
+    def open_output(self, path):
+        """Open path in the output directory for streaming text into
+        it, as UTF-8.
+
+        If the block raises, the partially written file is removed.
+        """
+        path = self.output_path(path)
+        f = io.open(path, "w", encoding="utf-8", newline="")
+        try:
+            with f:
+                yield f
+        except:
+            os.remove(path)
+            raise
+
+    @classmethod
+    def find_dependencies(cls, src):
+        """Return the names of the other templates that the template
+        source src depends on.
+
+        A name of None means the dependency can't be determined before
+        rendering, so the template may depend on any other template.
+        """
+        return [None]
+
+    @classmethod
+    def put_base_template(cls, name, src):
+        """Make src available to this engine as a base template called
+        name, without writing it to a file.
+
+        Returns False if the engine can only load base templates from
+        files.
+        """
+        return False
+
     def render_prep(self, path):
         """Gather all the information we want to provide to the
         template before rendering.
@@ -122,7 +184,46 @@ class MakoTemplate(Template):
             MakoTemplate.template_lookup = mako.lookup.TemplateLookup(
                 directories=[".", base_template_dir],
                 input_encoding='utf-8', output_encoding='utf-8',
-                encoding_errors='replace')
+                encoding_errors='replace',
+                **cls.module_cache_options())
+
+    @classmethod
+    def module_cache_options(cls):
+        """Return the TemplateLookup options that keep the compiled
+        Python modules of file based templates on disk, so they can be
+        reused by later builds.
+
+        Compiled modules are named after the template path only, so a
+        changed template's module is compiled again in place. Mako
+        recompiles modules older than their template (and those of
+        other Mako versions.) The intermediate templates written to the
+        writer's temporary directory, which don't outlive the build,
+        are compiled in memory.
+        """
+        module_dir = bf.config.templates.mako.module_cache_dir
+        if module_dir is False:
+            return {}
+        if not module_dir:
+            module_dir = util.path_join(bf.config.site.cache_dir, "mako")
+        module_dir = os.path.abspath(module_dir)
+
+        def module_path(filename, uri):
+            filename = os.path.abspath(filename)
+            if os.path.dirname(filename) == bf.writer.temp_proc_dir:
+                return None
+            path = os.path.join(
+                module_dir,
+                hashlib.sha1(filename.encode("utf-8")).hexdigest() + ".py")
+            try:
+                if os.stat(path).st_mtime <= os.stat(filename).st_mtime:
+                    # Mako only compares whole seconds, and would keep
+                    # the module of a template changed in the second it
+                    # was compiled:
+                    os.remove(path)
+            except OSError:
+                pass
+            return path
+        return {"modulename_callable": module_path}
 
     @classmethod
     def add_default_template_path(cls, path):
@@ -137,6 +238,33 @@ class MakoTemplate(Template):
         if path not in lookup.directories:
             lookup.directories.append(path)
 
+    @classmethod
+    def put_base_template(cls, name, src):
+        cls.create_lookup()
+        cls.template_lookup.put_string(name, src)
+        return True
+
+    @classmethod
+    def find_dependencies(cls, src):
+        """Return the files named by the inherit, include and namespace
+        tags in src.
+        """
+        dependencies = []
+        nodes = [mako.lexer.Lexer(src).parse()]
+        while nodes:
+            node = nodes.pop(0)
+            if isinstance(node, (mako.parsetree.InheritTag,
+                                 mako.parsetree.IncludeTag,
+                                 mako.parsetree.NamespaceTag)) \
+                    and "file" in node.attributes:
+                name = node.attributes["file"]
+                if "${" in name:
+                    # Computed at render time
+                    name = None
+                dependencies.append(name)
+            nodes.extend(node.get_children())
+        return dependencies
+
     def render(self, path=None):
         self.render_prep(path)
         # Make sure bf_base_template is defined
@@ -151,6 +279,11 @@ class MakoTemplate(Template):
                 self.template_lookup.get_template(
                     bf.config.site.base_template))
         try:
+            if self.streaming(path):
+                with self.open_output(path) as f:
+                    self.mako_template.render_context(
+                        mako.runtime.Context(f, **self), **self)
+                return
             rendered = self.mako_template.render(**self)
             if path:
                 self.write(path, rendered)
@@ -169,20 +302,64 @@ class JinjaTemplateLoader(jinja2.FileSystemLoader):
         jinja2.FileSystemLoader.__init__(self, searchpath)
         self.bf_base_template = bf.util.path_join(
             "_templates", bf.config.site.base_template)
+        # Base templates that only exist in memory, name -> source:
+        self.base_templates = {}
 
     def get_source(self, environment, template):
-        print(template)
-        if template == "bf_base_template":
-            with open(self.bf_base_template) as f:
-                return (f.read(), self.bf_base_template, lambda: False)
+        if template == "bf_base_template" and \
+                self.bf_base_template in self.base_templates:
+            name = self.bf_base_template
+            return (self.base_templates[name], None,
+                    lambda: name == self.bf_base_template)
+        elif template == "bf_base_template":
+            path = self.bf_base_template
+            with io.open(path, encoding=self.encoding) as f:
+                source = f.read()
+            mtime = os.path.getmtime(path)
+
+            def uptodate():
+                # bf_base_template can point to a different file for
+                # each render:
+                try:
+                    return path == self.bf_base_template and \
+                        os.path.getmtime(path) == mtime
+                except OSError:
+                    return False
+            return (source, path, uptodate)
         else:
             return (super(JinjaTemplateLoader, self)
                     .get_source(environment, template))
 
 
+class JinjaBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """A bytecode cache that leaves out the intermediate templates
+    written to the writer's temporary directory, which don't outlive
+    the build.
+    """
+    def get_bucket(self, environment, name, filename, source):
+        if filename is not None and \
+                os.path.dirname(filename) == bf.writer.temp_proc_dir:
+            # Compile it, but don't load or save its bytecode:
+            bucket = jinja2.bccache.Bucket(
+                environment, self.get_cache_key(name, filename),
+                self.get_source_checksum(source))
+            bucket.bf_temporary = True
+            return bucket
+        return jinja2.FileSystemBytecodeCache.get_bucket(
+            self, environment, name, filename, source)
+
+    def dump_bytecode(self, bucket):
+        if not getattr(bucket, "bf_temporary", False):
+            jinja2.FileSystemBytecodeCache.dump_bytecode(self, bucket)
+
+
 class JinjaTemplate(Template):
     name = "jinja2"
     template_lookup = None
+    # Compiled templates, keyed by source string, for templates that are
+    # constructed from src (eg. by controllers) rather than loaded:
+    src_cache_size = 400
+    src_cache = None
 
     def __init__(self, template_name, caller=None, lookup=None, src=None):
         """Templates can be provided in 2 ways:
@@ -208,9 +385,46 @@ class JinjaTemplate(Template):
     @classmethod
     def create_lookup(cls):
         if cls.template_lookup is None:
+            # Templates in the source dir are looked up last, so they
+            # don't shadow the ones in _templates:
             cls.template_lookup = jinja2.Environment(
                 loader=JinjaTemplateLoader([base_template_dir,
-                                            bf.writer.temp_proc_dir]))
+                                            bf.writer.temp_proc_dir,
+                                            "."]),
+                bytecode_cache=cls.bytecode_cache())
+
+    @classmethod
+    def bytecode_cache(cls):
+        """Return a bytecode cache that keeps compiled templates on disk
+        between builds, or None if it's disabled.
+
+        Jinja2 checks the source checksum of each cached template, so
+        changed templates are always recompiled.
+        """
+        cache_dir = bf.config.templates.jinja2.bytecode_cache_dir
+        if cache_dir is False:
+            return None
+        if not cache_dir:
+            cache_dir = util.path_join(bf.config.site.cache_dir, "jinja2")
+        cache_dir = os.path.abspath(cache_dir)
+        util.mkdir(cache_dir)
+        return JinjaBytecodeCache(cache_dir)
+
+    def compile_src(self):
+        """Return the compiled template for self.src, compiling each
+        distinct source only once per lookup environment.
+        """
+        cls = JinjaTemplate
+        if cls.src_cache is None:
+            cls.src_cache = jinja2.utils.LRUCache(cls.src_cache_size)
+        try:
+            lookup, compiled = cls.src_cache[self.src]
+        except KeyError:
+            lookup = compiled = None
+        if lookup is not self.template_lookup:
+            compiled = self.template_lookup.from_string(self.src)
+            cls.src_cache[self.src] = (self.template_lookup, compiled)
+        return compiled
 
     @classmethod
     def add_default_template_path(cls, path):
@@ -224,6 +438,20 @@ class JinjaTemplate(Template):
         if path not in lookup.loader.searchpath:
             lookup.loader.searchpath.append(path)
 
+    @classmethod
+    def put_base_template(cls, name, src):
+        cls.create_lookup()
+        cls.template_lookup.loader.base_templates[name] = src
+        return True
+
+    @classmethod
+    def find_dependencies(cls, src):
+        """Return the templates referenced by the extends, include,
+        import and from tags in src.
+        """
+        return list(jinja2.meta.find_referenced_templates(
+            jinja2.Environment().parse(src)))
+
     def render(self, path=None):
         # Ensure that bf_base_template is set:
         if "bf_base_template" in self:
@@ -233,7 +461,7 @@ class JinjaTemplate(Template):
             self["bf_base_template"] = (
                 self.template_lookup.loader.bf_base_template)
         if self.src:
-            self.jinja_template = self.template_lookup.from_string(self.src)
+            self.jinja_template = self.compile_src()
         # elif os.path.isfile(self.template_name):
         #     with open(self.template_name) as t_file:
         #         self.jinja_template = self.template_lookup.from_string(
@@ -243,6 +471,11 @@ class JinjaTemplate(Template):
                 self.template_name)
         self.render_prep(path)
         try:
+            if self.streaming(path):
+                with self.open_output(path) as f:
+                    for chunk in self.jinja_template.generate(self):
+                        f.write(chunk)
+                return
             rendered = bytes(self.jinja_template.render(self), "utf-8")
             if path:
                 self.write(path, rendered)
@@ -258,12 +491,58 @@ class JinjaTemplate(Template):
 class FilterTemplate(Template):
     name = "filter"
     chain = None
+    # Base templates that only exist in memory, name -> source:
+    base_templates = {}
+    # Content filtered ahead of rendering by prefilter_templates(),
+    # template name -> (chain, source, filtered content):
+    prefiltered = {}
+    # Base templates split at the content marker,
+    # name -> ((marker, mtime, size), segments):
+    base_segments = {}
 
     def __init__(self, template_name, caller=None, lookup=None, src=None):
         Template.__init__(self, template_name, caller)
         self.src = src
         self.marker = bf.config.templates.content_blocks.filter.replacement
 
+    @classmethod
+    def find_dependencies(cls, src):
+        """Filtered content is always placed into the base template.
+        """
+        return ["bf_base_template"]
+
+    @classmethod
+    def put_base_template(cls, name, src):
+        FilterTemplate.base_templates[name] = src
+        FilterTemplate.base_segments.pop(name, None)
+        return True
+
+    def base_template_segments(self):
+        """Return the source of the base template, split at the content
+        marker.
+
+        The split is done once, and redone when the base template is
+        put again (in memory) or modified (on disk.)
+        """
+        name = self["bf_base_template"]
+        in_memory = name in self.base_templates
+        if in_memory:
+            key = (self.marker,)
+        else:
+            st = os.stat(name)
+            key = (self.marker, st.st_mtime, st.st_size)
+        cached = FilterTemplate.base_segments.get(name)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+        if in_memory:
+            base = self.base_templates[name]
+        else:
+            with open(name) as f:
+                base = f.read()
+        segments = base.split(self.marker)
+        FilterTemplate.base_segments[name] = (key, segments)
+        return segments
+
     def render(self, path=None):
         self.render_prep(path)
         try:
@@ -272,11 +551,23 @@ class FilterTemplate(Template):
                     src = f.read()
             else:
                 src = self.src
-            # Run the filter chain:
-            html = _filter.run_chain(self.chain, src)
-            # Place the html into the base template:
-            with open(self["bf_base_template"]) as f:
-                html = f.read().replace(self.marker, html)
+            # Run the filter chain, unless that was done already:
+            prefiltered = self.prefiltered.pop(self.template_name, None)
+            if prefiltered is not None and \
+                    prefiltered[:2] == (self.chain, src):
+                html = prefiltered[2]
+            else:
+                html = _filter.run_chain(self.chain, src)
+            # Place the html between the segments of the base template:
+            segments = self.base_template_segments()
+            if self.streaming(path):
+                with self.open_output(path) as f:
+                    f.write(segments[0])
+                    for segment in segments[1:]:
+                        f.write(html)
+                        f.write(segment)
+                return
+            html = html.join(segments)
             html = bytes(html, "utf-8")
             if path:
                 self.write(path, html)
@@ -308,6 +599,33 @@ def get_engine_for_template_name(template_name):
             "templates.engines: {0}".format(template_name))
 
 
+def prefilter_templates(template_names):
+    """Run the filter chains of the filter templates (Markdown, reST,
+    etc.) among template_names in one batch, so that filters with a
+    run_batch function can process them all at once.
+
+    The results are kept until the templates are rendered.
+    """
+    documents = []
+    names = []
+    for template_name in template_names:
+        try:
+            engine = get_engine_for_template_name(template_name)
+        except TemplateEngineError:
+            continue
+        if not (isinstance(engine, type) and
+                issubclass(engine, FilterTemplate)) or engine.chain is None:
+            continue
+        with open(template_name) as f:
+            documents.append((engine.chain, f.read()))
+        names.append(template_name)
+    if len(documents) < 2:
+        return
+    results = _filter.run_chain_batch(documents)
+    for template_name, (chain, src), html in zip(names, documents, results):
+        FilterTemplate.prefiltered[template_name] = (chain, src, html)
+
+
 def get_base_template_path():
     return bf.util.path_join("_templates", bf.config.site.base_template)
 
@@ -327,13 +645,16 @@ def materialize_alternate_base_engine(template_name, location, attrs={},
       1) Load the base template source, and mark the content block
          for later replacement.
 
-      2) Materialize the base template in a temporary location with
-         attrs.
+      2) Materialize the base template.
 
       3) Convert the HTML to new template type by replacing the marker.
 
       4) Materialize the template setting bf_base_template to
          the new base template we created.
+
+    Steps 1 to 3 don't depend on attrs, so they are done once per build
+    for each base template and engine pair (see
+    intermediate_base_template.)
     """
     # Since we're mucking with the template attrs, make sure we copy
     # them and don't modify the original ones:
@@ -342,11 +663,39 @@ def materialize_alternate_base_engine(template_name, location, attrs={},
         base_engine = get_engine_for_template_name(
             bf.config.site.base_template)
     template_engine = get_engine_for_template_name(template_name)
-    base_template_src = get_base_template_src()
-    if not lookup:
-        lookup = base_engine.template_lookup
-    else:
+    if lookup:
         base_engine.add_default_template_path(bf.writer.temp_proc_dir)
+    attrs["bf_base_template"] = intermediate_base_template(
+        base_engine, template_engine)
+    materialize_template(
+        template_name, location, attrs, base_engine=template_engine)
+
+
+# Intermediate base templates of the current build,
+# (base engine, template engine, base template) -> name:
+_intermediate_base_templates = {}
+
+
+def intermediate_base_template(base_engine, template_engine):
+    """Return the name of the site base template converted from
+    base_engine into a base template for template_engine.
+
+    The converted template is kept in memory by the template engine if
+    it supports that, otherwise it's written to the writer's temporary
+    directory.
+    """
+    base_template_path = get_base_template_path()
+    key = (base_engine.name, template_engine.name, base_template_path,
+           os.path.getmtime(base_template_path), bf.writer.temp_proc_dir)
+    try:
+        return _intermediate_base_templates[key]
+    except KeyError:
+        pass
+    # Forget the templates of previous builds:
+    for old_key in list(_intermediate_base_templates):
+        if old_key[-1] != bf.writer.temp_proc_dir:
+            del _intermediate_base_templates[old_key]
+    base_template_src = get_base_template_src()
     # Replace the content block with our own marker:
     prev_content_block = bf.config.templates.content_blocks[base_engine.name]
     new_content_block = (
@@ -356,24 +705,37 @@ def materialize_alternate_base_engine(template_name, location, attrs={},
     html = str(base_engine(None, src=base_template_src).render(), "utf-8")
     html = template_content_place_holder.sub(
         new_content_block.replacement, html)
-    new_base_template = tempfile.mktemp(
-        suffix="." + template_engine.name, prefix="bf_template",
-        dir=bf.writer.temp_proc_dir)
-    with open(new_base_template, "w") as f:
-        logger.debug(
-            "Writing intermediate base template: {0}"
-            .format(new_base_template))
-        f.write(html)
-    attrs["bf_base_template"] = new_base_template
-    materialize_template(
-        template_name, location, attrs, base_engine=template_engine)
-    os.remove(new_base_template)
+    name = "bf_template_{0}.{1}".format(
+        hashlib.sha1(html.encode("utf-8")).hexdigest(), template_engine.name)
+    if template_engine.put_base_template(name, html):
+        logger.debug("Created intermediate base template: {0}".format(name))
+    else:
+        name = util.path_join(bf.writer.temp_proc_dir, name)
+        with open(name, "w") as f:
+            logger.debug(
+                "Writing intermediate base template: {0}".format(name))
+            f.write(html)
+    _intermediate_base_templates[key] = name
+    return name
+
+
+#Held while rendering a template, since templates share bf (and its
+#template_context) with each other. Controllers running on several
+#threads (see site.controller_threads) take turns rendering:
+render_lock = threading.RLock()
 
 
 def materialize_template(template_name, location, attrs={}, lookup=None,
                          base_engine=None, caller=None):
     """Render a named template with attrs to a location in the _site dir.
     """
+    with render_lock:
+        _materialize_template(template_name, location, attrs, lookup,
+                              base_engine, caller)
+
+
+def _materialize_template(template_name, location, attrs, lookup,
+                          base_engine, caller):
     # Find the appropriate template engine based on the file ending:
     template_engine = get_engine_for_template_name(template_name)
     if not base_engine:
@@ -383,7 +745,8 @@ def materialize_template(template_name, location, attrs={}, lookup=None,
     if base_engine == template_engine or base_engine == template_engine.name:
         template = template_engine(template_name, caller=caller, lookup=lookup)
         template.update(attrs)
-        template.render(location)
+        with timing.timer.time("template", template_name):
+            template.render(location)
     else:
         materialize_alternate_base_engine(
             template_name, location, attrs=attrs, caller=caller, lookup=lookup,
@@ -0,0 +1,19 @@
+import os
+import shutil
+from tempfile import mkdtemp
+from mock import patch
+
+
+def isolate_plugin_cache(test_case):
+    """Keep the plugin metadata cache of test_case in a temporary
+    directory instead of the user's home, and discover the plugins
+    again.
+    """
+    from .. import plugin
+    cache_dir = mkdtemp()
+    test_case.addCleanup(shutil.rmtree, cache_dir)
+    patcher = patch.dict(os.environ, {'XDG_CACHE_HOME': cache_dir})
+    patcher.start()
+    test_case.addCleanup(patcher.stop)
+    test_case.addCleanup(setattr, plugin, '_discovered', None)
+    plugin._discovered = None
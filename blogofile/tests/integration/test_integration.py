@@ -8,12 +8,20 @@ try:
     import unittest2 as unittest        # For Python 2.6
 except ImportError:
     import unittest                     # flake8 ignore # NOQA
+from mock import patch
+from ... import config
 from ... import main
+from ... import template
+from ... import writer
+from .. import isolate_plugin_cache
 
 
 class TestBlogofileCommands(unittest.TestCase):
     """Intrgration tests for the blogofile commands.
     """
+    def setUp(self):
+        isolate_plugin_cache(self)
+
     def _call_entry_point(self, *args):
         main.main(*args)
 
@@ -36,3 +44,367 @@ class TestBlogofileCommands(unittest.TestCase):
         self._call_entry_point(['blogofile', 'init', src_dir])
         self._call_entry_point(['blogofile', 'build', '-s', src_dir])
         self.assertIn('_site', os.listdir(src_dir))
+
+    def _make_site(self):
+        """Create a small site with a template, a static file, and a base
+        template, and return its source directory.
+        """
+        self.addCleanup(os.chdir, os.getcwd())
+        self.addCleanup(
+            setattr, template.MakoTemplate, 'template_lookup', None)
+        src_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, src_dir)
+        os.rmdir(src_dir)
+        self._call_entry_point(['blogofile', 'init', src_dir])
+        os.makedirs(os.path.join(src_dir, '_templates'))
+        os.makedirs(os.path.join(src_dir, 'css'))
+        files = {
+            os.path.join('_templates', 'site.mako'):
+                '<html>${next.body()}</html>',
+            'index.html.mako': '<%inherit file="site.mako" />home',
+            os.path.join('css', 'site.css'): 'body {}',
+        }
+        for path, content in files.items():
+            with open(os.path.join(src_dir, path), 'wt') as f:
+                f.write(content)
+        return src_dir
+
+    def test_blogofile_build_incremental_skips_unchanged(self):
+        """`blogofile build --incremental` leaves unchanged outputs alone
+        """
+        src_dir = self._make_site()
+        build = ['blogofile', 'build', '--incremental', '-s', src_dir]
+        self._call_entry_point(build)
+        index = os.path.join(src_dir, '_site', 'index.html')
+        os.utime(index, (0, 0))
+        self._call_entry_point(build)
+        self.assertEqual(os.stat(index).st_mtime, 0)
+
+    def test_blogofile_build_incremental_removes_orphans(self):
+        """`blogofile build --incremental` deletes outputs w/o a source
+        """
+        src_dir = self._make_site()
+        build = ['blogofile', 'build', '--incremental', '-s', src_dir]
+        self._call_entry_point(build)
+        os.remove(os.path.join(src_dir, 'css', 'site.css'))
+        self._call_entry_point(build)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(src_dir, '_site'))),
+            ['index.html'])
+
+    def test_blogofile_build_incremental_base_template_change(self):
+        """`blogofile build --incremental` rebuilds pages when
+        _templates change
+        """
+        src_dir = self._make_site()
+        build = ['blogofile', 'build', '--incremental', '-s', src_dir]
+        self._call_entry_point(build)
+        with open(os.path.join(src_dir, '_templates', 'site.mako'), 'wt') as f:
+            f.write('<body>${next.body()}</body>')
+        # Mako only notices template changes with a 1 second resolution:
+        template.MakoTemplate.template_lookup = None
+        self._call_entry_point(build)
+        with open(os.path.join(src_dir, '_site', 'index.html')) as f:
+            self.assertEqual(f.read(), '<body>home</body>')
+
+    def test_blogofile_build_jobs(self):
+        """`blogofile build --jobs 2` materializes all templates
+        """
+        src_dir = self._make_site()
+        for i in range(4):
+            path = os.path.join(src_dir, 'page{0}.html.mako'.format(i))
+            with open(path, 'wt') as f:
+                f.write('<%inherit file="site.mako" />page {0}'.format(i))
+        self._call_entry_point(
+            ['blogofile', 'build', '-j', '2', '-s', src_dir])
+        for i in range(4):
+            path = os.path.join(src_dir, '_site', 'page{0}.html'.format(i))
+            with open(path) as f:
+                self.assertEqual(f.read(), '<html>page {0}</html>'.format(i))
+
+    def test_blogofile_build_jobs_location_used_twice(self):
+        """`blogofile build --jobs 2` warns about a template writing a
+        location a controller wrote
+        """
+        src_dir = self._make_site()
+        # Controller settings outlive the build:
+        self.addCleanup(config.controllers.pop, 'pages', None)
+        os.makedirs(os.path.join(src_dir, '_controllers'))
+        files = {
+            os.path.join('_controllers', 'pages.py'): (
+                'from blogofile.cache import bf\n'
+                'def run():\n'
+                '    bf.template.materialize_template(\n'
+                '        "plain.mako", "index.html")\n'),
+            os.path.join('_templates', 'plain.mako'): 'plain',
+            'page.html.mako': 'page',
+        }
+        for path, content in files.items():
+            with open(os.path.join(src_dir, path), 'wt') as f:
+                f.write(content)
+        with open(os.path.join(src_dir, '_config.py'), 'at') as f:
+            f.write('\ncontrollers.pages.enabled = True\n')
+        with patch.object(writer.logger, 'warn') as mock_warn:
+            self._call_entry_point(
+                ['blogofile', 'build', '-j', '2', '-s', src_dir])
+        self.assertIn(
+            'Location is used more than once: index.html',
+            [call[0][0] for call in mock_warn.call_args_list])
+
+    def test_blogofile_build_incremental_partial_change(self):
+        """`blogofile build --incremental` only rebuilds the pages that
+        include a changed template
+        """
+        src_dir = self._make_site()
+        files = {
+            os.path.join('_templates', 'nav.mako'): 'nav',
+            'nav.html.mako':
+                '<%inherit file="site.mako" /><%include file="nav.mako"/>',
+        }
+        for path, content in files.items():
+            with open(os.path.join(src_dir, path), 'wt') as f:
+                f.write(content)
+        build = ['blogofile', 'build', '--incremental', '-s', src_dir]
+        self._call_entry_point(build)
+        index = os.path.join(src_dir, '_site', 'index.html')
+        nav = os.path.join(src_dir, '_site', 'nav.html')
+        os.utime(index, (0, 0))
+        os.utime(nav, (0, 0))
+        with open(os.path.join(src_dir, '_templates', 'nav.mako'), 'wt') as f:
+            f.write('new nav')
+        self._call_entry_point(build)
+        self.assertEqual(os.stat(index).st_mtime, 0)
+        self.assertNotEqual(os.stat(nav).st_mtime, 0)
+
+    def test_blogofile_build_staged_failure_keeps_site(self):
+        """`blogofile build --staged` leaves _site alone when the build
+        fails
+        """
+        src_dir = self._make_site()
+        build = ['blogofile', 'build', '--staged', '-s', src_dir]
+        self._call_entry_point(build)
+        with open(os.path.join(src_dir, 'index.html.mako'), 'wt') as f:
+            f.write('${1 / 0}')
+        template.MakoTemplate.template_lookup = None
+        self.assertRaises(ZeroDivisionError, self._call_entry_point, build)
+        with open(os.path.join(src_dir, '_site', 'index.html')) as f:
+            self.assertEqual(f.read(), '<html>home</html>')
+        self.assertEqual(
+            [name for name in os.listdir(src_dir) if name.startswith('_site')],
+            ['_site'])
+
+    def test_blogofile_build_staged_incremental_controller_in_place(self):
+        """`blogofile build --staged --incremental` leaves _site alone
+        when a controller rewrites a file in place and the build fails
+        """
+        src_dir = self._make_site()
+        # Controller settings outlive the build:
+        self.addCleanup(config.controllers.pop, 'notes', None)
+        os.makedirs(os.path.join(src_dir, '_controllers'))
+        files = {
+            os.path.join('_controllers', 'notes.py'): (
+                'import os\n'
+                'from blogofile.cache import bf\n'
+                'def run():\n'
+                '    with open(os.path.join(bf.writer.output_dir,\n'
+                '                           "notes.txt"), "w") as f:\n'
+                '        f.write(open("_notes").read())\n'),
+            '_notes': 'old',
+        }
+        for path, content in files.items():
+            with open(os.path.join(src_dir, path), 'wt') as f:
+                f.write(content)
+        with open(os.path.join(src_dir, '_config.py'), 'at') as f:
+            f.write('\ncontrollers.notes.enabled = True\n')
+        build = ['blogofile', 'build', '--staged', '--incremental',
+                 '-s', src_dir]
+        self._call_entry_point(build)
+        with open(os.path.join(src_dir, '_notes'), 'wt') as f:
+            f.write('new')
+        with open(os.path.join(src_dir, 'index.html.mako'), 'wt') as f:
+            f.write('${1 / 0}')
+        template.MakoTemplate.template_lookup = None
+        self.assertRaises(ZeroDivisionError, self._call_entry_point, build)
+        with open(os.path.join(src_dir, '_site', 'notes.txt')) as f:
+            self.assertEqual(f.read(), 'old')
+
+    def test_blogofile_build_staged_symlink(self):
+        """`blogofile build --staged symlink` flips a _site symlink over
+        to each new build
+        """
+        src_dir = self._make_site()
+        build = ['blogofile', 'build', '--staged', 'symlink', '-s', src_dir]
+        self._call_entry_point(build)
+        site = os.path.join(src_dir, '_site')
+        first = os.path.realpath(site)
+        self._call_entry_point(build)
+        self.assertTrue(os.path.islink(site))
+        self.assertNotEqual(os.path.realpath(site), first)
+        self.assertFalse(os.path.exists(first))
+        with open(os.path.join(site, 'index.html')) as f:
+            self.assertEqual(f.read(), '<html>home</html>')
+
+    def test_blogofile_build_staged_keep_inode(self):
+        """`blogofile build --staged keep_inode` keeps the inode of _site
+        """
+        src_dir = self._make_site()
+        site = os.path.join(src_dir, '_site')
+        os.mkdir(site)
+        inode = os.stat(site).st_ino
+        self._call_entry_point(
+            ['blogofile', 'build', '--staged', 'keep_inode', '-s', src_dir])
+        self.assertEqual(os.stat(site).st_ino, inode)
+        self.assertEqual(sorted(os.listdir(site)), ['css', 'index.html'])
+
+    def test_blogofile_build_sync(self):
+        """`blogofile build --sync` keeps unchanged static files and
+        deletes stale outputs
+        """
+        src_dir = self._make_site()
+        stale = os.path.join(src_dir, 'stale.html')
+        with open(stale, 'wt') as f:
+            f.write('stale')
+        build = ['blogofile', 'build', '--sync', '-s', src_dir]
+        self._call_entry_point(build)
+        os.remove(stale)
+        site = os.path.join(src_dir, '_site')
+        css = os.path.join(site, 'css', 'site.css')
+        with open(css, 'wt') as f:
+            # Same size and mtime, so it must not be copied again:
+            f.write('BODY {}')
+        src_st = os.stat(os.path.join(src_dir, 'css', 'site.css'))
+        os.utime(css, (src_st.st_atime, src_st.st_mtime))
+        self._call_entry_point(build)
+        with open(css) as f:
+            self.assertEqual(f.read(), 'BODY {}')
+        self.assertEqual(sorted(os.listdir(site)), ['css', 'index.html'])
+
+    def test_blogofile_build_sync_keeps_controller_outputs(self):
+        """`blogofile build --sync` keeps the files controllers write
+        straight into the output dir
+        """
+        src_dir = self._make_site()
+        # Controller settings outlive the build:
+        self.addCleanup(config.controllers.pop, 'feed', None)
+        os.makedirs(os.path.join(src_dir, '_controllers'))
+        with open(os.path.join(src_dir, '_controllers', 'feed.py'),
+                  'wt') as f:
+            f.write('import os\n'
+                    'from blogofile.cache import bf\n'
+                    'def run():\n'
+                    '    path = os.path.join(bf.writer.output_dir, '
+                    '"feed.xml")\n'
+                    '    with open(path, "w") as f:\n'
+                    '        f.write("<feed/>")\n')
+        with open(os.path.join(src_dir, '_config.py'), 'at') as f:
+            f.write('\ncontrollers.feed.enabled = True\n')
+        build = ['blogofile', 'build', '--sync', '-s', src_dir]
+        self._call_entry_point(build)
+        self._call_entry_point(build)
+        self.assertEqual(
+            sorted(os.listdir(os.path.join(src_dir, '_site'))),
+            ['css', 'feed.xml', 'index.html'])
+
+    def _make_gallery_site(self, cache=True):
+        """Make a site with a controller copying _photos to the output
+        directory in a unit of work, counting its runs in _runs.
+        """
+        src_dir = self._make_site()
+        # Controller settings outlive the build:
+        self.addCleanup(config.controllers.pop, 'gallery', None)
+        os.makedirs(os.path.join(src_dir, '_controllers'))
+        os.makedirs(os.path.join(src_dir, '_photos'))
+        files = {
+            os.path.join('_controllers', 'gallery.py'): (
+                'import os, shutil\n'
+                'from blogofile.cache import bf\n'
+                'def copy():\n'
+                '    with open("_runs", "a") as f:\n'
+                '        f.write("x")\n'
+                '    shutil.copytree("_photos", os.path.join(\n'
+                '        bf.writer.output_dir, "photos"))\n'
+                'def run():\n'
+                '    bf.writer.run_unit("photos", copy, inputs=["_photos"],\n'
+                '                       outputs=["photos"])\n'),
+            os.path.join('_photos', 'a.jpg'): 'photo',
+        }
+        for path, content in files.items():
+            with open(os.path.join(src_dir, path), 'wt') as f:
+                f.write(content)
+        with open(os.path.join(src_dir, '_config.py'), 'at') as f:
+            f.write('\ncontrollers.gallery.enabled = True\n'
+                    'site.controller_cache = {0}\n'.format(cache))
+        return src_dir
+
+    def test_blogofile_build_controller_unit_cache(self):
+        """`blogofile build` reuses the outputs of unchanged controller
+        units of work
+        """
+        src_dir = self._make_gallery_site()
+        build = ['blogofile', 'build', '-s', src_dir]
+        photo = os.path.join(src_dir, '_site', 'photos', 'a.jpg')
+        runs = os.path.join(src_dir, '_runs')
+        self._call_entry_point(build)
+        self._call_entry_point(build)
+        with open(runs) as f:
+            self.assertEqual(f.read(), 'x')
+        with open(photo) as f:
+            self.assertEqual(f.read(), 'photo')
+        with open(os.path.join(src_dir, '_photos', 'a.jpg'), 'wt') as f:
+            f.write('new photo')
+        self._call_entry_point(build)
+        with open(runs) as f:
+            self.assertEqual(f.read(), 'xx')
+        with open(photo) as f:
+            self.assertEqual(f.read(), 'new photo')
+
+    def test_blogofile_build_controller_unit_cache_off(self):
+        """`blogofile build` runs every unit of work without
+        site.controller_cache
+        """
+        src_dir = self._make_gallery_site(cache=False)
+        build = ['blogofile', 'build', '-s', src_dir]
+        self._call_entry_point(build)
+        self._call_entry_point(build)
+        with open(os.path.join(src_dir, '_runs')) as f:
+            self.assertEqual(f.read(), 'xx')
+        self.assertFalse(
+            os.path.exists(os.path.join(src_dir, '_bf_cache', 'units')))
+
+    def _check_unit_rerun(self, option, cache=True):
+        """A changed unit of work is run again on an empty output when
+        the build keeps the previous outputs
+        """
+        src_dir = self._make_gallery_site(cache)
+        with open(os.path.join(src_dir, '_photos', 'b.jpg'), 'wt') as f:
+            f.write('photo')
+        build = ['blogofile', 'build', option, '-s', src_dir]
+        photos = os.path.join(src_dir, '_site', 'photos')
+        self._call_entry_point(build)
+        os.remove(os.path.join(src_dir, '_photos', 'b.jpg'))
+        with open(os.path.join(src_dir, '_photos', 'a.jpg'), 'wt') as f:
+            f.write('new photo')
+        self._call_entry_point(build)
+        with open(os.path.join(src_dir, '_runs')) as f:
+            self.assertEqual(f.read(), 'xx')
+        self.assertEqual(os.listdir(photos), ['a.jpg'])
+        with open(os.path.join(photos, 'a.jpg')) as f:
+            self.assertEqual(f.read(), 'new photo')
+
+    def test_blogofile_build_incremental_controller_unit_rerun(self):
+        """`blogofile build --incremental` reruns changed units of work
+        on an empty output
+        """
+        self._check_unit_rerun('--incremental')
+
+    def test_blogofile_build_sync_controller_unit_rerun(self):
+        """`blogofile build --sync` reruns changed units of work on an
+        empty output
+        """
+        self._check_unit_rerun('--sync')
+
+    def test_blogofile_build_sync_controller_unit_rerun_no_cache(self):
+        """`blogofile build --sync` reruns units of work on an empty
+        output without site.controller_cache
+        """
+        self._check_unit_rerun('--sync', cache=False)
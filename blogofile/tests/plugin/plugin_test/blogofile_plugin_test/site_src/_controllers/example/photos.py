@@ -1,26 +1,37 @@
 import shutil
 import os
 from blogofile import util
+from blogofile.cache import bf
 
 from . import plugin
 
-def copy_photos():
-    plugin.logger.info("Copying gallery photos..")
+def photo_src_dir():
     if plugin.config.gallery.src:
         #The user has supplied their own photos
-        shutil.copytree(plugin.config.gallery.src,
-                        util.fs_site_path_helper(
-                "_site",plugin.config.gallery.path,"img"))
-    else:
-        #The user has not configured the photo path
-        #Use the supplied photos as an example
-        shutil.copytree(os.path.join(plugin.tools.get_src_dir(),"_photos"),
-                        util.fs_site_path_helper(
-                "_site",plugin.config.gallery.path,"img"))
+        return plugin.config.gallery.src
+    #The user has not configured the photo path
+    #Use the supplied photos as an example
+    return os.path.join(plugin.tools.get_src_dir(),"_photos")
+
+def photo_output_dir():
+    #Relative to the output directory of the build:
+    return util.fs_site_path_helper(plugin.config.gallery.path,"img")
+
+def copy_photos():
+    plugin.logger.info("Copying gallery photos..")
+    #With site.controller_cache, only copy the photos when they have
+    #changed since the last build:
+    bf.writer.run_unit(
+        "plugin_test.photos",
+        lambda: shutil.copytree(photo_src_dir(),
+                                util.path_join(bf.writer.output_dir,
+                                               photo_output_dir())),
+        inputs=[photo_src_dir()],
+        config=["plugins.plugin_test.gallery"],
+        outputs=[photo_output_dir()])
 
 def get_photo_names():
-    img_dir = util.fs_site_path_helper(
-        "_site",plugin.config.gallery.path,"img")
+    img_dir = util.path_join(bf.writer.output_dir,photo_output_dir())
     return [p for p in os.listdir(img_dir) if p.lower().endswith(".jpg")]
 
 def write_pages(photos):
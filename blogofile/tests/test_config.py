@@ -2,6 +2,8 @@
 """Unit tests for blogofile config module.
 """
 import os
+import shutil
+from tempfile import mkdtemp
 try:
     import unittest2 as unittest        # For Python 2.6
 except ImportError:
@@ -12,6 +14,9 @@ from mock import (
     patch,
     )
 from .. import config
+from .. import filter as _filter
+from .. import lazymodule
+from . import isolate_plugin_cache
 
 
 class TestConfigModuleAttributes(unittest.TestCase):
@@ -69,6 +74,9 @@ class TestConfigModuleAttributes(unittest.TestCase):
 class TestConfigInitInteractive(unittest.TestCase):
     """Unit tests for init_interactive function.
     """
+    def setUp(self):
+        isolate_plugin_cache(self)
+
     def _call_fut(self, *args):
         """Call the function under test.
         """
@@ -94,6 +102,9 @@ class TestConfigInitInteractive(unittest.TestCase):
 class TestConfigLoadConfig(unittest.TestCase):
     """Unit tests for _load_config function.
     """
+    def setUp(self):
+        isolate_plugin_cache(self)
+
     def _call_fut(self, *args):
         """Call the function under test.
         """
@@ -111,3 +122,78 @@ class TestConfigLoadConfig(unittest.TestCase):
         """
         with self.assertRaises(IOError):
             self._call_fut('_config.py')
+
+
+class TestConfigSnapshot(unittest.TestCase):
+    """Unit tests for reloading an unchanged config from its snapshot.
+    """
+    def setUp(self):
+        isolate_plugin_cache(self)
+        self.temp_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.addCleanup(os.chdir, os.getcwd())
+        self.addCleanup(setattr, config, '_snapshot', None)
+        os.chdir(self.temp_dir)
+        self._write_config('site.url = "http://www.example.com/snap/"\n')
+
+    def _write_config(self, src, mtime=None):
+        with open('_config.py', 'w') as f:
+            f.write(src)
+        if mtime is not None:
+            os.utime('_config.py', (mtime, mtime))
+
+    def _call_fut(self):
+        return config._load_config('_config.py')
+
+    def test_restores_snapshot(self):
+        """_load_config restores an unchanged config without executing it
+        """
+        self._call_fut()
+        config.site.build_state = 'built'
+        with patch.object(config, '_compile_config') as mock_compile:
+            self._call_fut()
+        self.assertFalse(mock_compile.called)
+        self.assertEqual(config.site.url, 'http://www.example.com/snap/')
+        self.assertNotIn('build_state', config.site)
+
+    def test_changed_config_loaded(self):
+        """_load_config executes the config again once it changes
+        """
+        self._call_fut()
+        mtime = os.stat('_config.py').st_mtime
+        self._write_config('site.url = "http://www.example.com/new/"\n',
+                           mtime + 10)
+        self._call_fut()
+        self.assertEqual(config.site.url, 'http://www.example.com/new/')
+
+    def test_init_runs_again(self):
+        """restored filters are initialized again, but not imported again
+        """
+        self.addCleanup(config.filters.pop, 'counter', None)
+        os.mkdir('_filters')
+        with open(os.path.join('_filters', 'counter.py'), 'w') as f:
+            f.write('imports = []\n'
+                    'inits = []\n'
+                    'imports.append(1)\n'
+                    'def init():\n'
+                    '    inits.append(1)\n'
+                    'def run(content):\n'
+                    '    return content\n')
+        self._call_fut()
+        self.assertEqual(_filter.run_chain('counter', 'text'), 'text')
+        mod = lazymodule.resolve(_filter.get_filter('counter'))
+        with patch.object(config, '_compile_config') as mock_compile:
+            self._call_fut()
+        self.assertFalse(mock_compile.called)
+        _filter.init_filters()
+        self.assertIs(_filter.get_filter('counter'), mod)
+        self.assertEqual(mod.imports, [1])
+        self.assertEqual(mod.inits, [1, 1])
+
+    def test_compiled_once(self):
+        """_compile_config reuses the code of an unchanged file
+        """
+        code = config._compile_config('_config.py')
+        self.assertIs(config._compile_config('_config.py'), code)
+        self._write_config('site.url = None\n')
+        self.assertIsNot(config._compile_config('_config.py'), code)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for blogofile controller scheduling.
+"""
+import threading
+import types
+try:
+    import unittest2 as unittest        # For Python 2.6
+except ImportError:
+    import unittest                     # flake8 ignore # NOQA
+from .. import controller
+from .. import exception
+from ..cache import HierarchicalCache
+
+
+def _make_controller(name, priority=50.0, run=None, **config):
+    mod = types.ModuleType(name)
+    mod.__file__ = name + '.py'
+    if run is not None:
+        mod.run = run
+    c = HierarchicalCache(mod=mod, priority=priority, enabled=True)
+    c.update(config)
+    return c
+
+
+class TestControllerDependencies(unittest.TestCase):
+    """Unit tests for controller_dependencies function.
+    """
+    def _call_fut(self, controllers):
+        return controller.controller_dependencies(controllers)
+
+    def test_undeclared_in_priority_order(self):
+        """controllers without declarations wait for all before them
+        """
+        controllers = [_make_controller('a'), _make_controller('b'),
+                       _make_controller('c')]
+        self.assertEqual(self._call_fut(controllers),
+                         [set(), set([0]), set([0, 1])])
+
+    def test_requires(self):
+        """controllers only wait for the providers of what they require
+        """
+        controllers = [
+            _make_controller('blog', provides='posts'),
+            _make_controller('gallery', provides=['photos']),
+            _make_controller('sitemap', requires=['posts', 'photos']),
+            _make_controller('feed', requires='posts')]
+        self.assertEqual(self._call_fut(controllers),
+                         [set(), set(), set([0, 1]), set([0])])
+
+    def test_after_undeclared(self):
+        """declared controllers don't wait for undeclared ones before them
+        """
+        controllers = [_make_controller('a'),
+                       _make_controller('b', provides='b'),
+                       _make_controller('c')]
+        self.assertEqual(self._call_fut(controllers),
+                         [set(), set(), set([0, 1])])
+
+    def test_unicode_keys(self):
+        """provides and requires can be unicode strings
+        """
+        controllers = [_make_controller('blog', provides=u'posts'),
+                       _make_controller('feed', requires=u'posts')]
+        self.assertEqual(self._call_fut(controllers), [set(), set([0])])
+
+
+class TestRunOrder(unittest.TestCase):
+    """Unit tests for run_order function.
+    """
+    def _call_fut(self, controllers):
+        return controller.run_order(
+            controllers, controller.controller_dependencies(controllers))
+
+    def test_provider_first(self):
+        """run_order runs providers before lower priority requirers
+        """
+        controllers = [_make_controller('sitemap', requires='posts'),
+                       _make_controller('blog', provides='posts')]
+        self.assertEqual(self._call_fut(controllers), [1, 0])
+
+    def test_undeclared_between(self):
+        """run_order runs a provider of lower priority than an undeclared
+        controller before the requirer of higher priority
+        """
+        controllers = [_make_controller('b', priority=90, requires='posts'),
+                       _make_controller('a', priority=50),
+                       _make_controller('c', priority=10, provides='posts')]
+        self.assertEqual(self._call_fut(controllers), [2, 0, 1])
+
+    def test_cycle(self):
+        """run_order raises BuildError for a dependency cycle
+        """
+        controllers = [_make_controller('a', provides='a', requires='b'),
+                       _make_controller('b', provides='b', requires='a')]
+        with self.assertRaises(exception.BuildError):
+            self._call_fut(controllers)
+
+
+class TestRunAll(unittest.TestCase):
+    """Unit tests for run_all function.
+    """
+    def _call_fut(self, controllers, threads):
+        namespace = HierarchicalCache()
+        for c in controllers:
+            namespace.controllers[c.mod.__name__] = c
+        return controller.run_all([namespace], threads=threads)
+
+    def test_independent_overlap(self):
+        """run_all runs independent controllers at the same time
+        """
+        barrier = threading.Barrier(2, timeout=5)
+        ran = []
+
+        def run():
+            barrier.wait()
+            ran.append(True)
+        self._call_fut([_make_controller('a', run=run, provides='a'),
+                        _make_controller('b', run=run, provides='b')],
+                       threads=2)
+        self.assertEqual(ran, [True, True])
+
+    def test_dependencies_respected(self):
+        """run_all runs controllers after the ones they require
+        """
+        ran = []
+        self._call_fut(
+            [_make_controller('sitemap', priority=90, requires='posts',
+                              run=lambda: ran.append('sitemap')),
+             _make_controller('blog', priority=10, provides='posts',
+                              run=lambda: ran.append('blog'))],
+            threads=2)
+        self.assertEqual(ran, ['blog', 'sitemap'])
+
+    def test_error(self):
+        """run_all raises the error of a failed controller
+        """
+        def run():
+            raise ValueError('broken')
+        ran = []
+        with self.assertRaises(ValueError):
+            self._call_fut(
+                [_make_controller('a', priority=90, run=run, provides='a'),
+                 _make_controller('b', priority=10, requires='a',
+                                  run=lambda: ran.append('b'))],
+                threads=2)
+        self.assertEqual(ran, [])
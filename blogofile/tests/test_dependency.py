@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for blogofile template dependency graph.
+"""
+import os
+import shutil
+from tempfile import mkdtemp
+try:
+    import unittest2 as unittest        # For Python 2.6
+except ImportError:
+    import unittest                     # flake8 ignore # NOQA
+from mock import patch
+from .. import dependency
+from .. import template
+
+
+class TestFindDependencies(unittest.TestCase):
+    """Unit tests for template engine find_dependencies methods.
+    """
+    def test_mako_inherit_include_namespace(self):
+        """Mako find_dependencies finds inherit, include & namespace files
+        """
+        src = ('<%inherit file="site.mako"/>'
+               '<%namespace name="n" file="/lib.mako"/>'
+               '<%def name="f()"><%include file="part.mako"/></%def>')
+        self.assertEqual(
+            template.MakoTemplate.find_dependencies(src),
+            ['site.mako', '/lib.mako', 'part.mako'])
+
+    def test_mako_computed_file(self):
+        """Mako find_dependencies returns None for computed file names
+        """
+        src = '<%include file="${name}"/>'
+        self.assertEqual(
+            template.MakoTemplate.find_dependencies(src), [None])
+
+    def test_jinja_extends_include_import(self):
+        """Jinja find_dependencies finds extends, include & import names
+        """
+        src = ('{% extends "bf_base_template" %}'
+               '{% import "macros.jinja2" as m %}'
+               '{% block content %}{% include name %}{% endblock %}')
+        self.assertEqual(
+            template.JinjaTemplate.find_dependencies(src),
+            ['bf_base_template', 'macros.jinja2', None])
+
+    def test_filter_depends_on_base_template(self):
+        """Filter templates depend on the base template
+        """
+        self.assertEqual(
+            template.MarkdownTemplate.find_dependencies('# Title'),
+            ['bf_base_template'])
+
+
+@patch.object(template, 'get_engine_for_template_name',
+              return_value=template.MakoTemplate)
+class TestDependencyGraph(unittest.TestCase):
+    """Unit tests for DependencyGraph class.
+    """
+    def setUp(self):
+        self.addCleanup(os.chdir, os.getcwd())
+        src_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, src_dir)
+        os.chdir(src_dir)
+        os.makedirs(os.path.join('_templates', 'inc'))
+        files = {
+            os.path.join('_templates', 'site.mako'):
+                '<%include file="inc/nav.mako"/>${next.body()}',
+            os.path.join('_templates', 'inc', 'nav.mako'): 'nav',
+            os.path.join('_templates', 'other.mako'): 'other',
+            'index.html.mako': '<%inherit file="site.mako"/>',
+        }
+        for path, content in files.items():
+            with open(path, 'wt') as f:
+                f.write(content)
+
+    def test_dependencies(self, mock_get_engine):
+        """dependencies returns direct and indirect dependencies
+        """
+        graph = dependency.DependencyGraph()
+        self.assertEqual(
+            graph.dependencies('index.html.mako'),
+            [os.path.join('_templates', 'site.mako'),
+             os.path.join('_templates', 'inc', 'nav.mako')])
+
+    def test_dependents(self, mock_get_engine):
+        """dependents returns the templates that depend on a template
+        """
+        graph = dependency.DependencyGraph()
+        graph.add_template('index.html.mako')
+        graph.add_template(os.path.join('_templates', 'other.mako'))
+        self.assertEqual(
+            graph.dependents(os.path.join('_templates', 'inc', 'nav.mako')),
+            [os.path.join('_templates', 'site.mako'), 'index.html.mako'])
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for blogofile static file copy strategies.
+"""
+import os
+import shutil
+from tempfile import mkdtemp
+try:
+    import unittest2 as unittest        # For Python 2.6
+except ImportError:
+    import unittest                     # flake8 ignore # NOQA
+from mock import patch
+from .. import filecopy
+
+
+class TestCopyStrategies(unittest.TestCase):
+    """Unit tests for CopyStrategy classes.
+    """
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.src = os.path.join(self.tmp_dir, 'src.jpg')
+        self.dst = os.path.join(self.tmp_dir, 'dst.jpg')
+        with open(self.src, 'wb') as f:
+            f.write(os.urandom(200000))
+
+    def _assert_copied(self):
+        with open(self.src, 'rb') as fsrc, open(self.dst, 'rb') as fdst:
+            self.assertEqual(fsrc.read(), fdst.read())
+
+    def test_strategies_copy_contents(self):
+        """every strategy copies the file contents (or falls back to copy)
+        """
+        for strategy in filecopy.strategies + (filecopy.HardLinkCopy,):
+            strategy().copy(self.src, self.dst)
+            self._assert_copied()
+            os.remove(self.dst)
+
+    def test_fallback_to_copy(self):
+        """copy falls back to a plain copy when the strategy fails
+        """
+        copier = filecopy.HardLinkCopy()
+        with patch.object(filecopy.os, 'link', side_effect=OSError):
+            copier.copy(self.src, self.dst)
+        self._assert_copied()
+        self.assertEqual(copier.fallback_files, 1)
+        self.assertEqual(copier.bytes, 200000)
+
+    def test_get_strategy_unknown(self):
+        """get_strategy raises ValueError for unknown strategy names
+        """
+        self.assertRaises(ValueError, filecopy.get_strategy, 'teleport')
+
+
+class TestChooseStrategy(unittest.TestCase):
+    """Unit tests for choose_strategy function.
+    """
+    def _call_fut(self, **kwargs):
+        """Call the function under test.
+        """
+        return filecopy.choose_strategy(
+            self.src_dir, self.dst_dir, **kwargs)
+
+    def setUp(self):
+        tmp_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.src_dir = os.path.join(tmp_dir, 'src')
+        self.dst_dir = os.path.join(tmp_dir, 'dst')
+
+    def test_hard_links(self):
+        """choose_strategy prefers hard links when they're turned on
+        """
+        copier = self._call_fut(use_hard_links=True)
+        self.assertEqual(copier.name, 'hardlink')
+        self.assertEqual(os.listdir(self.src_dir), [])
+        self.assertEqual(os.listdir(self.dst_dir), [])
+
+    def test_plain_copy(self):
+        """choose_strategy uses a plain copy when nothing else works
+        """
+        for strategy in filecopy.strategies[:-1]:
+            patcher = patch.object(
+                strategy, 'copy_file', side_effect=OSError)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.assertEqual(self._call_fut().name, 'copy')
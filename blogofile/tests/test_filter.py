@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for blogofile filter chains.
+"""
+import os
+import types
+try:
+    import unittest2 as unittest        # For Python 2.6
+except ImportError:
+    import unittest                     # flake8 ignore # NOQA
+from .. import exception
+from .. import filter as _filter
+from ..cache import bf
+from ..cache import HierarchicalCache
+
+
+class TestCompileChain(unittest.TestCase):
+    """Unit tests for compile_chain function.
+    """
+    def setUp(self):
+        self.saved_filters = bf.config.filters
+        bf.config.filters = HierarchicalCache()
+        _filter.invalidate_chains()
+
+    def tearDown(self):
+        bf.config.filters = self.saved_filters
+        _filter.invalidate_chains()
+
+    def _add_filter(self, name, run):
+        mod = types.ModuleType(name)
+        mod.run = run
+        bf.config.filters[name] = HierarchicalCache(mod=mod)
+
+    def _call_fut(self, chain):
+        return _filter.compile_chain(chain)
+
+    def test_runs_filters_in_order(self):
+        """compiled chain runs content through its filters in order
+        """
+        self._add_filter('a', lambda content: content + 'a')
+        self._add_filter('b', lambda content: content + 'b')
+        self.assertEqual(self._call_fut('a, b')('-'), '-ab')
+
+    def test_passes_context(self):
+        """compiled chain passes context to filters that take it
+        """
+        self._add_filter('a', lambda content, context: context)
+        self.assertEqual(self._call_fut('a')('-', 'context'), 'context')
+
+    def test_sequence_chain(self):
+        """compile_chain accepts a sequence of filter names
+        """
+        self._add_filter('a', lambda content: content + 'a')
+        self.assertEqual(self._call_fut(['a', 'a'])('-'), '-aa')
+
+    def test_unicode_chain(self):
+        """compile_chain parses unicode chain strings (eg. from YAML)
+        """
+        self._add_filter('a', lambda content: content + 'a')
+        self._add_filter('b', lambda content: content + 'b')
+        self.assertEqual(self._call_fut(u'a, b')('-'), '-ab')
+
+    def test_none_filters(self):
+        """compile_chain skips none in chain strings
+        """
+        self._add_filter('a', lambda content: content + 'a')
+        self.assertEqual(self._call_fut('none, a')('-'), '-a')
+
+    def test_cached(self):
+        """compile_chain returns the same object for the same chain
+        """
+        self._add_filter('a', lambda content: content + 'a')
+        self.assertIs(self._call_fut('a'), self._call_fut('a'))
+
+    def test_new_namespace(self):
+        """compile_chain recompiles chains when the filters are replaced
+        """
+        self._add_filter('a', lambda content: content + 'a')
+        chain = self._call_fut('a')
+        bf.config.filters = HierarchicalCache()
+        self._add_filter('a', lambda content: content + 'A')
+        self.assertIsNot(self._call_fut('a'), chain)
+        self.assertEqual(self._call_fut('a')('-'), '-A')
+
+    def test_not_loaded(self):
+        """compile_chain raises FilterNotLoaded for unknown filters
+        """
+        with self.assertRaises(exception.FilterNotLoaded):
+            self._call_fut('missing')
+
+    def test_no_run(self):
+        """compile_chain raises FilterNotLoaded for filters without run
+        """
+        bf.config.filters['a'] = HierarchicalCache(
+            mod=types.ModuleType('a'))
+        with self.assertRaises(exception.FilterNotLoaded):
+            self._call_fut('a')
+
+
+class TestRunChainBatch(unittest.TestCase):
+    """Unit tests for run_chain_batch function.
+    """
+    def setUp(self):
+        self.saved_filters = bf.config.filters
+        bf.config.filters = HierarchicalCache()
+        _filter.invalidate_chains()
+        self.batches = []
+
+    def tearDown(self):
+        bf.config.filters = self.saved_filters
+        _filter.invalidate_chains()
+
+    def _add_filter(self, name, batch=False):
+        mod = types.ModuleType(name)
+        mod.run = lambda content: content + name
+        if batch:
+            def run_batch(contents, contexts):
+                self.batches.append((name, contents, contexts))
+                return [content + name.upper() for content in contents]
+            mod.run_batch = run_batch
+        bf.config.filters[name] = HierarchicalCache(mod=mod)
+
+    def _call_fut(self, documents):
+        return _filter.run_chain_batch(documents)
+
+    def test_groups_by_chain(self):
+        """run_chain_batch hands documents with the same chain together
+        """
+        self._add_filter('a', batch=True)
+        self._add_filter('b', batch=True)
+        results = self._call_fut(
+            [('a', '1'), ('b', '2'), ('a', '3', 'context'), (None, '4')])
+        self.assertEqual(results, ['1A', '2b', '3A', '4'])
+        self.assertEqual(self.batches,
+                         [('a', ['1', '3'], [None, 'context'])])
+
+    def test_fallback_to_run(self):
+        """run_chain_batch runs filters without run_batch one by one
+        """
+        self._add_filter('a', batch=True)
+        self._add_filter('b')
+        results = self._call_fut([('a, b', '1'), ('a, b', '2')])
+        self.assertEqual(results, ['1Ab', '2Ab'])
+        self.assertEqual(len(self.batches), 1)
+
+    def test_wrong_number_of_results(self):
+        """run_chain_batch complains when run_batch loses documents
+        """
+        self._add_filter('a')
+        bf.config.filters.a.mod.run_batch = lambda contents, contexts: []
+        with self.assertRaises(ValueError):
+            self._call_fut([('a', '1'), ('a', '2')])
+
+
+class TestParallelFilters(unittest.TestCase):
+    """Unit tests for running filter chains on worker processes.
+    """
+    def setUp(self):
+        self.saved_filters = bf.config.filters
+        self.saved_site = bf.config.site
+        bf.config.filters = HierarchicalCache()
+        bf.config.site = HierarchicalCache(filter_processes=2)
+        _filter.invalidate_chains()
+        mod = types.ModuleType('pid')
+        mod.run = lambda content, context=None: '{0}:{1}'.format(
+            content, os.getpid())
+        bf.config.filters.pid = HierarchicalCache(mod=mod)
+
+    def tearDown(self):
+        _filter.close_pool()
+        bf.config.filters = self.saved_filters
+        bf.config.site = self.saved_site
+        _filter.invalidate_chains()
+
+    def _call_fut(self, documents):
+        return _filter.run_chain_batch(documents)
+
+    def test_in_order(self):
+        """run_chain_batch returns the workers' results in order
+        """
+        results = self._call_fut([('pid', str(i)) for i in range(5)])
+        self.assertEqual([r.split(':')[0] for r in results],
+                         [str(i) for i in range(5)])
+        self.assertNotIn(str(os.getpid()),
+                         [r.split(':')[1] for r in results])
+
+    def test_context_in_process(self):
+        """run_chain_batch filters documents with a context in process
+        """
+        results = self._call_fut(
+            [('pid', '0'), ('pid', '1', object()), ('pid', '2')])
+        self.assertEqual(results[1], '1:{0}'.format(os.getpid()))
+        self.assertNotEqual(results[0], '0:{0}'.format(os.getpid()))
+
+    def test_in_process(self):
+        """run_chain_batch filters in process with site.filter_processes 1
+        """
+        bf.config.site.filter_processes = 1
+        results = self._call_fut([('pid', str(i)) for i in range(3)])
+        self.assertEqual(
+            results, ['{0}:{1}'.format(i, os.getpid()) for i in range(3)])
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the filter result cache.
+"""
+import os
+import shutil
+import sys
+import types
+from tempfile import mkdtemp
+try:
+    import unittest2 as unittest        # For Python 2.6
+except ImportError:
+    import unittest                     # flake8 ignore # NOQA
+from .. import filter as _filter
+from .. import filtercache
+from ..cache import bf
+from ..cache import HierarchicalCache
+
+
+def _make_filter(name, run, cacheable=True):
+    mod = types.ModuleType(name)
+    mod.run = run
+    filter_config = HierarchicalCache()
+    filter_config.name = name
+    filter_config.cacheable = cacheable
+    filter_config.mod = mod
+    return filter_config
+
+
+class TestFilterCache(unittest.TestCase):
+    """Unit tests for FilterCache class.
+    """
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def _make_one(self, max_size=1024):
+        return filtercache.FilterCache(self.temp_dir, max_size)
+
+    def test_get_missing(self):
+        """get returns None for results that aren't cached
+        """
+        cache = self._make_one()
+        self.assertIsNone(cache.get('0' * 40))
+        self.assertEqual(cache.misses, 1)
+
+    def test_put_get(self):
+        """get returns the result put under a key
+        """
+        cache = self._make_one()
+        cache.put('ab' * 20, u'<p>été</p>')
+        self.assertEqual(cache.get('ab' * 20), u'<p>été</p>')
+        self.assertEqual(cache.hits, 1)
+
+    def test_key_depends_on_content(self):
+        """key differs for different content
+        """
+        cache = self._make_one()
+        filters = [_make_filter('markdown', lambda c: c)]
+        self.assertNotEqual(cache.key(filters, 'a'), cache.key(filters, 'b'))
+
+    def test_key_depends_on_config(self):
+        """key differs for filters with different configs
+        """
+        cache = self._make_one()
+        one = _make_filter('markdown', lambda c: c)
+        two = _make_filter('markdown', lambda c: c)
+        two.extensions = ['toc']
+        self.assertNotEqual(cache.key([one], 'a'), cache.key([two], 'a'))
+
+    def test_key_depends_on_chain(self):
+        """key differs for different filter chains
+        """
+        cache = self._make_one()
+        one = _make_filter('markdown', lambda c: c)
+        two = _make_filter('syntax_highlight', lambda c: c)
+        self.assertNotEqual(cache.key([one], 'a'),
+                            cache.key([two, one], 'a'))
+
+    def test_key_depends_on_package_files(self):
+        """key differs when any file of a package filter changes
+        """
+        package_dir = os.path.join(self.temp_dir, 'pkg')
+        os.mkdir(package_dir)
+        for fn in ('__init__.py', 'extension.py'):
+            with open(os.path.join(package_dir, fn), 'w') as f:
+                f.write('run = None\n')
+        one = _make_filter('pkg', lambda c: c)
+        one.mod.__file__ = os.path.join(package_dir, '__init__.py')
+        key = self._make_one().key([one], 'a')
+        with open(os.path.join(package_dir, 'extension.py'), 'w') as f:
+            f.write('run = 1\n')
+        self.assertNotEqual(self._make_one().key([one], 'a'), key)
+
+    def test_key_depends_on_library_versions(self):
+        """key differs when a library the filter uses is upgraded
+        """
+        library = types.ModuleType('fake_markdown_library')
+        library.__version__ = '1.0'
+        library.markdown = lambda c: c
+        library.markdown.__module__ = 'fake_markdown_library'
+        sys.modules['fake_markdown_library'] = library
+        self.addCleanup(sys.modules.pop, 'fake_markdown_library')
+        one = _make_filter('markdown', library.markdown)
+        key = self._make_one().key([one], 'a')
+        library.__version__ = '2.0'
+        self.assertNotEqual(self._make_one().key([one], 'a'), key)
+
+    def test_prune_least_recently_used(self):
+        """prune deletes the least recently used results first
+        """
+        cache = self._make_one(max_size=25)
+        for n, key in enumerate(('aa' * 20, 'bb' * 20, 'cc' * 20)):
+            cache.put(key, 'x' * 10)
+            path = os.path.join(self.temp_dir, key[:2], key[2:])
+            os.utime(path, (1000 + n, 1000 + n))
+        # Reading the oldest one makes it the most recently used:
+        cache.get('aa' * 20)
+        self.assertEqual(cache.prune(), 20)
+        self.assertIsNone(cache.get('bb' * 20))
+        self.assertEqual(cache.get('aa' * 20), 'x' * 10)
+        self.assertEqual(cache.get('cc' * 20), 'x' * 10)
+
+
+class TestRunChain(unittest.TestCase):
+    """Unit tests for run_chain with the result cache.
+    """
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.calls = []
+        self.saved_filters = bf.config.filters
+        bf.config.filters = HierarchicalCache()
+        _filter.result_cache = filtercache.FilterCache(self.temp_dir, 4096)
+
+    def tearDown(self):
+        _filter.result_cache = None
+        bf.config.filters = self.saved_filters
+        shutil.rmtree(self.temp_dir)
+
+    def _add_filter(self, name, cacheable=True):
+        def run(content):
+            self.calls.append(name)
+            return '{0}({1})'.format(name, content)
+        bf.config.filters[name] = _make_filter(name, run, cacheable)
+
+    def _call_fut(self, chain, content):
+        return _filter.run_chain(chain, content)
+
+    def test_cached_result(self):
+        """run_chain only runs cacheable filters once for the same content
+        """
+        self._add_filter('markdown')
+        self.assertEqual(self._call_fut('markdown', 'a'), 'markdown(a)')
+        self.assertEqual(self._call_fut('markdown', 'a'), 'markdown(a)')
+        self.assertEqual(self.calls, ['markdown'])
+
+    def test_changed_content(self):
+        """run_chain runs cacheable filters again for changed content
+        """
+        self._add_filter('markdown')
+        self._call_fut('markdown', 'a')
+        self.assertEqual(self._call_fut('markdown', 'b'), 'markdown(b)')
+        self.assertEqual(self.calls, ['markdown', 'markdown'])
+
+    def test_not_cacheable(self):
+        """run_chain always runs filters that aren't cacheable
+        """
+        self._add_filter('markdown')
+        self._add_filter('stamp', cacheable=False)
+        self._call_fut('markdown, stamp', 'a')
+        self.assertEqual(self._call_fut('markdown, stamp', 'a'),
+                         'stamp(markdown(a))')
+        self.assertEqual(self.calls, ['markdown', 'stamp', 'stamp'])
+
+    def test_no_cache(self):
+        """run_chain runs every filter when the cache is off
+        """
+        _filter.result_cache = None
+        self._add_filter('markdown')
+        self._call_fut('markdown', 'a')
+        self._call_fut('markdown', 'a')
+        self.assertEqual(self.calls, ['markdown', 'markdown'])
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for deferred importing of filters and controllers.
+"""
+import os
+import shutil
+import sys
+import types
+from tempfile import mkdtemp
+try:
+    import unittest2 as unittest        # For Python 2.6
+except ImportError:
+    import unittest                     # flake8 ignore # NOQA
+from .. import controller
+from .. import filter as _filter
+from .. import lazymodule
+from .. import util                     # NOQA, sets up bf.util
+from ..cache import HierarchicalCache
+
+
+class TestStaticConfig(unittest.TestCase):
+    """Unit tests for static_config function.
+    """
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+
+    def _call_fut(self, src):
+        path = os.path.join(self.temp_dir, 'mod.py')
+        with open(path, 'wt') as f:
+            f.write(src)
+        return lazymodule.static_config(path)
+
+    def test_dict(self):
+        """static_config reads a dict literal config
+        """
+        self.assertEqual(
+            self._call_fut('config = {"name": "Markdown",\n'
+                           '          "aliases": ["md"]}\n'),
+            {'name': 'Markdown', 'aliases': ['md']})
+
+    def test_hierarchical_cache(self):
+        """static_config reads a HierarchicalCache config as one
+        """
+        config = self._call_fut(
+            'from blogofile.cache import HierarchicalCache as HC\n'
+            'config = HC(name="Blog", posts=HC(per_page=5))\n')
+        self.assertIsInstance(config, HierarchicalCache)
+        self.assertEqual(config.posts.per_page, 5)
+
+    def test_no_config(self):
+        """static_config returns {} for modules without a config
+        """
+        self.assertEqual(self._call_fut('def run(content):\n    pass\n'), {})
+
+    def test_not_literal(self):
+        """static_config returns None for configs built by code
+        """
+        self.assertIsNone(self._call_fut('config = make_config()\n'))
+
+    def test_modified(self):
+        """static_config returns None for configs changed later on
+        """
+        self.assertIsNone(self._call_fut(
+            'config = {"name": "x"}\nconfig["name"] = "y"\n'))
+        self.assertIsNone(self._call_fut(
+            'config = {"name": "x"}\nconfig.update(name="y")\n'))
+
+
+class TestLazyModule(unittest.TestCase):
+    """Unit tests for LazyModule class.
+    """
+    def _make_one(self):
+        self.loads = []
+
+        def load():
+            self.loads.append(True)
+            mod = types.ModuleType('real')
+            mod.run = 'run'
+            return mod
+        return lazymodule.LazyModule('real', 'real.py', load)
+
+    def test_not_loaded(self):
+        """LazyModule knows the module name and file without loading it
+        """
+        mod = self._make_one()
+        self.assertEqual((mod.__name__, mod.__file__), ('real', 'real.py'))
+        self.assertFalse(lazymodule.is_loaded(mod))
+        self.assertEqual(self.loads, [])
+
+    def test_loads_once(self):
+        """LazyModule loads the module on first attribute use, once
+        """
+        mod = self._make_one()
+        self.assertEqual(mod.run, 'run')
+        self.assertEqual(mod.run, 'run')
+        self.assertTrue(lazymodule.is_loaded(mod))
+        self.assertEqual(self.loads, [True])
+
+
+class TestLazyLoading(unittest.TestCase):
+    """Unit tests for the deferred loading of filters and controllers.
+    """
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.imported = os.path.join(self.temp_dir, 'imported')
+
+    def _write_module(self, name, src):
+        path = os.path.join(self.temp_dir, name + '.py')
+        with open(path, 'wt') as f:
+            f.write('with open({0!r}, "a") as f:\n'
+                    '    f.write("{1} ")\n'.format(self.imported, name))
+            f.write(src)
+        return path
+
+    def _imported(self):
+        if not os.path.exists(self.imported):
+            return []
+        with open(self.imported) as f:
+            return f.read().split()
+
+    def test_filter(self):
+        """load_filter(lazy=True) imports and initializes the filter on use
+        """
+        path = self._write_module(
+            'markdown',
+            'config = {"name": "Markdown", "aliases": ["md"]}\n'
+            'initialized = False\n'
+            'def init():\n'
+            '    global initialized\n'
+            '    initialized = True\n'
+            'def run(content):\n'
+            '    return content\n')
+        namespace = HierarchicalCache()
+        _filter.load_filter('markdown', path, namespace, lazy=True)
+        self.assertEqual(namespace.md.name, 'Markdown')
+        self.assertEqual(self._imported(), [])
+        mod = _filter.get_filter('md', namespace)
+        self.assertTrue(mod.initialized)
+        self.assertEqual(self._imported(), ['markdown'])
+
+    def test_controllers(self):
+        """only enabled controllers get imported
+        """
+        for name in ('blog', 'gallery'):
+            self.addCleanup(sys.modules.pop, name, None)
+            self._write_module(name, 'config = {"priority": 70}\n')
+        namespace = HierarchicalCache()
+        controller.load_controllers(namespace, self.temp_dir)
+        self.assertEqual(namespace.gallery.priority, 70)
+        namespace.blog.enabled = True
+        controller.init_controllers(namespace)
+        self.assertEqual(self._imported(), ['blog'])
+
+
+class TestLazyImport(unittest.TestCase):
+    """Unit tests for lazy_import function.
+    """
+    def test_lazy_import(self):
+        """lazy_import returns a stand-in for the module, imported on use
+        """
+        mod = lazymodule.lazy_import('blogofile.filecopy')
+        self.assertFalse(lazymodule.is_loaded(mod))
+        self.assertTrue(callable(mod.choose_strategy))
+        self.assertTrue(lazymodule.is_loaded(mod))
+        self.assertEqual(mod.__file__,
+                         sys.modules['blogofile.filecopy'].__file__)
+
+    def test_missing_module(self):
+        """lazy_import only fails once a missing module is used
+        """
+        mod = lazymodule.lazy_import('blogofile.no_such_module')
+        with self.assertRaises(ImportError):
+            mod.anything
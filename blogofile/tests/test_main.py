@@ -8,7 +8,10 @@ import argparse
 import logging
 import os
 import platform
+import shutil
+import subprocess
 import sys
+import tempfile
 try:
     import unittest2 as unittest        # For Python 2.6
 except ImportError:
@@ -18,6 +21,7 @@ from mock import Mock
 from mock import patch
 import six
 from .. import main
+from . import isolate_plugin_cache
 
 
 class TestEntryPoint(unittest.TestCase):
@@ -336,6 +340,9 @@ class TestInitBareSite(unittest.TestCase):
 class TestInitPluginSite(unittest.TestCase):
     """Unit tests _init_plugin_site function.
     """
+    def setUp(self):
+        isolate_plugin_cache(self)
+
     def _call_fut(self, *args):
         """Call the fuction under test.
         """
@@ -479,6 +486,67 @@ class TestBuildParser(unittest.TestCase):
         args = self._parse_args(['build'])
         self.assertEqual(args.func, main.do_build)
 
+    def test_build_parser_incremental_default(self):
+        """build parser sets incremental default to False
+        """
+        args = self._parse_args(['build'])
+        self.assertFalse(args.incremental)
+
+    def test_build_parser_jobs_default(self):
+        """build parser sets jobs default to 1
+        """
+        args = self._parse_args(['build'])
+        self.assertEqual(args.jobs, 1)
+
+    def test_build_parser_jobs_value(self):
+        """build parser sets jobs to arg value
+        """
+        args = self._parse_args('build -j 4'.split())
+        self.assertEqual(args.jobs, 4)
+
+    def test_build_parser_staged_default(self):
+        """build parser sets staged default to None
+        """
+        args = self._parse_args(['build'])
+        self.assertIsNone(args.staged)
+
+    def test_build_parser_staged_no_mode(self):
+        """build parser sets staged to rename when no mode is given
+        """
+        args = self._parse_args('build --staged'.split())
+        self.assertEqual(args.staged, 'rename')
+
+    def test_build_parser_staged_mode(self):
+        """build parser sets staged to arg value
+        """
+        args = self._parse_args('build --staged symlink'.split())
+        self.assertEqual(args.staged, 'symlink')
+
+    def test_build_parser_output_mode_default(self):
+        """build parser sets output_mode default to None
+        """
+        args = self._parse_args(['build'])
+        self.assertIsNone(args.output_mode)
+
+    def test_build_parser_sync(self):
+        """build parser sets output_mode to sync for --sync
+        """
+        args = self._parse_args('build --sync'.split())
+        self.assertEqual(args.output_mode, 'sync')
+
+    def test_build_parser_profile_default(self):
+        """build parser sets profile default to False
+        """
+        args = self._parse_args(['build'])
+        self.assertFalse(args.profile)
+        self.assertIsNone(args.profile_json)
+
+    def test_build_parser_profile_json(self):
+        """build parser sets profile_json to arg value
+        """
+        args = self._parse_args('build --profile-json p.json'.split())
+        self.assertEqual(args.profile_json, 'p.json')
+
 
 class TestServeParser(unittest.TestCase):
     """Unit tests for serve sub-command parser.
@@ -567,6 +635,9 @@ class TestInfoParser(unittest.TestCase):
 class TestPluginsParser(unittest.TestCase):
     """Unit tests for plugins sub-command parser.
     """
+    def setUp(self):
+        isolate_plugin_cache(self)
+
     def _parse_args(self, *args):
         """Set up sub-command parser, parse args, and return result.
         """
@@ -582,6 +653,27 @@ class TestPluginsParser(unittest.TestCase):
         args = self._parse_args('plugins list'.split())
         self.assertEqual(args.func, main.plugin.list_plugins)
 
+    @patch.object(main.plugin, 'get_by_name', return_value=None)
+    @patch.object(main.plugin, 'discover_plugins')
+    def test_stale_plugin_metadata(self, mock_discover, mock_get_by_name):
+        """plugins missing from stale metadata are rediscovered or skipped
+        """
+        mock_discover.return_value = [
+            {'entry_point': 'gone',
+             'dist': {'config_name': 'gone', 'command_parser': True,
+                      'description': 'Gone', 'version': '1.0',
+                      'author': 'Me', 'url': 'http://example.com'}}]
+        parser_template = argparse.ArgumentParser(add_help=False)
+        parser = argparse.ArgumentParser(parents=[parser_template])
+        subparsers = parser.add_subparsers()
+        with patch.object(main.logger, 'warn') as mock_warn:
+            main._setup_plugins_parser(
+                subparsers, parser_template, ['blogofile', 'gone'])
+        mock_discover.assert_called_with(refresh=True)
+        self.assertEqual(mock_get_by_name.call_count, 2)
+        self.assertTrue(mock_warn.called)
+        self.assertNotIn('gone', subparsers.choices)
+
 
 class TestFiltersParser(unittest.TestCase):
     """Unit tests for filters sub-command parser.
@@ -599,3 +691,30 @@ class TestFiltersParser(unittest.TestCase):
         """
         args = self._parse_args('filters list'.split())
         self.assertEqual(args.func, main._filter.list_filters)
+
+
+class TestDeferredImports(unittest.TestCase):
+    """Unit tests for the modules sub-commands import.
+    """
+    def _imported(self, code):
+        root = os.path.dirname(os.path.dirname(os.path.dirname(
+            os.path.abspath(__file__))))
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        env = dict(os.environ, XDG_CACHE_HOME=cache_dir)
+        output = subprocess.check_output(
+            [sys.executable, '-c',
+             'import sys; sys.path.insert(0, {0!r}); {1}; '
+             'print(" ".join(sys.modules))'.format(root, code)],
+            env=env, universal_newlines=True)
+        return set(output.split())
+
+    def test_parser_imports(self):
+        """setting up the command parser doesn't import template engines
+        """
+        modules = self._imported(
+            'from blogofile import main; main.setup_command_parser()')
+        for module in ('blogofile.config', 'blogofile.server',
+                       'blogofile.template', 'blogofile.writer',
+                       'mako', 'jinja2'):
+            self.assertNotIn(module, modules)
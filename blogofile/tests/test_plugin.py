@@ -1,6 +1,11 @@
 # -*- coding: utf-8 -*-
 """Unit tests for blogofile plugin module.
 """
+import os
+import shutil
+import sys
+import types
+from tempfile import mkdtemp
 try:
     import unittest2 as unittest        # For Python 2.6
 except ImportError:
@@ -29,6 +34,66 @@ class TestGetByName(unittest.TestCase):
         self.assertEqual(p, mock_plugin)
 
 
+class TestDiscoverPlugins(unittest.TestCase):
+    """Unit tests for discover_plugins function.
+    """
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        patcher = patch.dict(os.environ, {'XDG_CACHE_HOME': self.temp_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, plugin, '_discovered', None)
+        plugin._discovered = None
+        self.imports = []
+        mod = types.ModuleType('fake_plugin')
+        mod.__dist__ = {'config_name': 'fake', 'version': '1.0',
+                        'description': 'Fake', 'author': 'Me',
+                        'command_parser_setup': lambda *args: None}
+        importer = patch.object(
+            plugin.importlib, 'import_module',
+            side_effect=lambda name: self.imports.append(name) or mod)
+        importer.start()
+        self.addCleanup(importer.stop)
+        entry_points = patch.object(
+            plugin, '_entry_points',
+            return_value=[('fake', 'fake_plugin')])
+        entry_points.start()
+        self.addCleanup(entry_points.stop)
+
+    def _call_fut(self, *args):
+        return plugin.discover_plugins(*args)
+
+    def test_metadata(self):
+        """discover_plugins returns the serializable metadata of plugins
+        """
+        plugins = self._call_fut()
+        self.assertEqual(plugins[0]['entry_point'], 'fake_plugin')
+        self.assertEqual(plugins[0]['dist']['config_name'], 'fake')
+        self.assertTrue(plugins[0]['dist']['command_parser'])
+        self.assertNotIn('command_parser_setup', plugins[0]['dist'])
+
+    def test_cached(self):
+        """discover_plugins doesn't import plugins it has metadata for
+        """
+        self._call_fut()
+        self.assertTrue(os.path.exists(plugin.plugin_cache_path()))
+        plugin._discovered = None
+        self.imports = []
+        self.assertEqual(self._call_fut()[0]['dist']['config_name'], 'fake')
+        self.assertEqual(self.imports, [])
+
+    def test_path_changed(self):
+        """discover_plugins discovers again when the search path changes
+        """
+        self._call_fut()
+        plugin._discovered = None
+        self.imports = []
+        with patch.object(sys, 'path', sys.path + [self.temp_dir]):
+            self._call_fut()
+        self.assertEqual(self.imports, ['fake_plugin'])
+
+
 class TestPluginTools(unittest.TestCase):
     """Unit tests for PluginTools class.
     """
@@ -79,7 +144,7 @@ class TestPluginTools(unittest.TestCase):
         """
         mock_plugin_module = MagicMock(
             config={'name': 'foo'}, __name__='mock_plugin', __file__='./foo')
-        with patch.object(plugin, 'TemplateLookup') as mock_TemplateLookup:
+        with patch('mako.lookup.TemplateLookup') as mock_TemplateLookup:
             self._make_one(mock_plugin_module)
         mock_TemplateLookup.assert_called_once_with(
             directories=['_templates', './site_src/_templates'],
@@ -127,7 +192,7 @@ class TestPluginTools(unittest.TestCase):
             config={'name': 'foo'}, __name__='mock_plugin',
             __file__='/foo/bar.py')
         # nested contexts for Python 2.6 compatibility
-        with patch.object(plugin, 'TemplateLookup') as mock_TL:
+        with patch('mako.lookup.TemplateLookup') as mock_TL:
             tools = self._make_one(mock_plugin_module)
             with patch.object(
                 plugin.template, 'materialize_template') as mock_mt:
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for blogofile source tree index.
+"""
+import os
+import shutil
+from tempfile import mkdtemp
+try:
+    import unittest2 as unittest        # For Python 2.6
+except ImportError:
+    import unittest                     # flake8 ignore # NOQA
+from mock import patch
+from .. import sourceindex
+
+
+@patch.object(sourceindex.util, 'should_ignore_path',
+              side_effect=lambda path: '/_' in path)
+class TestSourceIndex(unittest.TestCase):
+    """Unit tests for SourceIndex class.
+    """
+    def setUp(self):
+        self.src_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.src_dir)
+        for d in ('_posts', 'css', os.path.join('css', 'img')):
+            os.mkdir(os.path.join(self.src_dir, d))
+        for path in ('index.html.mako', os.path.join('_posts', 'p.md'),
+                     os.path.join('css', 'site.css'),
+                     os.path.join('css', '_skip.css'),
+                     os.path.join('css', 'img', 'a.png')):
+            with open(os.path.join(self.src_dir, path), 'wt') as f:
+                f.write(path)
+
+    def _make_one(self):
+        return sourceindex.SourceIndex(self.src_dir)
+
+    def test_walk(self, mock_ignore):
+        """walk yields like os.walk, minus ignored files and directories
+        """
+        self.assertEqual(
+            list(self._make_one().walk()),
+            [('.', ['css'], ['index.html.mako']),
+             ('css', ['img'], ['site.css']),
+             (os.path.join('css', 'img'), [], ['a.png'])])
+
+    def test_walk_prunes_ignored_dirs(self, mock_ignore):
+        """walk doesn't read ignored directories
+        """
+        index = self._make_one()
+        list(index.walk())
+        self.assertNotIn(os.path.join('_posts', 'p.md'), index.entries)
+
+    def test_files_of_ignored_dir(self, mock_ignore):
+        """files lists ignored directories on request
+        """
+        index = self._make_one()
+        self.assertEqual(
+            [entry.path for entry in index.files('_posts')],
+            [os.path.join('_posts', 'p.md')])
+
+    def test_stat(self, mock_ignore):
+        """get returns entries with the size and mtime of the file
+        """
+        entry = self._make_one().get(os.path.join('.', 'css', 'site.css'))
+        st = os.stat(os.path.join(self.src_dir, 'css', 'site.css'))
+        self.assertEqual(entry.size, st.st_size)
+        self.assertEqual(entry.mtime, st.st_mtime)
+        self.assertFalse(entry.is_dir)
+
+    def test_get_missing(self, mock_ignore):
+        """get returns None for paths that don't exist
+        """
+        index = self._make_one()
+        self.assertIsNone(index.get('nope.html'))
+        self.assertIsNone(index.get(os.path.join('nope', 'nope.html')))
+
+    def test_listdir_fallback(self, mock_ignore):
+        """SourceIndex reads the same tree without os.scandir
+        """
+        with patch.object(sourceindex, 'scandir',
+                          sourceindex.listdir_entries):
+            index = self._make_one()
+            walked = list(index.walk())
+            entry = index.get(os.path.join('css', 'site.css'))
+        self.assertEqual(walked, list(self._make_one().walk()))
+        st = os.stat(os.path.join(self.src_dir, 'css', 'site.css'))
+        self.assertEqual((entry.size, entry.mtime, entry.is_dir),
+                         (st.st_size, st.st_mtime, False))
@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for blogofile template module.
+"""
+import os
+import shutil
+from tempfile import mkdtemp
+try:
+    import unittest2 as unittest        # For Python 2.6
+except ImportError:
+    import unittest                     # flake8 ignore # NOQA
+from mock import patch
+from .. import template
+from . import isolate_plugin_cache
+
+
+@patch.object(template.bf, 'config')
+class TestMakoModuleCacheOptions(unittest.TestCase):
+    """Unit tests for MakoTemplate.module_cache_options method.
+    """
+    def _call_fut(self):
+        """Call the method under test.
+        """
+        return template.MakoTemplate.module_cache_options()
+
+    def setUp(self):
+        self.src_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.src_dir)
+        self.template_path = os.path.join(self.src_dir, 'site.mako')
+        with open(self.template_path, 'wt') as f:
+            f.write('${next.body()}')
+
+    def test_disabled(self, mock_config):
+        """module_cache_options returns no options when cache is disabled
+        """
+        mock_config.templates.mako.module_cache_dir = False
+        self.assertEqual(self._call_fut(), {})
+
+    def test_default_dir(self, mock_config):
+        """module_cache_options defaults to mako dir inside site.cache_dir
+        """
+        mock_config.templates.mako.module_cache_dir = None
+        mock_config.site.cache_dir = self.src_dir
+        module_path = self._call_fut()['modulename_callable']
+        self.assertEqual(
+            os.path.dirname(module_path(self.template_path, '/site.mako')),
+            os.path.join(self.src_dir, 'mako'))
+
+    def test_module_path_same_for_changed_template(self, mock_config):
+        """a changed template keeps its compiled module path
+        """
+        mock_config.templates.mako.module_cache_dir = self.src_dir
+        module_path = self._call_fut()['modulename_callable']
+        path = module_path(self.template_path, '/site.mako')
+        os.utime(self.template_path, (0, 0))
+        self.assertEqual(
+            path, module_path(self.template_path, '/site.mako'))
+
+    def test_stale_module_removed(self, mock_config):
+        """a module no newer than its template is removed, to recompile
+        """
+        mock_config.templates.mako.module_cache_dir = self.src_dir
+        module_path = self._call_fut()['modulename_callable']
+        path = module_path(self.template_path, '/site.mako')
+        with open(path, 'wt') as f:
+            f.write('')
+        mtime = os.stat(path).st_mtime
+        os.utime(self.template_path, (mtime, mtime))
+        module_path(self.template_path, '/site.mako')
+        self.assertFalse(os.path.exists(path))
+
+    def test_temporary_templates_in_memory(self, mock_config):
+        """templates in the writer's temporary directory aren't cached
+        """
+        mock_config.templates.mako.module_cache_dir = self.src_dir
+        module_path = self._call_fut()['modulename_callable']
+        with patch.object(template.bf, 'writer') as mock_writer:
+            mock_writer.temp_proc_dir = self.src_dir
+            self.assertIsNone(module_path(self.template_path, '/site.mako'))
+
+
+@patch.object(template.bf, 'config')
+class TestJinjaTemplateLoader(unittest.TestCase):
+    """Unit tests for JinjaTemplateLoader class.
+    """
+    def setUp(self):
+        self.src_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.src_dir)
+        self.base_template = os.path.join(self.src_dir, 'site.jinja2')
+        with open(self.base_template, 'wt') as f:
+            f.write('{% block content %}{% endblock %}')
+
+    def _get_source(self):
+        loader = template.JinjaTemplateLoader([self.src_dir])
+        loader.bf_base_template = self.base_template
+        return loader, loader.get_source(None, 'bf_base_template')
+
+    def test_base_template_uptodate(self, mock_config):
+        """bf_base_template is up to date while its file is unchanged
+        """
+        loader, (source, filename, uptodate) = self._get_source()
+        self.assertTrue(uptodate())
+
+    def test_base_template_modified(self, mock_config):
+        """bf_base_template is out of date after its file changes
+        """
+        loader, (source, filename, uptodate) = self._get_source()
+        os.utime(self.base_template, (0, 0))
+        self.assertFalse(uptodate())
+
+    def test_base_template_changed(self, mock_config):
+        """bf_base_template is out of date when it's set to another file
+        """
+        loader, (source, filename, uptodate) = self._get_source()
+        loader.bf_base_template = os.path.join(self.src_dir, 'other.jinja2')
+        self.assertFalse(uptodate())
+
+
+@patch.object(template.bf, 'writer')
+@patch.object(template.bf, 'config')
+class TestJinjaCompileSrc(unittest.TestCase):
+    """Unit tests for JinjaTemplate.compile_src method.
+    """
+    def setUp(self):
+        self.addCleanup(
+            setattr, template.JinjaTemplate, 'template_lookup', None)
+        self.addCleanup(setattr, template.JinjaTemplate, 'src_cache', None)
+
+    def _make_one(self, src):
+        return template.JinjaTemplate(None, src=src)
+
+    def test_compiles_once(self, mock_config, mock_writer):
+        """compile_src compiles each source only once
+        """
+        mock_config.templates.jinja2.bytecode_cache_dir = False
+        compiled = self._make_one('{{ 1 + 1 }}').compile_src()
+        self.assertIs(self._make_one('{{ 1 + 1 }}').compile_src(), compiled)
+        self.assertEqual(compiled.render(), '2')
+
+    def test_different_sources(self, mock_config, mock_writer):
+        """compile_src compiles different sources separately
+        """
+        mock_config.templates.jinja2.bytecode_cache_dir = False
+        self.assertEqual(self._make_one('a').compile_src().render(), 'a')
+        self.assertEqual(self._make_one('b').compile_src().render(), 'b')
+
+
+class TestIntermediateBaseTemplate(unittest.TestCase):
+    """Unit tests for intermediate_base_template function.
+    """
+    def _call_fut(self, *args):
+        """Call the function under test.
+        """
+        return template.intermediate_base_template(*args)
+
+    def setUp(self):
+        from .. import config
+        isolate_plugin_cache(self)
+        self.addCleanup(os.chdir, os.getcwd())
+        self.addCleanup(
+            setattr, template.MakoTemplate, 'template_lookup', None)
+        src_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, src_dir)
+        os.chdir(src_dir)
+        os.makedirs('_templates')
+        with open(os.path.join('_templates', 'site.mako'), 'wt') as f:
+            f.write('<html>${next.body()}</html>')
+        with open('_config.py', 'wt') as f:
+            f.write('templates.mako.module_cache_dir = False')
+        config.init_interactive()
+        patcher = patch.object(template.bf, 'writer', create=True)
+        self.mock_writer = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mock_writer.temp_proc_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.mock_writer.temp_proc_dir)
+
+    def test_kept_in_memory(self):
+        """intermediate_base_template keeps converted template in memory
+        """
+        name = self._call_fut(
+            template.MakoTemplate, template.MarkdownTemplate)
+        self.assertEqual(
+            template.FilterTemplate.base_templates[name],
+            '<html>~~!`FILTER_CONTENT_HERE`!~~</html>')
+        self.assertEqual(os.listdir(self.mock_writer.temp_proc_dir), [])
+
+    def test_converted_once(self):
+        """intermediate_base_template renders the base template once
+        """
+        name = self._call_fut(
+            template.MakoTemplate, template.MarkdownTemplate)
+        with patch.object(template.MakoTemplate, 'render') as mock_render:
+            self.assertEqual(
+                self._call_fut(
+                    template.MakoTemplate, template.MarkdownTemplate),
+                name)
+        self.assertFalse(mock_render.called)
+
+
+@patch.object(template.bf, 'writer')
+@patch.object(template.bf, 'config')
+class TestStreamOutput(unittest.TestCase):
+    """Unit tests for rendering templates straight to the output file.
+    """
+    def setUp(self):
+        self.addCleanup(
+            setattr, template.JinjaTemplate, 'template_lookup', None)
+        self.addCleanup(setattr, template.JinjaTemplate, 'src_cache', None)
+        self.output_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+
+    def _make_one(self, src, mock_config, mock_writer):
+        mock_config.templates.jinja2.bytecode_cache_dir = False
+        mock_config.templates.stream_output = True
+        mock_writer.output_dir = self.output_dir
+        mock_writer.record_output.return_value = False
+        return template.JinjaTemplate(None, src=src)
+
+    def test_streams_to_file(self, mock_config, mock_writer):
+        """render writes the template to the file and returns None
+        """
+        t = self._make_one(u'{{ x }} é', mock_config, mock_writer)
+        t['x'] = 'hello'
+        self.assertIsNone(t.render('a/index.html'))
+        path = os.path.join(self.output_dir, 'a', 'index.html')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), u'hello é'.encode('utf-8'))
+        mock_writer.record_output.assert_called_once_with('a/index.html')
+
+    def test_render_to_string(self, mock_config, mock_writer):
+        """render without a path still returns the rendered bytes
+        """
+        t = self._make_one(u'{{ x }} é', mock_config, mock_writer)
+        t['x'] = 'hello'
+        self.assertEqual(t.render(), u'hello é'.encode('utf-8'))
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+    def test_partial_file_removed(self, mock_config, mock_writer):
+        """render removes the partly written file when rendering fails
+        """
+        t = self._make_one('start {{ 1 // 0 }}', mock_config, mock_writer)
+        self.assertRaises(ZeroDivisionError, t.render, 'index.html')
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+
+@patch.object(template._filter, 'run_chain_batch')
+@patch.object(template.bf, 'config')
+class TestPrefilterTemplates(unittest.TestCase):
+    """Unit tests for prefilter_templates function.
+    """
+    def setUp(self):
+        self.src_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.src_dir)
+        self.addCleanup(template.FilterTemplate.prefiltered.clear)
+        self.paths = []
+        for name in ('a.html.markdown', 'b.html.mako', 'c.html.markdown'):
+            self.paths.append(os.path.join(self.src_dir, name))
+            with open(self.paths[-1], 'wt') as f:
+                f.write(name)
+
+    def _call_fut(self, template_names, mock_config):
+        mock_config.templates.engines = {
+            'markdown': template.MarkdownTemplate,
+            'mako': template.MakoTemplate}
+        return template.prefilter_templates(template_names)
+
+    def test_batch(self, mock_config, mock_run_chain_batch):
+        """prefilter_templates filters only filter templates, together
+        """
+        mock_run_chain_batch.return_value = ['A', 'C']
+        self._call_fut(self.paths, mock_config)
+        mock_run_chain_batch.assert_called_once_with(
+            [('markdown', 'a.html.markdown'),
+             ('markdown', 'c.html.markdown')])
+        self.assertEqual(
+            template.FilterTemplate.prefiltered,
+            {self.paths[0]: ('markdown', 'a.html.markdown', 'A'),
+             self.paths[2]: ('markdown', 'c.html.markdown', 'C')})
+
+    def test_single_template(self, mock_config, mock_run_chain_batch):
+        """prefilter_templates leaves a lone filter template to render
+        """
+        self._call_fut(self.paths[:2], mock_config)
+        self.assertFalse(mock_run_chain_batch.called)
+        self.assertEqual(template.FilterTemplate.prefiltered, {})
+
+
+@patch.object(template.bf, 'config')
+class TestBaseTemplateSegments(unittest.TestCase):
+    """Unit tests for FilterTemplate.base_template_segments method.
+    """
+    def setUp(self):
+        self.src_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.src_dir)
+        self.addCleanup(template.FilterTemplate.base_segments.clear)
+        self.base_path = os.path.join(self.src_dir, 'base.html')
+        with open(self.base_path, 'wt') as f:
+            f.write('<html>MARKER</html>')
+
+    def _make_one(self, mock_config, base_template):
+        mock_config.templates.content_blocks.filter.replacement = 'MARKER'
+        t = template.FilterTemplate(None)
+        t['bf_base_template'] = base_template
+        return t
+
+    def test_split(self, mock_config):
+        """base_template_segments splits the base template at the marker
+        """
+        t = self._make_one(mock_config, self.base_path)
+        self.assertEqual(t.base_template_segments(), ['<html>', '</html>'])
+
+    def test_cached(self, mock_config):
+        """base_template_segments only reads the base template once
+        """
+        t = self._make_one(mock_config, self.base_path)
+        segments = t.base_template_segments()
+        self.assertIs(t.base_template_segments(), segments)
+
+    def test_modified(self, mock_config):
+        """base_template_segments rereads a modified base template
+        """
+        t = self._make_one(mock_config, self.base_path)
+        t.base_template_segments()
+        with open(self.base_path, 'wt') as f:
+            f.write('<body>MARKER</body>')
+        os.utime(self.base_path, (0, 0))
+        self.assertEqual(t.base_template_segments(), ['<body>', '</body>'])
+
+    def test_put_base_template(self, mock_config):
+        """base_template_segments uses the latest in memory base template
+        """
+        self.addCleanup(
+            template.FilterTemplate.base_templates.pop, 'bf_test', None)
+        t = self._make_one(mock_config, 'bf_test')
+        template.FilterTemplate.put_base_template('bf_test', 'aMARKERb')
+        self.assertEqual(t.base_template_segments(), ['a', 'b'])
+        template.FilterTemplate.put_base_template('bf_test', 'cMARKERd')
+        self.assertEqual(t.base_template_segments(), ['c', 'd'])
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for blogofile build timing.
+"""
+import json
+import os
+import shutil
+from tempfile import mkdtemp
+try:
+    import unittest2 as unittest        # For Python 2.6
+except ImportError:
+    import unittest                     # flake8 ignore # NOQA
+from .. import timing
+
+
+class TestTimer(unittest.TestCase):
+    """Unit tests for Timer class.
+    """
+    def _make_one(self):
+        return timing.Timer()
+
+    def test_disabled(self):
+        """time records nothing when timing is off
+        """
+        timer = self._make_one()
+        with timer.time('filter', 'markdown'):
+            pass
+        self.assertEqual(timer.records, {})
+
+    def test_enabled(self):
+        """time counts calls by category and name
+        """
+        timer = self._make_one()
+        timer.enable()
+        for i in range(3):
+            with timer.time('filter', 'markdown'):
+                pass
+        self.assertEqual(timer.records['filter:markdown'][0], 3)
+
+    def test_records_failures(self):
+        """time records blocks that raise
+        """
+        timer = self._make_one()
+        timer.enable()
+        with self.assertRaises(ValueError):
+            with timer.time('controller.run', 'blog'):
+                raise ValueError
+        self.assertIn('controller.run:blog', timer.records)
+
+    def test_merge(self):
+        """merge adds the records of another timer
+        """
+        timer = self._make_one()
+        timer.add('template', 'a.mako', 1.0, 0.5)
+        timer.merge({'template:a.mako': [2, 3.0, 1.0],
+                     'template:b.mako': [1, 1.0, 1.0]})
+        self.assertEqual(timer.records['template:a.mako'], [3, 4.0, 1.5])
+        self.assertEqual(timer.records['template:b.mako'], [1, 1.0, 1.0])
+
+    def test_summary_sorted(self):
+        """summary lists the slowest records first
+        """
+        timer = self._make_one()
+        timer.add('phase', 'fast', 0.1, 0.1)
+        timer.add('phase', 'slow', 2.0, 1.0)
+        lines = timer.summary()
+        self.assertTrue(lines[1].endswith('phase:slow'))
+        self.assertTrue(lines[2].endswith('phase:fast'))
+
+    def test_write_json(self):
+        """write_json writes the records as JSON
+        """
+        tmp_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, 'profile.json')
+        timer = self._make_one()
+        timer.add('filter', 'rst', 0.5, 0.25)
+        timer.write_json(path)
+        with open(path) as f:
+            self.assertEqual(
+                json.load(f),
+                {'filter:rst': {'calls': 1, 'wall': 0.5, 'cpu': 0.25}})
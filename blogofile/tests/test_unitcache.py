@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Unit tests for the controller unit cache.
+"""
+import os
+import shutil
+from tempfile import mkdtemp
+try:
+    import unittest2 as unittest        # For Python 2.6
+except ImportError:
+    import unittest                     # flake8 ignore # NOQA
+from .. import unitcache
+
+
+class TestUnitCache(unittest.TestCase):
+    """Unit tests for UnitCache class.
+    """
+    def setUp(self):
+        self.temp_dir = mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.src_dir = os.path.join(self.temp_dir, 'src')
+        self.output_dir = os.path.join(self.temp_dir, '_site')
+        os.makedirs(os.path.join(self.src_dir, 'photos'))
+        os.makedirs(os.path.join(self.output_dir, 'gallery'))
+        self.photo = os.path.join(self.src_dir, 'photos', 'a.jpg')
+        self._write(self.photo, 'photo')
+
+    def _write(self, path, content):
+        with open(path, 'wt') as f:
+            f.write(content)
+
+    def _make_one(self):
+        return unitcache.UnitCache(
+            os.path.join(self.temp_dir, 'units'), self.output_dir)
+
+    def test_key_input_changed(self):
+        """key changes when an input file changes
+        """
+        units = self._make_one()
+        inputs = [os.path.join(self.src_dir, 'photos')]
+        key = units.key('gallery', inputs)
+        self.assertEqual(units.key('gallery', inputs), key)
+        self._write(self.photo, 'new photo')
+        self.assertNotEqual(units.key('gallery', inputs), key)
+
+    def test_save_restore(self):
+        """restore puts the saved outputs back in the output directory
+        """
+        units = self._make_one()
+        output = os.path.join(self.output_dir, 'gallery', 'a.jpg')
+        self._write(output, 'photo')
+        files = unitcache.output_files(self.output_dir, ['gallery'])
+        self.assertEqual(files, [os.path.join('gallery', 'a.jpg')])
+        units.save('gallery', 'key', files)
+        shutil.rmtree(self.output_dir)
+        record = units.load('gallery')
+        self.assertEqual(record['key'], 'key')
+        self.assertEqual(units.restore('gallery', record), files)
+        with open(output) as f:
+            self.assertEqual(f.read(), 'photo')
+
+    def test_restore_missing_copies(self):
+        """restore returns None when the saved outputs are gone
+        """
+        units = self._make_one()
+        self._write(os.path.join(self.output_dir, 'gallery', 'a.jpg'), 'x')
+        units.save('gallery', 'key', ['gallery/a.jpg'])
+        shutil.rmtree(os.path.join(units.unit_dir('gallery'), 'files'))
+        self.assertIsNone(units.restore('gallery', units.load('gallery')))
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 """Unit tests for blogofile util module.
 """
+import re
 try:
     import unittest2 as unittest        # For Python 2.6
 except ImportError:
@@ -110,3 +111,56 @@ class TestSitePathHelper(unittest.TestCase):
         mock_config.site.url = 'http://www.blogofile.com'
         path = self._call_fut(trailing_slash=True)
         self.assertEqual(path, '/')
+
+
+class TestFileIgnoreMatcher(unittest.TestCase):
+    """Unit tests for FileIgnoreMatcher class.
+    """
+    patterns = [
+        '.*/_.*',
+        '.*~$',
+        r'.*/\.(git|hg|svn|bzr)$',
+        r'.*/(a)\1$',
+        re.compile('.*/Makefile$'),
+    ]
+
+    def _make_one(self):
+        return util.FileIgnoreMatcher(self.patterns)
+
+    def test_index(self):
+        """literal patterns are checked without regexes
+        """
+        matcher = self._make_one()
+        self.assertEqual(matcher.contains, ['/_'])
+        self.assertEqual(matcher.suffixes, ('~',))
+        self.assertEqual(len(matcher.separate), 2)
+
+    def test_compiled_unicode_pattern(self):
+        """case insensitive compiled patterns are indexed like strings
+        """
+        matcher = util.FileIgnoreMatcher(
+            [re.compile(u'.*/_.*', re.IGNORECASE)])
+        self.assertEqual(matcher.contains, ['/_'])
+        self.assertEqual(matcher.separate, [])
+
+    def test_same_as_patterns(self):
+        """match agrees with matching each pattern in turn
+        """
+        matcher = self._make_one()
+        compiled = [
+            p if hasattr(p, 'findall') else re.compile(p, re.IGNORECASE)
+            for p in self.patterns]
+        for path in ('./_site', 'css/_x/a.css', 'x/_', 'a/b_c', 'a/b/c~',
+                     'a/.GIT', 'a/.github', 'x/aa', 'x/ab', 'x/Makefile',
+                     'x/makefile', './index.html'):
+            self.assertEqual(
+                matcher.match(path),
+                any(p.match(path) for p in compiled), path)
+
+    def test_directory_cache(self):
+        """files in a directory that contains a literal are ignored
+        """
+        matcher = self._make_one()
+        self.assertTrue(matcher.match('./_posts/a/b.html'))
+        self.assertTrue(matcher.match('./_posts/a/c.html'))
+        self.assertFalse(matcher.match('./posts/a/c.html'))
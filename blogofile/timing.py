@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""Build timing instrumentation, for `blogofile build --profile`.
+
+The build records the wall clock time, CPU time and number of calls of
+each of its phases, controller init() and run() functions, filters
+and template renders in the module level timer:
+
+    with timing.timer.time("filter", "markdown"):
+        ...
+
+Timing is off (and costs next to nothing) unless timer.enable() has
+been called.
+"""
+from __future__ import print_function
+import contextlib
+import json
+import time
+
+#The most precise wall clock and CPU clocks there are (the first two
+#only exist on Python 3.3 and later):
+_wall_clock = getattr(time, "perf_counter", time.time)
+_cpu_clock = getattr(time, "process_time", None) or time.clock
+
+
+class Timer(object):
+    """Accumulate timings by (category, name).
+
+    records maps "category:name" to [calls, wall seconds, CPU seconds].
+    Times are inclusive: a template render's time includes the filters
+    it runs.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.records = {}
+
+    def enable(self):
+        """Start timing, forgetting any earlier records.
+        """
+        self.enabled = True
+        self.records = {}
+
+    def disable(self):
+        self.enabled = False
+
+    def time(self, category, name):
+        """Return a context manager timing its block as name in
+        category.
+        """
+        if not self.enabled:
+            return _null_context
+        return self.__time(category, name)
+
+    @contextlib.contextmanager
+    def __time(self, category, name):
+        wall = _wall_clock()
+        cpu = _cpu_clock()
+        try:
+            yield
+        finally:
+            self.add(category, name, _wall_clock() - wall,
+                     _cpu_clock() - cpu)
+
+    def add(self, category, name, wall, cpu, calls=1):
+        key = "{0}:{1}".format(category, name)
+        record = self.records.setdefault(key, [0, 0.0, 0.0])
+        record[0] += calls
+        record[1] += wall
+        record[2] += cpu
+
+    def merge(self, records):
+        """Add the records of another timer (eg. from a build worker
+        process) to this one.
+        """
+        for key, (calls, wall, cpu) in records.items():
+            category, name = key.split(":", 1)
+            self.add(category, name, wall, cpu, calls)
+
+    def summary(self, limit=None):
+        """Return the report lines, slowest first.
+        """
+        rows = sorted(self.records.items(), key=lambda r: -r[1][1])
+        if limit:
+            rows = rows[:limit]
+        lines = ["{0:>10} {1:>10} {2:>8}  {3}".format(
+            "wall (s)", "cpu (s)", "calls", "what")]
+        for key, (calls, wall, cpu) in rows:
+            lines.append("{0:>10.3f} {1:>10.3f} {2:>8}  {3}".format(
+                wall, cpu, calls, key))
+        return lines
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(dict((key, {"calls": calls, "wall": wall, "cpu": cpu})
+                           for key, (calls, wall, cpu)
+                           in self.records.items()),
+                      f, indent=2, sort_keys=True)
+
+
+class _NullContext(object):
+    """What Timer.time() returns when timing is off.
+    """
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_context = _NullContext()
+
+timer = Timer()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Caching of the output of controllers' units of work.
+
+Controllers can split their work into units that declare what they
+depend on and what they write, and run them through the writer:
+
+    bf.writer.run_unit(
+        "gallery.photos", copy_photos,
+        inputs=[photo_dir],
+        config=["plugins.gallery.gallery"],
+        outputs=["photos/img"])
+
+When the unit's inputs (files or directories, compared by size and
+mtime), the values of its config keys (dotted names in bf.config) and
+its outputs (files or directories in the output directory) are the
+same as in the last build, the unit isn't run: the outputs it wrote
+then are copied into the output directory instead. Copies of the
+outputs are kept in site.cache_dir/units for that.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+
+from . import __version__
+from . import filecopy
+from . import util
+from .cache import bf
+
+
+logger = logging.getLogger("blogofile.unitcache")
+
+
+def _files(path):
+    """Return the files at path: path itself, or the files in it when
+    it's a directory.
+    """
+    if os.path.isdir(path):
+        return sorted(util.recursive_file_list(path))
+    if os.path.isfile(path):
+        return [path]
+    return []
+
+
+def config_value(name):
+    """Return the value of the dotted config key name, or None.
+    """
+    value = bf.config
+    for part in name.split("."):
+        try:
+            value = getattr(value, part)
+        except AttributeError:
+            return None
+    return value
+
+
+def output_files(output_dir, outputs):
+    """Return the paths, relative to output_dir, of the files in
+    outputs.
+    """
+    files = []
+    for output in outputs:
+        for path in _files(util.path_join(output_dir, output)):
+            files.append(os.path.relpath(path, output_dir))
+    return files
+
+
+class UnitCache(object):
+    """The outputs of units of work, stored in directory.
+
+    Each unit has a directory named after it holding unit.json, which
+    records the key of the unit's last run and the size and mtime of
+    its outputs, and a copy of the outputs in files.
+    """
+
+    def __init__(self, directory, output_dir):
+        self.directory = directory
+        self.output_dir = output_dir
+        self.__copier = None
+
+    def key(self, name, inputs=(), config=(), outputs=()):
+        """Digest everything a unit depends on.
+        """
+        h = hashlib.sha1(__version__.encode("utf-8"))
+        h.update(repr((name, sorted(outputs))).encode("utf-8"))
+        for path in sorted(inputs):
+            h.update(repr(path).encode("utf-8", "replace"))
+            for fn in _files(path):
+                st = os.stat(fn)
+                h.update(repr((fn, st.st_size, st.st_mtime))
+                         .encode("utf-8", "replace"))
+        for config_name in sorted(config):
+            h.update(repr((config_name, config_value(config_name)))
+                     .encode("utf-8", "replace"))
+        return h.hexdigest()
+
+    def unit_dir(self, name):
+        return util.path_join(
+            self.directory, hashlib.sha1(name.encode("utf-8")).hexdigest())
+
+    def load(self, name):
+        """Return the record of the last run of a unit, or None.
+        """
+        try:
+            with open(util.path_join(self.unit_dir(name), "unit.json")) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def copier(self):
+        # Stored copies must not be hard links to the outputs, which
+        # may be modified in place by later builds:
+        if self.__copier is None:
+            util.mkdir(self.directory)
+            self.__copier = filecopy.choose_strategy(
+                self.directory, self.output_dir)
+        return self.__copier
+
+    def save(self, name, key, files):
+        """Store a copy of the files (relative to the output directory)
+        a unit wrote.
+        """
+        unit_dir = self.unit_dir(name)
+        if os.path.isdir(unit_dir):
+            shutil.rmtree(unit_dir)
+        record = {"name": name, "key": key, "files": {}}
+        for path in files:
+            src = util.path_join(self.output_dir, path)
+            dst = util.path_join(unit_dir, "files", path)
+            util.mkdir(os.path.dirname(dst))
+            self.copier().copy(src, dst)
+            st = os.stat(src)
+            os.utime(dst, (st.st_atime, st.st_mtime))
+            record["files"][path] = [st.st_size, st.st_mtime]
+        tmp_path = util.path_join(unit_dir, "unit.json.tmp")
+        util.mkdir(unit_dir)
+        with open(tmp_path, "w") as f:
+            json.dump(record, f)
+        os.rename(tmp_path, util.path_join(unit_dir, "unit.json"))
+
+    def restore(self, name, record):
+        """Put the stored outputs of a unit back in the output directory.
+
+        Returns the restored paths, or None if the stored copies are
+        missing.
+        """
+        unit_dir = self.unit_dir(name)
+        stored = [util.path_join(unit_dir, "files", path)
+                  for path in record["files"]]
+        if not all(os.path.isfile(path) for path in stored):
+            return None
+        for (path, (size, mtime)), src in zip(
+                record["files"].items(), stored):
+            dst = util.path_join(self.output_dir, path)
+            try:
+                st = os.stat(dst)
+            except OSError:
+                pass
+            else:
+                if st.st_size == size and st.st_mtime == mtime:
+                    continue
+            if os.path.lexists(dst):
+                os.remove(dst)
+            util.mkdir(os.path.dirname(dst))
+            self.copier().copy(src, dst)
+            os.utime(dst, (mtime, mtime))
+        return list(record["files"])
@@ -46,12 +46,126 @@ def should_ignore_path(path):
     """
     if os.path.sep == '\\':
         path = path.replace('\\', '/')
+    matcher = bf.config.site.get("file_ignore_matcher")
+    if matcher is not None:
+        return matcher.match(path)
     for p in bf.config.site.compiled_file_ignore_patterns:
         if p.match(path):
             return True
     return False
 
 
+# A literal that a path has to contain (.*/_.*) or end with (.*~$):
+_CONTAINS_PATTERN_RE = re.compile(r"^\.\*((?:[^.^$*+?{}\[\]\\|()]|\\\W)+)"
+                                  r"\.\*$")
+_SUFFIX_PATTERN_RE = re.compile(r"^\.\*((?:[^.^$*+?{}\[\]\\|()]|\\\W)+)\$$")
+# Things that stop a regex from being combined with others into one
+# alternation: back references, named groups and inline flags.
+_UNCOMBINABLE_RE = re.compile(r"\\[1-9]|\(\?P[<=]|\(\?[aiLmsux]")
+
+
+class FileIgnoreMatcher(object):
+    """Match paths against a list of ignore patterns.
+
+    The patterns are compiled into:
+
+      - literal substrings and suffixes for the common patterns like
+        ".*/_.*" and ".*~$", which are checked with plain string
+        operations. Whether a directory contains one of the substrings
+        is cached, so the files in it only need their name checked.
+      - a single alternation of all the other case insensitive
+        patterns.
+      - the patterns that can't be combined, matched one by one.
+    """
+    dir_cache_size = 10000
+
+    def __init__(self, patterns):
+        self.contains = []
+        suffixes = []
+        combined = []
+        self.separate = []
+        for p in patterns:
+            if hasattr(p, "findall"):
+                if p.flags & re.IGNORECASE and \
+                        isinstance(p.pattern, six.string_types):
+                    pattern = p.pattern
+                else:
+                    self.separate.append(p)
+                    continue
+            else:
+                pattern = p
+            literal = self.__literal(_CONTAINS_PATTERN_RE, pattern)
+            if literal is not None:
+                self.contains.append(literal)
+                continue
+            literal = self.__literal(_SUFFIX_PATTERN_RE, pattern)
+            if literal is not None:
+                suffixes.append(literal)
+            elif _UNCOMBINABLE_RE.search(pattern):
+                self.separate.append(re.compile(pattern, re.IGNORECASE))
+            else:
+                combined.append(pattern)
+        self.suffixes = tuple(suffixes)
+        self.__longest = max([len(c) for c in self.contains] or [0])
+        if combined:
+            self.regex = re.compile(
+                "|".join("(?:{0})".format(p) for p in combined),
+                re.IGNORECASE)
+        else:
+            self.regex = None
+        self.__dir_cache = {}
+
+    @staticmethod
+    def __literal(pattern_re, pattern):
+        """Return the lowercased literal pattern_re finds in pattern, or
+        None if it doesn't match or the literal isn't ASCII (lower()
+        only agrees with re.IGNORECASE for ASCII.)
+        """
+        m = pattern_re.match(pattern)
+        if m is None:
+            return None
+        literal = re.sub(r"\\(.)", r"\1", m.group(1))
+        try:
+            literal.encode("ascii")
+        except UnicodeError:
+            return None
+        return literal.lower()
+
+    def __dir_contains(self, directory):
+        try:
+            return self.__dir_cache[directory]
+        except KeyError:
+            pass
+        if len(self.__dir_cache) >= self.dir_cache_size:
+            self.__dir_cache.clear()
+        found = any(s in directory for s in self.contains)
+        self.__dir_cache[directory] = found
+        return found
+
+    def match(self, path):
+        """Does path (with / separators) match any of the patterns?
+        """
+        lower = path.lower()
+        if self.contains:
+            cut = lower.rfind("/")
+            if cut > 0 and self.__dir_contains(lower[:cut]):
+                return True
+            # The name, and as much of the end of the directory as a
+            # substring could straddle:
+            tail = lower[max(0, cut - self.__longest + 1):]
+            for s in self.contains:
+                if s in tail:
+                    return True
+        if self.suffixes and lower.endswith(self.suffixes):
+            return True
+        if self.regex is not None and self.regex.match(path):
+            return True
+        for p in self.separate:
+            if p.match(path):
+                return True
+        return False
+
+
 def mkdir(newdir):
     """works the way a good mkdir should :)
     - already exists, silently complete
@@ -6,18 +6,29 @@ the current working directory.
 __author__ = "Ryan McGuire (ryan@enigmacurry.com)"
 
 import logging
+import multiprocessing
 import os
 import re
 import shutil
 import tempfile
+import traceback
 
 from . import util
 from . import config
 from . import cache
 from . import filter as _filter
 from . import controller
+from . import dependency
+from . import exception
+from . import filecopy
+from . import filtercache
+from . import manifest
 from . import plugin
+from . import sourceindex
 from . import template
+from . import timing
+from . import unitcache
+from .buildmodes import OUTPUT_MODES, STAGED_MODES
 
 
 logger = logging.getLogger("blogofile.writer")
@@ -25,12 +36,40 @@ logger = logging.getLogger("blogofile.writer")
 
 class Writer(object):
 
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, incremental=False, jobs=1, staged=None,
+                 output_mode=None):
         self.config = config
         # Base templates are templates (usually in ./_templates) that are only
         # referenced by other templates.
         self.base_template_dir = util.path_join(".", "_templates")
         self.output_dir = output_dir
+        # Incremental builds keep the previous _site and only rewrite
+        # the outputs whose inputs have changed:
+        self.incremental = incremental
+        self.manifest = None
+        self.__current_inputs = None
+        # The unitcache.UnitCache of controllers' units of work:
+        self.units = None
+        # Number of worker processes to materialize templates with,
+        # 0 means one per CPU:
+        self.jobs = jobs or multiprocessing.cpu_count()
+        # How to publish a build made in a staging directory next to
+        # output_dir (one of STAGED_MODES), or False to build in place.
+        # None means use site.staged_build:
+        self.staged = staged
+        # The directory the site is published to; output_dir points to
+        # the staging directory while a staged build runs:
+        self.publish_dir = output_dir
+        # One of OUTPUT_MODES, None means use site.output_mode:
+        self.output_mode = output_mode
+        self.sync = False
+        # Outputs written (or kept, when syncing) by this build:
+        self.written = set()
+        # Is this the copy of the writer in a build worker process?
+        # Workers only know about the outputs of their own template:
+        self.worker = False
+        # The source files of the build:
+        self.source_index = None
 
     def __load_bf_cache(self):
         # Template cache object, used to transfer state to/from each template:
@@ -39,17 +78,229 @@ class Writer(object):
         self.bf.logger = logger
 
     def write_site(self):
-        self.__load_bf_cache()
-        self.__setup_temp_dir()
+        with timing.timer.time("phase", "write_site"):
+            self.__load_bf_cache()
+            self.__setup_temp_dir()
+            try:
+                self.source_index = sourceindex.SourceIndex()
+                self.__phase("load_manifest", self.__load_manifest)
+                self.sync = self.__sync_mode()
+                if self.__staged_mode():
+                    self.__build_staged()
+                else:
+                    self.__build()
+                    self.__phase("save_manifest", self.__save_manifest)
+            finally:
+                self.__delete_temp_dir()
+
+    def __phase(self, name, method, *args):
+        """Run one phase of the build, timing it for --profile.
+        """
+        with timing.timer.time("phase", name):
+            return method(*args)
+
+    def __sync_mode(self):
+        """Should the output directory be synced rather than cleaned?
+
+        Incremental builds with a manifest already keep the outputs
+        that are up to date, so they never sync.
+        """
+        mode = self.output_mode or self.config.site.output_mode
+        if mode not in OUTPUT_MODES:
+            raise exception.BuildError(
+                "Unknown output mode: {0} (use one of: {1})".format(
+                    mode, ", ".join(OUTPUT_MODES)))
+        if self.manifest is not None and self.manifest.previous is not None:
+            return False
+        return mode == "sync"
+
+    def __build(self):
+        self.__phase("setup_output_dir", self.__setup_output_dir)
+        self.__phase("setup_copy_strategy", self.__setup_copy_strategy)
+        self.__calculate_template_files()
+        self.__phase("init_plugins", self.__init_plugins)
+        self.__phase("init_filters_controllers",
+                     self.__init_filters_controllers)
+        self.__setup_filter_cache()
+        self.__setup_unit_cache()
         try:
-            self.__setup_output_dir()
-            self.__calculate_template_files()
-            self.__init_plugins()
-            self.__init_filters_controllers()
-            self.__run_controllers()
-            self.__write_files()
+            self.__phase("run_controllers", self.__run_controllers)
+            self.__phase("write_files", self.__write_files)
         finally:
-            self.__delete_temp_dir()
+            _filter.close_pool()
+            self.__phase("prune_filter_cache", self.__prune_filter_cache)
+        self.__phase("remove_orphans", self.__remove_orphans)
+        logger.info("Build stats: " + self.copier.summary())
+
+    def __staged_mode(self):
+        staged = self.staged
+        if staged is None:
+            staged = self.config.site.staged_build
+        if staged is True:
+            staged = "rename"
+        if staged and staged not in STAGED_MODES:
+            raise exception.BuildError(
+                "Unknown staged build mode: {0} (use one of: {1})".format(
+                    staged, ", ".join(STAGED_MODES)))
+        return staged
+
+    def __build_staged(self):
+        """Build the site in a staging directory next to the output
+        directory, and only publish it once the whole build succeeded.
+
+        The output directory is left untouched by a failed build, and
+        the previous site is deleted after the new one is published.
+        """
+        mode = self.__staged_mode()
+        publish_dir = self.publish_dir
+        if mode == "keep_inode":
+            # The staged files are moved into the directory the output
+            # dir resolves to, so they must be on its filesystem:
+            parent_dir = os.path.dirname(os.path.realpath(publish_dir))
+        else:
+            parent_dir = os.path.dirname(os.path.abspath(publish_dir))
+        util.mkdir(parent_dir)
+        staging_dir = tempfile.mkdtemp(
+            prefix=os.path.basename(publish_dir) + ".", dir=parent_dir)
+        # mkdtemp makes the directory private, but it's going to be
+        # served; give it the permissions of a normal directory:
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(staging_dir, 0o777 & ~umask)
+        if self.sync or (self.manifest is not None and
+                         self.manifest.previous is not None):
+            self.__copy_previous_build(publish_dir, staging_dir)
+        self.output_dir = staging_dir
+        try:
+            self.__build()
+        except:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+        finally:
+            self.output_dir = publish_dir
+        logger.info("Publishing staged build to {0}".format(publish_dir))
+        if mode == "rename":
+            publish = self.__publish_rename
+        elif mode == "symlink":
+            publish = self.__publish_symlink
+        else:
+            publish = self.__publish_keep_inode
+        old = self.__phase("publish", publish, staging_dir)
+        self.__phase("save_manifest", self.__save_manifest)
+        if old is not None:
+            logger.debug("Removing previous build: " + old)
+            self.__phase("remove_previous_build", shutil.rmtree, old, True)
+
+    def __copy_previous_build(self, src, dst):
+        """Populate dst with copies of the files in src, made with the
+        cheapest copy strategy (see filecopy.py) within dst's
+        filesystem.
+
+        They aren't hard links (unless site.use_hard_links is on), so
+        that a controller writing into a file of the staged build in
+        place doesn't change the published site before the build is
+        done.
+        """
+        if not os.path.isdir(src):
+            return
+        # Probe within dst, not in the published site:
+        probe_dir = tempfile.mkdtemp(dir=dst)
+        try:
+            copier = filecopy.choose_strategy(
+                dst, probe_dir,
+                use_hard_links=self.config.site.use_hard_links)
+        finally:
+            shutil.rmtree(probe_dir, ignore_errors=True)
+        for root, dirs, files in os.walk(src):
+            out_root = util.path_join(dst, os.path.relpath(root, src))
+            util.mkdir(out_root)
+            for fn in files:
+                f_path = util.path_join(root, fn)
+                out_path = util.path_join(out_root, fn)
+                copier.copy(f_path, out_path)
+                shutil.copystat(f_path, out_path)
+
+    def __aside(self, path):
+        """Return a new name next to path to move path out of the way
+        to.
+        """
+        aside = tempfile.mkdtemp(
+            prefix=os.path.basename(path) + ".old.",
+            dir=os.path.dirname(os.path.abspath(path)))
+        os.rmdir(aside)
+        return aside
+
+    def __staged_link_target(self, staging_dir):
+        """Return the directory the output directory symlink points to,
+        if it was made by a previous staged build.
+
+        Directories we didn't create ourselves are never deleted.
+        """
+        target = os.path.realpath(self.publish_dir)
+        if os.path.dirname(target) == \
+                os.path.dirname(os.path.realpath(staging_dir)) and \
+                os.path.basename(target).startswith(
+                    os.path.basename(self.publish_dir) + "."):
+            return target
+        return None
+
+    def __publish_rename(self, staging_dir):
+        """Replace the output directory with the staging directory.
+
+        Returns the directory holding the previous build, if any.
+        """
+        publish_dir = self.publish_dir
+        if os.path.islink(publish_dir):
+            old = self.__staged_link_target(staging_dir)
+            os.remove(publish_dir)
+        elif os.path.exists(publish_dir):
+            old = self.__aside(publish_dir)
+            os.rename(publish_dir, old)
+        else:
+            old = None
+        os.rename(staging_dir, publish_dir)
+        return old
+
+    def __publish_symlink(self, staging_dir):
+        """Atomically point the output directory symlink at the
+        staging directory.
+
+        Returns the directory holding the previous build, if it was
+        made by a previous staged build.
+        """
+        publish_dir = self.publish_dir
+        old = None
+        if os.path.islink(publish_dir):
+            old = self.__staged_link_target(staging_dir)
+        elif os.path.exists(publish_dir):
+            # A plain directory can't be atomically replaced by a
+            # symlink, so this first switch-over is two renames:
+            old = self.__aside(publish_dir)
+            os.rename(publish_dir, old)
+        link = self.__aside(publish_dir)
+        os.symlink(os.path.basename(staging_dir), link)
+        os.rename(link, publish_dir)
+        return old
+
+    def __publish_keep_inode(self, staging_dir):
+        """Move the contents of the staging directory into the output
+        directory, which retains its inode on the filesystem (some HTTP
+        servers need that.)
+
+        Returns the directory holding the previous contents.
+        """
+        publish_dir = self.publish_dir
+        util.mkdir(publish_dir)
+        old = tempfile.mkdtemp(
+            prefix=os.path.basename(publish_dir) + ".old.",
+            dir=os.path.dirname(staging_dir))
+        for f in os.listdir(publish_dir):
+            os.rename(util.path_join(publish_dir, f), util.path_join(old, f))
+        for f in os.listdir(staging_dir):
+            os.rename(util.path_join(staging_dir, f),
+                      util.path_join(publish_dir, f))
+        os.rmdir(staging_dir)
+        return old
 
     def __setup_temp_dir(self):
         """Create a directory for temporary data.
@@ -66,8 +317,127 @@ class Writer(object):
         "Cleanup and delete temporary directory"
         shutil.rmtree(self.temp_proc_dir)
 
+    def __load_manifest(self):
+        """Load the manifest of the previous build.
+
+        Only incremental builds use a manifest. A full build makes any
+        existing manifest obsolete, so it gets removed.
+        """
+        manifest_path = util.path_join(
+            self.config.site.cache_dir, "manifest.json")
+        if not self.incremental:
+            if os.path.isfile(manifest_path):
+                os.remove(manifest_path)
+            return
+        previous = manifest.Manifest.load(manifest_path)
+        if previous is None:
+            logger.info("No usable build manifest found, doing a full build")
+        self.manifest = manifest.Manifest(
+            manifest_path, previous, source_index=self.source_index)
+
+    def __save_manifest(self):
+        """Save the manifest for the next build, and the list of the
+        outputs this build recorded for the next synced build.
+        """
+        if self.manifest is not None:
+            self.manifest.save()
+            outputs = self.manifest.outputs
+        else:
+            outputs = self.written
+        recorded = manifest.Manifest(self.__recorded_outputs_path())
+        recorded.outputs = dict.fromkeys(outputs)
+        recorded.save()
+
+    def __recorded_outputs_path(self):
+        return util.path_join(self.config.site.cache_dir, "outputs.json")
+
+    def __remove_orphans(self):
+        """Delete the outputs recorded by the previous build that this
+        build did not produce.
+        """
+        if self.sync:
+            # Only outputs the previous build recorded are known to be
+            # Blogofile's; files controllers wrote without recording
+            # them are left alone:
+            previous = manifest.Manifest.load(self.__recorded_outputs_path())
+            if previous is None:
+                return
+            orphans = sorted(set(previous.outputs) - self.written)
+        elif self.manifest is not None:
+            orphans = self.manifest.orphans()
+        else:
+            return
+        for output in orphans:
+            self.__remove_output(output)
+
+    def __remove_output(self, output):
+        """Delete output, and the directories it leaves empty.
+        """
+        path = util.path_join(self.output_dir, output)
+        logger.debug("Removing stale output: " + path)
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        parent = os.path.dirname(path)
+        while os.path.normpath(parent) != os.path.normpath(self.output_dir):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+
+    def record_output(self, path, inputs=None):
+        """Record that path (relative to the output dir) is written by
+        this build.
+
+        inputs is a mapping of the source paths the output is built
+        from to their digests. When it's omitted, the inputs of the
+        template currently being materialized are used, if any. Outputs
+        without inputs are always rewritten.
+
+        Returns True if the location was already written earlier in
+        this build.
+        """
+        key = manifest.output_key(path)
+        reused = key in self.written
+        self.written.add(key)
+        if self.manifest is None:
+            if self.sync or self.worker:
+                return reused
+            return os.path.exists(util.path_join(self.output_dir, path))
+        if inputs is None:
+            inputs = self.__current_inputs
+        return self.manifest.record(path, inputs)
+
+    def __inputs(self, path, data=False):
+        """Return the inputs of an output built from the source path.
+
+        Template outputs also depend on the templates they inherit,
+        include or import, and on everything in the other underscore
+        directories (see manifest.data_digest.)
+        """
+        if self.manifest is None:
+            return None
+        inputs = {path: self.manifest.digest(path)}
+        if data:
+            inputs[manifest.DATA_INPUT] = self.data_digest
+            for dep in self.dependency_graph.dependencies(path):
+                if dep is None:
+                    inputs[manifest.TEMPLATES_INPUT] = manifest.tree_digest(
+                        self.manifest, [self.base_template_dir])
+                else:
+                    inputs[dep] = self.manifest.digest(dep)
+        return inputs
+
     def __setup_output_dir(self):
         """Setup the staging directory"""
+        if self.sync or (self.manifest is not None and
+                         self.manifest.previous is not None):
+            # Incremental build or sync, leave the previous outputs in
+            # place:
+            util.mkdir(self.output_dir)
+            return
         if os.path.isdir(self.output_dir):
             # I *would* just shutil.rmtree the whole thing and recreate it,
             # but I want the output_dir to retain its same inode on the
@@ -85,6 +455,22 @@ class Writer(object):
                     pass
         util.mkdir(self.output_dir)
 
+    def __setup_copy_strategy(self):
+        """Pick the way static files get copied to the output dir.
+        """
+        name = self.config.site.copy_strategy
+        if name:
+            try:
+                self.copier = filecopy.get_strategy(name)()
+            except ValueError as e:
+                raise exception.BuildError(str(e))
+        else:
+            # Probe from the cache dir, which is on the filesystem of
+            # the source files:
+            self.copier = filecopy.choose_strategy(
+                self.config.site.cache_dir, self.output_dir,
+                use_hard_links=self.config.site.use_hard_links)
+
     def __calculate_template_files(self):
         """Build a regex for template file paths"""
         endings = []
@@ -99,49 +485,171 @@ class Writer(object):
         Convert all templates to straight HTML.  Copy other
         non-template files directly.
         """
-        for root, dirs, files in os.walk("."):
-            if root.startswith("./"):
-                root = root[2:]
-            for d in list(dirs):
-                # Exclude some dirs
-                d_path = util.path_join(root, d)
-                if util.should_ignore_path(d_path):
-                    logger.debug("Ignoring directory: " + d_path)
-                    dirs.remove(d)
+        if self.manifest is not None:
+            output_top = self.publish_dir.split(os.sep)[0]
+            # Staged builds of the output dir sit next to it:
+            staged_dirs = [entry.name for entry in self.source_index.listdir()
+                           if entry.name.startswith(output_top + ".")]
+            self.data_digest = manifest.data_digest(
+                self.manifest, exclude=[
+                    output_top,
+                    self.config.site.cache_dir,
+                    self.base_template_dir] + staged_dirs)
+            self.dependency_graph = dependency.DependencyGraph()
+        # Templates to be materialized by the worker processes:
+        templates = []
+        # The walk skips ignored files and directories, and is in a
+        # stable order, so that parallel builds are deterministic:
+        for root, dirs, files in self.source_index.walk():
             try:
                 util.mkdir(util.path_join(self.output_dir, root))
             except OSError:
                 pass
             for t_fn in files:
                 t_fn_path = util.path_join(root, t_fn)
-                if util.should_ignore_path(t_fn_path):
-                    # Ignore this file.
-                    logger.debug("Ignoring file: " + t_fn_path)
-                    continue
-                elif self.template_file_regex.search(t_fn):
-                    logger.info("Processing template: " + t_fn_path)
-                    # Process this template file
-                    html_path = self.template_file_regex.sub("", t_fn)
-                    template.materialize_template(
-                        t_fn_path,
-                        util.path_join(root, html_path))
+                if self.template_file_regex.search(t_fn):
+                    html_path = util.path_join(
+                        root, self.template_file_regex.sub("", t_fn))
+                    inputs = self.__inputs(t_fn_path, data=True)
+                    if self.manifest is not None and \
+                            self.manifest.is_current(
+                                html_path, inputs, self.output_dir):
+                        logger.debug("Template unchanged: " + t_fn_path)
+                        continue
+                    templates.append((t_fn_path, html_path, inputs))
                 else:
                     # Copy this non-template file
                     f_path = util.path_join(root, t_fn)
+                    inputs = self.__inputs(f_path)
+                    if self.manifest is not None and \
+                            self.manifest.is_current(
+                                f_path, inputs, self.output_dir):
+                        logger.debug("File unchanged: " + f_path)
+                        continue
                     logger.debug("Copying file: " + f_path)
                     out_path = util.path_join(self.output_dir, f_path)
-                    if self.config.site.overwrite_warning and \
-                            os.path.exists(out_path):
+                    if self.record_output(f_path, inputs) and \
+                            self.config.site.overwrite_warning:
                         logger.warn("Location is used more than once: {0}"
                                     .format(f_path))
-                    if self.config.site.use_hard_links:
-                        # Try hardlinking first, and if that fails copy
-                        try:
-                            os.link(f_path, out_path)
-                        except Exception:
-                            shutil.copyfile(f_path, out_path)
-                    else:
-                        shutil.copyfile(f_path, out_path)
+                    if self.sync and self.__synced(f_path, out_path):
+                        logger.debug("File unchanged: " + f_path)
+                        continue
+                    if (self.manifest is not None or self.sync) and \
+                            os.path.lexists(out_path):
+                        # Don't write through a hard link from a
+                        # previous build into the source file:
+                        os.remove(out_path)
+                    self.copier.copy(f_path, out_path)
+                    if self.sync:
+                        # Give the copy the source's mtime, so the next
+                        # build can tell it's unchanged:
+                        st = os.stat(f_path)
+                        os.utime(out_path, (st.st_atime, st.st_mtime))
+        if self.jobs > 1:
+            self.__materialize_parallel(templates)
+        else:
+            self.__materialize_serial(templates)
+
+    def __synced(self, f_path, out_path):
+        """Is out_path an up to date copy of the static file f_path?
+
+        Files with the same size and mtime are considered the same.
+        With site.sync_compare_hash, files with the same size but a
+        different mtime are compared by their contents.
+        """
+        try:
+            out_st = os.stat(out_path)
+        except OSError:
+            return False
+        st = os.stat(f_path)
+        if st.st_size != out_st.st_size:
+            return False
+        if st.st_mtime == out_st.st_mtime:
+            return True
+        if self.config.site.sync_compare_hash and \
+                manifest.hash_file(f_path) == manifest.hash_file(out_path):
+            os.utime(out_path, (st.st_atime, st.st_mtime))
+            return True
+        return False
+
+    def materialize(self, t_fn_path, html_path, inputs=None):
+        """Materialize the template t_fn_path to html_path in the output
+        directory.
+        """
+        logger.info("Processing template: " + t_fn_path)
+        self.__current_inputs = inputs
+        try:
+            template.materialize_template(t_fn_path, html_path)
+        finally:
+            self.__current_inputs = None
+
+    def __materialize_serial(self, templates):
+        """Materialize templates in this process, in batches whose
+        filter templates get their filter chains run together.
+        """
+        batch_size = max(1, self.config.templates.get(
+            "filter_batch_size", 1) or 1)
+        for start in range(0, len(templates), batch_size):
+            batch = templates[start:start + batch_size]
+            if batch_size > 1:
+                template.prefilter_templates([t[0] for t in batch])
+            try:
+                for t in batch:
+                    self.materialize(*t)
+            finally:
+                template.FilterTemplate.prefiltered.clear()
+
+    def __materialize_parallel(self, templates):
+        """Materialize templates on a pool of worker processes.
+
+        The workers are forked from this process after the controllers
+        have run, so they each start with a copy of the bf cache, and
+        build their own template lookups. Results are processed in the
+        order the templates were found.
+        """
+        if not templates:
+            return
+        try:
+            context = multiprocessing.get_context("fork")
+        except (AttributeError, ValueError):
+            # No get_context before Python 3.4, no fork on Windows:
+            logger.warn("Parallel builds need the fork start method of "
+                        "multiprocessing, materializing templates serially")
+            self.__materialize_serial(templates)
+            return
+        jobs = min(self.jobs, len(templates))
+        logger.info("Materializing {0} templates with {1} processes"
+                    .format(len(templates), jobs))
+        pool = context.Pool(jobs)
+        try:
+            results = pool.imap(_materialize_in_worker, templates,
+                                max(1, len(templates) // (jobs * 4)))
+            for (t_fn_path, html_path, inputs), \
+                    (outputs, written, timings, error) \
+                    in zip(templates, results):
+                timing.timer.merge(timings)
+                if error is not None:
+                    logger.error("Error rendering template: {0}\n{1}"
+                                 .format(t_fn_path, error))
+                    raise exception.BuildError(
+                        "Error rendering template: {0}".format(t_fn_path))
+                # Outputs the template wrote more than once were
+                # reported by the worker; this finds the ones written
+                # earlier in the build, by controllers or other
+                # templates:
+                reused = sorted(self.written.intersection(written))
+                if self.manifest is not None:
+                    for output, output_inputs in sorted(outputs.items()):
+                        self.manifest.record(output, output_inputs)
+                if self.config.site.overwrite_warning:
+                    for output in reused:
+                        logger.warn("Location is used more than once: {0}"
+                                    .format(output))
+                self.written.update(written)
+        finally:
+            pool.terminate()
+            pool.join()
 
     def __init_plugins(self):
         # Run plugin defined init methods
@@ -152,6 +660,88 @@ class Writer(object):
         _filter.init_filters()
         controller.init_controllers(namespace=self.bf.config.controllers)
 
+    def __setup_filter_cache(self):
+        size = self.config.site.get("filter_cache_size", 0)
+        if size:
+            _filter.result_cache = filtercache.FilterCache(
+                os.path.abspath(util.path_join(
+                    self.config.site.cache_dir, "filters")), size)
+        else:
+            _filter.result_cache = None
+
+    def __setup_unit_cache(self):
+        if self.config.site.get("controller_cache", False):
+            self.units = unitcache.UnitCache(
+                os.path.abspath(util.path_join(
+                    self.config.site.cache_dir, "units")), self.output_dir)
+        else:
+            self.units = None
+
+    def run_unit(self, name, run, inputs=(), config=(), outputs=()):
+        """Run a controller's unit of work, unless what it depends on is
+        unchanged since the last build, in which case the outputs it
+        wrote then are put back in the output directory.
+
+        inputs are source files or directories, config dotted names of
+        bf.config settings, and outputs files or directories in the
+        output directory (see unitcache.py.) Returns True if the unit
+        was run.
+        """
+        if self.units is None:
+            self.__remove_unit_outputs(outputs)
+            run()
+            for path in unitcache.output_files(self.output_dir, outputs):
+                self.record_output(path)
+            return True
+        key = self.units.key(name, inputs, config, outputs)
+        record = self.units.load(name)
+        if record is not None and record.get("key") == key:
+            restored = self.units.restore(name, record)
+            if restored is not None:
+                logger.debug("Unit unchanged: " + name)
+                for path in restored:
+                    self.record_output(path)
+                return False
+        self.__remove_unit_outputs(
+            outputs, record["files"] if record is not None else ())
+        run()
+        files = unitcache.output_files(self.output_dir, outputs)
+        for path in files:
+            self.record_output(path)
+        self.units.save(name, key, files)
+        return True
+
+    def __remove_unit_outputs(self, outputs, previous=()):
+        """Delete what a unit wrote in an earlier build, so it's run on
+        an empty output like in a full build.
+
+        outputs are the unit's declared outputs and previous the files
+        it recorded the last time it was run. Files written earlier in
+        this build are kept.
+        """
+        stale = set(unitcache.output_files(self.output_dir, outputs))
+        stale.update(previous)
+        for path in sorted(stale):
+            if manifest.output_key(path) not in self.written:
+                self.__remove_output(path)
+        for output in outputs:
+            # Empty directories left in the declared outputs:
+            path = util.path_join(self.output_dir, output)
+            for dirpath, dirnames, filenames in os.walk(path, False):
+                try:
+                    os.rmdir(dirpath)
+                except OSError:
+                    pass
+
+    def __prune_filter_cache(self):
+        result_cache = _filter.result_cache
+        if result_cache is None:
+            return
+        _filter.result_cache = None
+        size = result_cache.prune()
+        logger.debug("Filter cache: {0} hits, {1} misses, {2} bytes".format(
+            result_cache.hits, result_cache.misses, size))
+
     def __run_controllers(self):
         """Run all the controllers in the _controllers directory.
         """
@@ -159,4 +749,28 @@ class Writer(object):
         for plugin in list(self.bf.config.plugins.values()):
             if plugin.enabled:
                 namespaces.append(plugin)
-        controller.run_all(namespaces)
+        controller.run_all(
+            namespaces, threads=self.config.site.get("controller_threads", 1))
+
+
+def _materialize_in_worker(work):
+    """Materialize a template in a build worker process.
+
+    Returns the outputs recorded in the manifest while materializing
+    it (empty for full builds), the paths it wrote, the timings
+    recorded for --profile, and the formatted traceback if it failed.
+    """
+    writer = cache.bf.writer
+    # The parent process merges the outputs into the real manifest,
+    # and the timings into its timer:
+    if writer.manifest is not None:
+        writer.manifest.outputs = {}
+    writer.written = set()
+    writer.worker = True
+    timing.timer.records = {}
+    try:
+        writer.materialize(*work)
+    except Exception:
+        return {}, [], timing.timer.records, traceback.format_exc()
+    outputs = {} if writer.manifest is None else writer.manifest.outputs
+    return outputs, sorted(writer.written), timing.timer.records, None